@@ -0,0 +1,175 @@
+import time
+import random
+import numpy as np
+import pandas as pd
+import Grade_Cleaner as grade_cleaner
+import Location_Cleaner as location_cleaner
+import Rating_Consensus as rating_consensus
+
+### CONFIGURATION ###
+
+# Number of synthetic routes to benchmark
+ROUTE_COUNT = 250000
+
+# The row-at-a-time reference is too slow for the full set, so it runs on a sample and is extrapolated
+LEGACY_SAMPLE = 5000
+
+RANDOM_SEED = 42
+
+
+### FUNCTIONS ###
+
+# Build long_grade strings shaped like the scraped ones (YDS/V grade, conversions, optional danger)
+def synthetic_long_grades(cat_df, count, seed=RANDOM_SEED):
+    rng = random.Random(seed)
+    rock = cat_df['Rock'].dropna().tolist()
+    boulder = cat_df['Boulder'].dropna().tolist()
+    aid = cat_df['Aid'].dropna().tolist()
+    ice = cat_df['Ice'].dropna().tolist()
+    mixed = cat_df['Mixed'].dropna().tolist()
+    snow = cat_df['Snow'].dropna().tolist()
+    danger = cat_df['Danger'].dropna().tolist()
+
+    long_grades = []
+    for _ in range(count):
+        parts = []
+        if rng.random() < 0.85:
+            parts.append(f'{rng.choice(rock)} YDS 6a French 19 Ewbanks VI+ UIAA 18 ZA HVS 4c British')
+        if rng.random() < 0.2:
+            parts.append(f'{rng.choice(boulder)} YDS 6A Font')
+        if rng.random() < 0.05:
+            parts.append(rng.choice(aid))
+        if rng.random() < 0.05:
+            parts.append(f'{rng.choice(ice)} {rng.choice(mixed)}')
+        if rng.random() < 0.03:
+            parts.append(rng.choice(snow))
+        if rng.random() < 0.1:
+            parts.append(rng.choice(danger))
+        if not parts:
+            parts.append(rng.choice(rock))
+        long_grades.append(' '.join(parts))
+
+    return pd.DataFrame({'page_id': range(count), 'long_grade': long_grades})
+
+
+# Compare the vectorised grade classifier with the row-at-a-time reference
+def benchmark_grades(route_count=ROUTE_COUNT, legacy_sample=LEGACY_SAMPLE):
+    cat_df = pd.read_csv('grade_categories.csv')
+    columns = grade_cleaner.GRADE_COLUMNS
+    grades_df = synthetic_long_grades(cat_df, route_count)
+    grade_cleaner.long_grade_cleanup(grades_df)
+
+    start_time = time.perf_counter()
+    matchers = grade_cleaner.compile_matchers(cat_df)
+    classified = grade_cleaner.classify_grades(grades_df['long_grade'], matchers)
+    vectorised_time = time.perf_counter() - start_time
+
+    sample_df = grades_df.iloc[:legacy_sample].copy()
+    for col in columns:
+        sample_df[col] = ''
+    start_time = time.perf_counter()
+    sample_df.apply(lambda row: grade_cleaner.process_row(row.name, row, sample_df, columns, cat_df), axis=1)
+    legacy_time = (time.perf_counter() - start_time) * route_count / legacy_sample
+
+    identical = bool((sample_df[columns].to_numpy() == classified.iloc[:legacy_sample][columns].to_numpy()).all())
+
+    print(f'Grade classification, {route_count} routes')
+    print(f'  vectorised: {vectorised_time:.2f}s')
+    print(f'  row-at-a-time (extrapolated from {legacy_sample}): {legacy_time:.2f}s')
+    print(f'  speedup: {legacy_time / vectorised_time:.1f}x, identical output: {identical}')
+
+    return identical
+
+
+# Build location strings shaped like the scraped ones, from a pool of a few thousand areas
+def synthetic_locations(count, seed=RANDOM_SEED, distinct=5000):
+    rng = random.Random(seed)
+    states = ['Colorado', 'Kentucky', 'Utah', 'California', 'Nevada', 'West Virginia', 'Wyoming']
+    continents = {'Europe': ['France', 'Spain', 'Italy'], 'Asia': ['Thailand', 'China'], 'Oceania': ['Australia']}
+
+    pool = []
+    for i in range(distinct):
+        areas = [f'Area {i % 97}', f'Crag {i % 389}', f'Wall {i}'][:rng.randint(1, 3)]
+        areas.extend(f'Sector {depth}' for depth in range(rng.choice([0, 0, 0, 2, 8])))
+        if rng.random() < 0.2:
+            continent = rng.choice(list(continents))
+            pool.append(' > '.join(['International', continent, rng.choice(continents[continent])] + areas))
+        else:
+            pool.append(' > '.join([rng.choice(states)] + areas))
+
+    return pd.Series([rng.choice(pool) for _ in range(count)], dtype=object)
+
+
+# Compare the vectorised location split with apply(location_cleaner).apply(pd.Series)
+def benchmark_locations(route_count=ROUTE_COUNT, legacy_sample=LEGACY_SAMPLE * 10):
+    locations = synthetic_locations(route_count)
+    columns = location_cleaner.LOCATION_COLUMNS
+
+    start_time = time.perf_counter()
+    codes, uniques = pd.factorize(locations)
+    distinct_df = location_cleaner.split_locations(pd.Series(uniques, dtype=object))
+    split_df = distinct_df.iloc[codes].reset_index(drop=True)
+    summary = location_cleaner.describe_locations(distinct_df, np.bincount(codes, minlength=len(uniques)))
+    vectorised_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    direct_df = location_cleaner.split_locations(locations)
+    direct_time = time.perf_counter() - start_time
+
+    sample = locations.iloc[:legacy_sample]
+    start_time = time.perf_counter()
+    legacy_df = sample.apply(location_cleaner.location_cleaner).apply(pd.Series)
+    legacy_df.columns = columns
+    legacy_summary = legacy_df.describe(include='all')
+    legacy_time = (time.perf_counter() - start_time) * route_count / legacy_sample
+
+    legacy_values = legacy_df.astype(object).where(legacy_df.notna(), None).to_numpy()
+    identical = bool((legacy_values == split_df.iloc[:legacy_sample].to_numpy()).all()
+                     and (legacy_values == direct_df.iloc[:legacy_sample].to_numpy()).all())
+    full_summary = pd.DataFrame(split_df).describe(include='all')
+    summary_matches = bool((full_summary.loc[['count', 'unique', 'freq']].astype(int).to_numpy() ==
+                            summary.loc[['count', 'unique', 'freq']].astype(int).to_numpy()).all())
+
+    print(f'Location split, {route_count} routes ({len(uniques)} distinct)')
+    print(f'  vectorised on distinct values + describe: {vectorised_time:.2f}s')
+    print(f'  vectorised on every row: {direct_time:.2f}s')
+    print(f'  apply(pd.Series) + describe (extrapolated from {legacy_sample}): {legacy_time:.2f}s')
+    print(f'  identical output: {identical}, describe matches: {summary_matches}')
+
+    return identical and summary_matches
+
+
+# Every grade category, listed on a route and voted for unanimously in its raw spelling, must have a spread of 0
+def check_consensus(votes_per_route=3):
+    cat_df = pd.read_csv('grade_categories.csv')
+    grade_order = grade_cleaner.load_grade_order()
+    type_starts = rating_consensus.load_type_starts(grade_order)
+    labels = rating_consensus.order_labels(grade_order)
+
+    listed_rows = []
+    rating_rows = []
+    for col in grade_cleaner.GRADE_COLUMNS:
+        for grade in cat_df[col].dropna():
+            page_id = len(listed_rows) + 1
+            listed_rows.append((page_id, col, grade_order[grade_cleaner.clean_grade(grade)]))
+            rating_rows.extend([(page_id, grade)] * votes_per_route)
+    listed = pd.DataFrame(listed_rows, columns=['page_id', 'Type', 'Grade_Order'])
+    ratings = pd.DataFrame(rating_rows, columns=['page_id', 'allRatings'])
+
+    votes = rating_consensus.parse_ratings(ratings, grade_order, type_starts)
+    consensus = rating_consensus.aggregate_ratings(votes, listed, labels)['rating_consensus']
+    unanimous = bool(len(consensus) == len(listed) and (consensus['spread'] == 0).all())
+
+    print(f'Rating consensus, {len(listed)} unanimously voted grades')
+    print(f'  spread 0 for every listed grade: {unanimous}')
+    if not unanimous:
+        print(consensus[consensus['spread'] != 0].to_string())
+
+    return unanimous
+
+
+### Run ###
+if __name__ == '__main__':
+    benchmark_grades()
+    benchmark_locations()
+    check_consensus()
@@ -0,0 +1,95 @@
+import math
+import time
+import threading
+
+### CONFIGURATION ###
+
+# Weight given to each new latency sample in the moving average
+LATENCY_SMOOTHING = 0.2
+
+# Extra in-flight requests kept on top of Little's law to absorb latency spikes
+HEADROOM = 1.25
+
+
+### CLASSES ###
+
+# Sets the number of in-flight requests from measured latency and the allowed request rate.
+# Little's law: in_flight = arrival_rate * latency, so a rate of 2 calls/s at 3 s per call needs 6 workers
+class ConcurrencyController:
+    def __init__(self, calls_per_period, time_period, min_workers=1, max_workers=32,
+                 initial_latency=1.0, smoothing=LATENCY_SMOOTHING, headroom=HEADROOM):
+        self.rate = calls_per_period / time_period
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.smoothing = smoothing
+        self.headroom = headroom
+
+        self.latency = initial_latency
+        self.limit = self._target_limit()
+        self.in_flight = 0
+        self.completed = 0
+        self.busy_time = 0.0
+        self.started_at = time.time()
+        self.ended_at = None
+        self._condition = threading.Condition()
+
+    # Number of workers Little's law asks for at the current latency estimate
+    def _target_limit(self):
+        target = math.ceil(self.rate * self.latency * self.headroom)
+        return max(self.min_workers, min(self.max_workers, target))
+
+    # Block until a slot is free under the current limit
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    # Free a slot and wake any waiting workers (the limit may have grown)
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    # Record how long one request took and resize the pool from the new estimate
+    def observe(self, latency):
+        with self._condition:
+            self.latency = (1 - self.smoothing) * self.latency + self.smoothing * latency
+            self.completed += 1
+            self.busy_time += latency
+            self.limit = self._target_limit()
+            self._condition.notify_all()
+
+    # Start a new measurement window, so time spent outside the requests (e.g. writing a batch) isn't
+    # counted as idle workers
+    def reset_window(self):
+        with self._condition:
+            self.completed = 0
+            self.busy_time = 0.0
+            self.started_at = time.time()
+            self.ended_at = None
+
+    # Close the window once the requests it covers are done, metrics() then reports over that span
+    def end_window(self):
+        with self._condition:
+            self.ended_at = time.time()
+
+    # Run func inside a slot so callers can submit straight to an executor
+    def run(self, func, *args, **kwargs):
+        self.acquire()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.release()
+
+    # Snapshot of the controller state for logging
+    def metrics(self):
+        with self._condition:
+            ended_at = self.ended_at if self.ended_at is not None else time.time()
+            elapsed = max(ended_at - self.started_at, 1e-9)
+            return {'concurrency': self.limit,
+                    'in_flight': self.in_flight,
+                    'latency': round(self.latency, 3),
+                    'utilisation': round(self.busy_time / (elapsed * self.limit), 3),
+                    'rate_utilisation': round(self.completed / elapsed / self.rate, 3),
+                    'completed': self.completed}
@@ -0,0 +1,123 @@
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from decouple import config
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import URL
+
+### CONFIGURATION ###
+
+# MySQL Database Configuration, not needed when DATABASE_URL is set
+DB_CONFIG = {
+    "host": config('AWS_HOST', default=''),
+    "user": config('AWS_USERNAME', default=''),
+    "password": config('AWS_MASTER_PASSWORD', default=''),
+    "database": config('AWS_DATABASE', default='')}
+
+# Full SQLAlchemy URL that overrides DB_CONFIG (e.g. a local database for load tests)
+DATABASE_URL = config('DATABASE_URL', default='')
+
+# Connection pool shared by every script (and every thread within one)
+POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=20, cast=int)
+POOL_RECYCLE = 3600  # seconds, stays under MySQL's wait_timeout
+
+# Rows per multi-row INSERT statement written by insert_frame
+INSERT_CHUNK_SIZE = 1000
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+### FUNCTIONS ###
+
+# Build the connection URL, URL.create escapes special characters in the password
+def database_url():
+    if DATABASE_URL:
+        return DATABASE_URL
+
+    missing = [name for name, value in DB_CONFIG.items() if not value and name != 'password']
+    if missing:
+        raise ValueError(f'Missing database settings {missing}, set the AWS_* variables or DATABASE_URL')
+
+    return URL.create('mysql+mysqlconnector', username=DB_CONFIG['user'], password=DB_CONFIG['password'],
+                      host=DB_CONFIG['host'], database=DB_CONFIG['database'])
+
+
+# The process-wide pooled engine, created on first use
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(database_url(), pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                                    pool_pre_ping=True, pool_recycle=POOL_RECYCLE)
+            logging.info(f'Created database engine at {datetime.datetime.now()}')
+
+    return _engine
+
+
+# Check out a SQLAlchemy connection from the pool
+def connect_to_db():
+    try:
+        conn = get_engine().connect()
+        logging.info(f'Connected to database at {datetime.datetime.now()}')
+
+        return conn
+
+    except Exception as e:
+        logging.error(f'Error connecting to database: {e}', exc_info=True)
+        raise
+
+
+# Pooled DBAPI connection for scripts that work with cursors directly, returned to the pool on exit
+@contextmanager
+def connect_raw():
+    conn = get_engine().raw_connection()
+    logging.info(f'Connected to database at {datetime.datetime.now()}')
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# Thread-safe transactional checkout for concurrent writers: commits on success, rolls back on error
+@contextmanager
+def checkout():
+    with get_engine().begin() as conn:
+        yield conn
+
+
+# Append a DataFrame with multi-row INSERTs
+def insert_frame(df, table_name, conn, method='multi', chunksize=INSERT_CHUNK_SIZE, index=False, **kwargs):
+    return df.to_sql(name=table_name, con=conn, if_exists='append', index=index, method=method,
+                     chunksize=chunksize, **kwargs)
+
+
+# Create the table recording when each incremental stage last ran
+def create_runs_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS pipeline_runs (
+            stage VARCHAR(64) PRIMARY KEY,
+            last_run DATE
+        )
+    """))
+    conn.commit()
+
+
+# Get the date a stage last finished (None if it has never run)
+def get_last_run(conn, stage):
+    create_runs_table(conn)
+    row = conn.execute(text('SELECT last_run FROM pipeline_runs WHERE stage = :stage'),
+                       {'stage': stage}).fetchone()
+
+    return row[0] if row else None
+
+
+# Record the date a stage started so the next run picks up anything changed from then on
+def set_last_run(conn, stage, run_date):
+    conn.execute(text("""
+        INSERT INTO pipeline_runs (stage, last_run) VALUES (:stage, :last_run)
+        ON DUPLICATE KEY UPDATE last_run = VALUES(last_run)
+    """), {'stage': stage, 'last_run': run_date})
+    conn.commit()
@@ -0,0 +1,292 @@
+import re
+import json
+import time
+import random
+import logging
+import datetime
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+### CONFIGURATION ###
+
+# Where the stand-in server listens (port 0 picks a free port)
+HOST = '127.0.0.1'
+PORT = 8080
+
+# Size of the synthetic site
+ROUTE_COUNT = 5000
+SITEMAP_SIZE = 1000  # urls per route sitemap
+FIRST_PAGE_ID = 105700001
+API_PAGE_SIZE = 250  # items per /api/v2 page
+
+# Stats per route follow a long-tailed distribution, a few popular routes have thousands of ticks
+STAT_SCALE = {'stars': 8, 'ticks': 15, 'todos': 6, 'ratings': 4}
+
+# Behaviour of the server
+LATENCY = 0.05  # mean seconds per response
+ERROR_RATE = 0.0  # share of responses that are a 500
+THROTTLE_RATE = 0.0  # share of responses that are a 429
+CHANGE_RATE = 0.1  # share of routes updated each time the site advances a generation
+
+RANDOM_SEED = 42
+
+STATES = ['Colorado', 'Utah', 'California', 'Kentucky', 'Nevada', 'West Virginia', 'Wyoming', 'Washington']
+ROUTE_TYPES = ['Trad', 'Sport', 'TR', 'Alpine', 'Aid', 'Boulder']
+GRADES = ['5.6', '5.7', '5.8', '5.9', '5.10a', '5.10b', '5.10c', '5.10d', '5.11a', '5.11b', '5.11c', '5.11d',
+          '5.12a', '5.12b', '5.12c', '5.13a']
+STYLES = [('Lead', 'Onsight'), ('Lead', 'Flash'), ('Lead', 'Redpoint'), ('Lead', 'Fell/Hung'), ('TR', ''),
+          ('Follow', ''), ('Solo', '')]
+WORDS = ['crack', 'face', 'crux', 'bolt', 'anchor', 'ledge', 'roof', 'slab', 'corner', 'pitch', 'gear', 'rap',
+         'chimney', 'jug', 'crimp', 'arete', 'dihedral', 'traverse', 'belay', 'approach', 'trail', 'left', 'right']
+
+PAGE_PATTERN = re.compile(r'^/route/(\d+)/')
+API_PATTERN = re.compile(r'^/api/v2/routes/(\d+)/(stars|ticks|todos|ratings)$')
+SITEMAP_PATTERN = re.compile(r'^/sitemaps/routes-(\d+)\.xml$')
+
+
+### FUNCTIONS ###
+
+# Same seed, same route, so every request for a page sees the same data until the route changes
+def route_random(seed, page_id, *salt):
+    return random.Random(f'{seed}-{page_id}-' + '-'.join(str(value) for value in salt))
+
+
+def sentence(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + '.'
+
+
+def api_user(rng):
+    roll = rng.random()
+    if roll < 0.03:
+        return None
+    if roll < 0.05:
+        return False
+
+    return {'id': rng.randint(1, 200000), 'name': f'Climber {rng.randint(1, 20000)}'}
+
+
+def api_date(rng, start=datetime.date(2005, 1, 1), days=6500):
+    return (start + datetime.timedelta(days=rng.randrange(days))).isoformat()
+
+
+# One item of a stats list, shaped like the fields Stats_Grabber writes. Ids are unique per stat like the site's
+def api_item(rng, stat, grade, item_id):
+    item = {'id': item_id, 'createdAt': api_date(rng), 'updatedAt': api_date(rng)}
+    user = api_user(rng)
+    if user is not None:
+        item['user'] = user
+
+    if stat == 'stars':
+        item['score'] = str(rng.randint(0, 4))
+    elif stat == 'ticks':
+        style, lead_style = rng.choice(STYLES)
+        item.update({'date': api_date(rng), 'style': style, 'leadStyle': lead_style, 'pitches': rng.randint(1, 3),
+                     'text': f'{api_date(rng)} &middot; {style}. {sentence(rng, 0, 8)}', 'comment': None})
+    elif stat == 'ratings':
+        rating = rng.choice(GRADES[max(GRADES.index(grade) - 2, 0):GRADES.index(grade) + 3])
+        item.update({'allRatings': [rating], 'rockRating': rating, 'iceRating': None, 'aidRating': None,
+                     'boulderRating': None, 'mixedRating': None, 'snowRating': None,
+                     'safteyRating': rng.choice([None, None, 'PG13', 'R'])})
+
+    return item
+
+
+### CLASSES ###
+
+# Synthetic Mountain Project: sitemaps, route pages with the markup Route_Grabber parses, and the
+# paginated /api/v2/routes/{id}/{stat} JSON. advance() moves the site on a generation, updating
+# CHANGE_RATE of the routes so incremental runs have something to pick up
+class FakeMPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host=HOST, port=PORT, route_count=ROUTE_COUNT, latency=LATENCY, error_rate=ERROR_RATE,
+                 throttle_rate=THROTTLE_RATE, change_rate=CHANGE_RATE, seed=RANDOM_SEED):
+        super().__init__((host, port), FakeMPHandler)
+        self.route_count = route_count
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.change_rate = change_rate
+        self.seed = seed
+        self.generation = 0
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    @property
+    def base_url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='fake-mp-server', daemon=True)
+        thread.start()
+        logging.info(f'Fake Mountain Project server listening on {self.base_url}')
+
+        return self
+
+    def advance(self):
+        self.generation += 1
+
+    def page_ids(self):
+        return range(FIRST_PAGE_ID, FIRST_PAGE_ID + self.route_count)
+
+    def count_request(self, kind, status):
+        with self._lock:
+            self.requests[(kind, status)] += 1
+
+    # Simulated latency and failures, returns the status the response should have
+    def roll_response(self):
+        with self._lock:
+            delay = self._rng.expovariate(1 / self.latency) if self.latency > 0 else 0
+            roll = self._rng.random()
+        time.sleep(delay)
+
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+
+        return 200
+
+    # Latest generation a route changed in, 0 if it hasn't changed since the site was created
+    def route_generation(self, page_id):
+        for generation in range(self.generation, 0, -1):
+            if route_random(self.seed, page_id, 'change', generation).random() < self.change_rate:
+                return generation
+
+        return 0
+
+    def last_update(self, page_id):
+        base = datetime.date(2023, 1, 1) + datetime.timedelta(days=page_id % 300)
+        return (base + datetime.timedelta(days=self.route_generation(page_id))).isoformat()
+
+    def route_url(self, page_id):
+        return f'{self.base_url}/route/{page_id}/synthetic-route-{page_id}'
+
+    def sitemap_index(self):
+        sitemaps = [f'{self.base_url}/sitemaps/pages.xml']
+        sitemaps += [f'{self.base_url}/sitemaps/routes-{i}.xml' for i in range(0, self.route_count, SITEMAP_SIZE)]
+        entries = ''.join(f'<sitemap><loc>{loc}</loc></sitemap>' for loc in sitemaps)
+
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex>{entries}</sitemapindex>'
+
+    def route_sitemap(self, start):
+        page_ids = self.page_ids()[start:start + SITEMAP_SIZE]
+        entries = ''.join(f'<url><loc>{self.route_url(page_id)}</loc><lastmod>{self.last_update(page_id)}</lastmod>'
+                          f'</url>' for page_id in page_ids)
+
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset>{entries}</urlset>'
+
+    def route_grade(self, page_id):
+        return route_random(self.seed, page_id, 'grade').choice(GRADES)
+
+    # Route page with the same elements Route_Grabber looks for
+    def route_page(self, page_id):
+        rng = route_random(self.seed, page_id, 'page', self.route_generation(page_id))
+        static = route_random(self.seed, page_id, 'static')
+        grade = self.route_grade(page_id)
+
+        state = static.choice(STATES)
+        areas = [f'{state} Area {static.randint(1, 40)}', f'Crag {static.randint(1, 400)}']
+        areas += [f'Wall {static.randint(1, 2000)}'] * static.randint(0, 1)
+        location_links = ''.join(f'<a href="#">{name}</a> &gt; ' for name in ['All Locations', state] + areas)
+
+        route_types = static.sample(ROUTE_TYPES, static.randint(1, 2))
+        pitches = static.choice([1, 1, 1, 2, 3, 5])
+        feet = static.randint(20, 200) * pitches
+        route_type = f'{", ".join(route_types)}, {feet} ft ({round(feet * 0.3048)} m)'
+        if pitches > 1:
+            route_type += f', {pitches} pitches'
+        if 'Sport' in route_types:
+            route_type += f'Fixed Hardware ({static.randint(3, 15)})'
+
+        stars = round(rng.uniform(1, 4), 1)
+        votes = rng.randint(1, 500)
+        views = rng.randint(100, 100000)
+        added = datetime.date(2005, 1, 1) + datetime.timedelta(days=static.randrange(6500))
+        geo = json.dumps({'@context': 'https://schema.org', '@type': 'Place',
+                          'geo': {'latitude': round(static.uniform(33, 48), 5),
+                                  'longitude': round(static.uniform(-122, -80), 5)}})
+        sections = ''.join(f'<h2 class="mt-2">{title}</h2><div class="fr-view">{sentence(rng, 10, 120)}</div>'
+                           for title in ['Description', 'Location', 'Protection'])
+
+        return f'''<!DOCTYPE html><html><head><script type="application/ld+json">{geo}</script></head><body>
+<h1>Synthetic Route {page_id}</h1>
+<h2 class="inline-block mr-2">{grade} YDS 6a French 19 Ewbanks</h2>
+<span id="starsWithAvgText-{page_id}">Avg: {stars} from {votes:,} votes</span>
+<div class="mb-half small text-warm">{location_links}</div>
+<table>
+<tr><td>Type:</td><td>{route_type}</td></tr>
+<tr><td>FA:</td><td>Synthetic Party {static.randint(1, 999)}</td></tr>
+<tr><td>Page Views:</td><td>{views:,} total · {max(views // 100, 1)}/month</td></tr>
+<tr><td>Shared By:</td><td>Climber {static.randint(1, 20000)} on {added.strftime('%b %-d, %Y')}·Updates</td></tr>
+</table>
+{sections}
+</body></html>'''
+
+    # One page of a route's stats, the item count is fixed per route so the totals add up
+    def api_page(self, page_id, stat, page):
+        scale = STAT_SCALE[stat]
+        total = min(int(route_random(self.seed, page_id, 'count', stat).paretovariate(1.2) * scale) - scale, 2000)
+        last_page = max((total + API_PAGE_SIZE - 1) // API_PAGE_SIZE, 1)
+        grade = self.route_grade(page_id)
+
+        start = (page - 1) * API_PAGE_SIZE
+        data = [api_item(route_random(self.seed, page_id, stat, i), stat, grade, page_id * 10 ** 6 + i)
+                for i in range(start, min(start + API_PAGE_SIZE, total))]
+
+        return json.dumps({'data': data, 'total': total, 'current_page': page, 'last_page': last_page})
+
+
+# Routes requests to the FakeMPServer generators
+class FakeMPHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, kind, status, body='', content_type='text/html'):
+        self.server.count_request(kind, status)
+        encoded = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        server = self.server
+
+        if path == '/sitemap.xml':
+            return self.send('sitemap', 200, server.sitemap_index(), 'application/xml')
+        if path == '/sitemaps/pages.xml':
+            return self.send('sitemap', 200, '<?xml version="1.0" encoding="UTF-8"?><urlset></urlset>',
+                             'application/xml')
+        match = SITEMAP_PATTERN.match(path)
+        if match:
+            return self.send('sitemap', 200, server.route_sitemap(int(match.group(1))), 'application/xml')
+
+        page_match = PAGE_PATTERN.match(path)
+        api_match = API_PATTERN.match(path)
+        kind = 'route' if page_match else 'api' if api_match else 'other'
+        page_id = int((page_match or api_match).group(1)) if kind != 'other' else None
+        if page_id is None or page_id not in server.page_ids():
+            return self.send(kind, 404, 'Not Found')
+
+        status = server.roll_response()
+        if status != 200:
+            return self.send(kind, status, 'Too Many Requests' if status == 429 else 'Server Error')
+
+        if kind == 'route':
+            return self.send(kind, 200, server.route_page(page_id))
+
+        page = int(dict(part.split('=', 1) for part in query.split('&') if '=' in part).get('page', 1))
+        return self.send(kind, 200, server.api_page(page_id, api_match.group(2), page), 'application/json')
+
+
+### Run ###
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fake_server = FakeMPServer()
+    print(f'Serving {fake_server.route_count} synthetic routes at {fake_server.base_url}/sitemap.xml')
+    fake_server.serve_forever()
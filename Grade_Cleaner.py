@@ -2,8 +2,9 @@ import os
 import logging
 import datetime
 import pandas as pd
-from decouple import config
-from sqlalchemy import create_engine
+from sqlalchemy import text, bindparam
+import Database as database
+from Normalization_Cache import NormalizationCache, file_fingerprint
 
 ### CONFIGURATION ###
 
@@ -11,12 +12,13 @@ from sqlalchemy import create_engine
 LOG_FOLDER = 'log_files'
 LOG_FILENAME = f'Logfile - Grade Cleanup ({datetime.date.today()}).log'
 
-# MySQL Database Configuration
-DB_CONFIG = {
-    "host": config('AWS_HOST'),
-    "user": config('AWS_USERNAME'),
-    "password": config('AWS_MASTER_PASSWORD'),
-    "database": config('AWS_DATABASE')}
+# Only re-classify routes scraped since the last run (False rebuilds every route)
+INCREMENTAL = True
+STAGE_NAME = 'grade_cleaner'
+DELETE_BATCH_SIZE = 1000
+
+# Grade columns in the order they appear in grade_categories.csv
+GRADE_COLUMNS = ['Rock', 'Boulder', 'Aid', 'Ice', 'Mixed', 'Snow', 'Danger']
 
 
 ### FUNCTIONS ###
@@ -34,32 +36,54 @@ def setup_logging():
         print(f'Error creating log folder: {e}')
 
 
-# Create MySQL database connection
-def connect_to_db():
+# Create route_grades. A route_grades from before grade ordinals gets the Grade_Order column here, and
+# True is returned so main backfills the existing rows once grade_order is written
+def create_tables(conn):
     try:
-        # Create an SQLAlchemy engine
-        engine = create_engine(
-            f"mysql+mysqlconnector://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}")
-
-        # Connect to the engine and return it
-        conn = engine.connect()
-        logging.info(f'Connected to database at {datetime.datetime.now()}')
-
-        return conn
+        create_table_query = text("""
+            CREATE TABLE IF NOT EXISTS route_grades (
+                page_id INT,
+                Type VARCHAR(16),
+                Grade VARCHAR(32),
+                Grade_Order INT,
+                PRIMARY KEY (page_id, Type),
+                INDEX type_order_idx (Type, Grade_Order)
+            )
+        """)
+        conn.execute(create_table_query)
+
+        has_order = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'route_grades' AND column_name = 'Grade_Order'
+        """)).fetchone()[0]
+        if has_order == 0:
+            conn.execute(text('ALTER TABLE route_grades ADD COLUMN Grade_Order INT, '
+                              'ADD INDEX type_order_idx (Type, Grade_Order)'))
+            logging.info('Added Grade_Order to route_grades')
+        conn.commit()
+
+        return has_order == 0
 
     except Exception as e:
-        logging.error(f'Error connecting to database: {e}', exc_info=True)
-
-    return None
+        logging.error(f'Error creating tables: {e}', exc_info=True)
+        raise
 
 
-# Grab route urls to process from database (only processes route pages)
-def get_grades(conn):
+# Grab route long grades from the database, limited to a change set or to routes scraped since a date
+def get_grades(conn, since=None, page_ids=None):
     try:
         # Execute MySQL query
-        urls_query = "SELECT page_id, long_grade FROM mp_route_info"
-        df = pd.read_sql(urls_query, conn)
-        logging.info(f'Got list of grades at {datetime.datetime.now()}')
+        if page_ids is not None:
+            urls_query = text("SELECT page_id, long_grade FROM mp_route_info WHERE page_id IN :page_ids").bindparams(
+                bindparam('page_ids', expanding=True))
+            df = pd.read_sql(urls_query, conn, params={'page_ids': list(page_ids)})
+        elif since is not None:
+            urls_query = text("SELECT page_id, long_grade FROM mp_route_info WHERE date_grabbed >= :since")
+            df = pd.read_sql(urls_query, conn, params={'since': since})
+        else:
+            urls_query = "SELECT page_id, long_grade FROM mp_route_info"
+            df = pd.read_sql(urls_query, conn)
+        logging.info(f'Got list of {len(df)} grades at {datetime.datetime.now()}')
 
         return df
 
@@ -69,16 +93,25 @@ def get_grades(conn):
     return None
 
 
-# Insert data into each table in the database
-def insert_data(conn, grade_data, table_name='route_grades'):
+# Replace the grades of the processed routes in one transaction so readers never see an empty table
+def insert_data(conn, grade_data, page_ids=None, table_name='route_grades'):
     try:
-        # Execute MySQL query
-        grade_data.to_sql(name=table_name, con=conn.engine, if_exists='replace', index=False)
+        if page_ids is None:
+            conn.execute(text(f'DELETE FROM {table_name}'))
+        else:
+            delete_query = text(f'DELETE FROM {table_name} WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            for i in range(0, len(page_ids), DELETE_BATCH_SIZE):
+                conn.execute(delete_query, {'page_ids': page_ids[i:i + DELETE_BATCH_SIZE]})
+
+        database.insert_frame(grade_data, table_name, conn)
+        conn.commit()
+        logging.info(f'Replaced grades for {len(grade_data)} rows at {datetime.datetime.now()}')
 
     except Exception as e:
         logging.error(f'Error inserting data into database: {e}', exc_info=True)
-
-    return None
+        conn.rollback()
+        raise
 
 
 # Cleanup long grade for processing
@@ -101,6 +134,7 @@ def long_grade_cleanup(df):
 
 
 # Process each row of the dataframe and add values to the appropriate grades column
+# (row-at-a-time reference for classify_grades, used by Benchmarks.py to confirm identical output)
 def process_row(index, row, grades_df, columns, cat_df):
     try:
         grade_values = row['long_grade']
@@ -120,47 +154,172 @@ def process_row(index, row, grades_df, columns, cat_df):
         logging.error(f'Error connecting grade with grade type: {e}')
 
 
-# Main execution
-def main():
+# Convert a grade category into the form stored in route_grades
+def clean_grade(value):
+    return value.replace('V-easy', 'V Easy').replace('+', 'd').replace('-', 'a')
+
+
+# Map every grade spelling in grade_order.csv to its ordinal. The cleaned spellings stored in route_grades
+# ('5.10-' -> '5.10a', 'V-easy' -> 'V Easy') and the bare letter-less grades long_grade_cleanup reads as
+# 'b' are added as aliases, without overriding an exact entry
+def load_grade_order(file_name='grade_order.csv'):
+    try:
+        order_df = pd.read_csv(file_name, dtype={'Grade': str}, encoding='utf-8-sig')
+        grade_order = dict(zip(order_df['Grade'], order_df['Order'].astype(int)))
+
+        for grade, order in list(grade_order.items()):
+            grade_order.setdefault(clean_grade(grade), order)
+        grade_order.setdefault('5.0', grade_order['5'])
+        for number in range(10, 16):
+            grade_order.setdefault(f'5.{number}', grade_order[f'5.{number}b'])
+
+        return grade_order
+
+    except Exception as e:
+        logging.error(f'Error loading grade order: {e}', exc_info=True)
+        raise
+
+
+# Integer ordinal for each grade string, missing for anything grade_order.csv doesn't know
+def grade_to_order(grades, grade_order):
+    return grades.map(grade_order).astype('Int64')
+
+
+# Write the grade lookup so SQL can join on it (used to backfill existing rows)
+def insert_grade_order(conn, grade_order):
+    try:
+        order_df = pd.DataFrame(list(grade_order.items()), columns=['Grade', 'Grade_Order'])
+        order_df.to_sql(name='grade_order', con=conn, if_exists='replace', index=False)
+        conn.commit()
+
+    except Exception as e:
+        logging.error(f'Error inserting grade order: {e}', exc_info=True)
+
+
+# Fill Grade_Order for the routes already in route_grades from the grade_order lookup
+def backfill_grade_order(conn):
+    try:
+        conn.execute(text("""
+            UPDATE route_grades rg
+            JOIN grade_order go ON go.Grade = rg.Grade
+            SET rg.Grade_Order = go.Grade_Order
+        """))
+        conn.commit()
+        logging.info(f'Backfilled route_grades.Grade_Order at {datetime.datetime.now()}')
+
+    except Exception as e:
+        logging.error(f'Error backfilling grade order: {e}', exc_info=True)
+        conn.rollback()
+        raise
+
+
+# Compile grade_categories.csv into one matcher per discipline. Categories are listed last-to-first
+# because process_row keeps the last category in the file that appears in long_grade
+def compile_matchers(cat_df, columns=GRADE_COLUMNS):
+    matchers = {}
+    for col in columns:
+        categories = cat_df[col].dropna().tolist()
+        matchers[col] = [(value, clean_grade(value)) for value in reversed(categories)]
+
+    return matchers
+
+
+# Classify a whole long_grade column at once, one vectorised substring pass per category.
+# Rows leave the candidate set as soon as they match, so later passes only scan what's left
+def classify_grades(long_grade, matchers):
+    try:
+        classified = pd.DataFrame('', index=long_grade.index, columns=list(matchers), dtype=object)
+
+        for col, matcher in matchers.items():
+            unmatched = long_grade[long_grade.notna()]
+            for value, cleaned in matcher:
+                if len(unmatched) == 0:
+                    break
+
+                hits = unmatched.str.contains(value, regex=False, na=False).to_numpy(dtype=bool)
+                classified.loc[unmatched.index[hits], col] = cleaned
+                unmatched = unmatched[~hits]
+
+        return classified
+
+    except Exception as e:
+        logging.error(f'Error classifying grades: {e}', exc_info=True)
+        raise
+
+
+# Clean and classify a batch of distinct long_grade strings (called through the normalization cache)
+def parse_long_grades(long_grades, matchers):
+    df = pd.DataFrame({'long_grade': long_grades})
+    long_grade_cleanup(df)
+
+    return classify_grades(df['long_grade'], matchers).values.tolist()
+
+
+# Main execution, page_ids limits the run to a change set. Returns the page_ids that were re-classified
+def main(page_ids=None):
     # Setup logging and connection to database
     setup_logging()
+    changed_page_ids = set()
 
     try:
-        with connect_to_db() as conn:
-            # Get route long grades and a list of grade categories
-            grades_df = get_grades(conn)
+        with database.connect_to_db() as conn:
+            added_grade_order = create_tables(conn)
+            run_date = datetime.date.today()
+
+            # Work out which routes need re-classifying
+            change_set = page_ids is not None
+            if change_set:
+                page_ids = list(page_ids)
+            last_run = database.get_last_run(conn, STAGE_NAME) if INCREMENTAL else None
+            grades_df = get_grades(conn, since=last_run, page_ids=page_ids)
+            if page_ids is None and last_run is not None:
+                page_ids = grades_df['page_id'].tolist()
+            logging.info(f'Re-classifying {len(grades_df)} routes (last run {last_run})')
+
+            # Get a list of grade categories
             cat_df = pd.read_csv('grade_categories.csv')
 
-            # Cleanup long_grades for processing
-            long_grade_cleanup(grades_df)
-
-            # Create grade columns in the grades DataFrame
-            columns = ['Rock', 'Boulder', 'Aid', 'Ice', 'Mixed', 'Snow', 'Danger']
-            for col in columns:
-                grades_df[col] = ''
-
-            # Iterate through long_grade and fill in values for the grade columns
-            grades_df.apply(lambda row: process_row(row.name, row, grades_df, columns, cat_df), axis=1)
+            # Clean and classify each distinct long_grade once, the cache is reset when this file
+            # or grade_categories.csv changes
+            matchers = compile_matchers(cat_df)
+            grade_cache = NormalizationCache('long_grade', version=file_fingerprint('grade_categories.csv', __file__))
+            grades_df[GRADE_COLUMNS] = grade_cache.map_frame(grades_df['long_grade'],
+                                                             lambda values: parse_long_grades(values, matchers),
+                                                             GRADE_COLUMNS, na_value=[''] * len(GRADE_COLUMNS))
+            grade_cache.save()
 
             # Melt grades df
             columns_to_keep = ['page_id']
-            columns_to_melt = ['Rock', 'Boulder', 'Aid', 'Ice', 'Mixed', 'Snow', 'Danger']
+            columns_to_melt = GRADE_COLUMNS
             melted_df = pd.melt(grades_df, id_vars=columns_to_keep, value_vars=columns_to_melt,
                                 var_name='Type', value_name='Grade')
             melted_df = melted_df[melted_df['Grade'] != '']
             melted_df.reset_index(drop=True, inplace=True)
 
-            # Insert grade data into database
-            insert_data(conn, melted_df)
+            # Add the sortable ordinal for range queries
+            grade_order = load_grade_order()
+            melted_df['Grade_Order'] = grade_to_order(melted_df['Grade'], grade_order)
+            insert_grade_order(conn, grade_order)
+            if added_grade_order:
+                backfill_grade_order(conn)
+
+            # Swap in the new grades for just these routes, then record the run
+            insert_data(conn, melted_df, page_ids=page_ids)
+            if not change_set:
+                database.set_last_run(conn, STAGE_NAME, run_date)
+            changed_page_ids.update(grades_df['page_id'].tolist())
 
     except Exception as e:
         logging.error(f'Error occured in main function:', exc_info=True)
         print(f'Error occured in main function: {e}')
+        raise
 
     finally:
         # Close connection to database
         conn.close()
 
+    return changed_page_ids
+
 
 ### Run ###
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+import os
+import time
+import shutil
+import logging
+import datetime
+import importlib
+from decouple import config
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from Fake_MP_Server import FakeMPServer
+
+### CONFIGURATION ###
+
+# Log Folder
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Load Test ({datetime.date.today()}).log'
+
+# Throwaway local database the whole pipeline writes to. The scripts use MySQL upserts, so this has
+# to be a MySQL/MariaDB server; every table in it is dropped before the run
+LOAD_TEST_DATABASE_URL = config('LOAD_TEST_DATABASE_URL',
+                                default='mysql+mysqlconnector://root@127.0.0.1:3306/climbing_load_test')
+
+# Scripts read relative paths (csv inputs, caches, indexes), so they run from a scratch folder
+WORK_FOLDER = 'load_test'
+INPUT_FILES = ['grade_categories.csv', 'grade_order.csv']
+TITLE_COUNTS = [('Description', 'Description'), ('Location', 'Directions'), ('Access', 'Misc'),
+                ('Protection', 'Protection')]
+
+# Synthetic site and how it behaves
+ROUTE_COUNT = 2000
+LATENCY = 0.05
+ERROR_RATE = 0.01
+THROTTLE_RATE = 0.01
+CHANGE_RATE = 0.1
+
+# The first round scrapes everything, each later round advances the site and runs incrementally
+ROUNDS = 2
+
+# Rate limits for the grabbers, far above the live site's so the server and database are the bottleneck
+CALLS_PER_PERIOD = 100000
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Drop every table in the load test database, refusing anything that doesn't look like a test database
+def reset_database(database_url=LOAD_TEST_DATABASE_URL):
+    database_name = make_url(database_url).database or ''
+    if 'test' not in database_name:
+        raise ValueError(f'Refusing to reset {database_name!r}, the load test database name must contain "test"')
+
+    engine = create_engine(database_url)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text('SET FOREIGN_KEY_CHECKS = 0'))
+            for view_name in inspect(conn).get_view_names():
+                conn.execute(text(f'DROP VIEW IF EXISTS `{view_name}`'))
+            for table_name in inspect(conn).get_table_names():
+                conn.execute(text(f'DROP TABLE IF EXISTS `{table_name}`'))
+            conn.execute(text('SET FOREIGN_KEY_CHECKS = 1'))
+        logging.info(f'Reset load test database {database_name} at {datetime.datetime.now()}')
+
+    finally:
+        engine.dispose()
+
+
+# Copy the pipeline's input files into the scratch folder
+def prepare_work_folder(work_folder=WORK_FOLDER):
+    if os.path.exists(work_folder):
+        shutil.rmtree(work_folder)
+    os.makedirs(work_folder)
+
+    for file_name in INPUT_FILES:
+        shutil.copy(file_name, work_folder)
+    with open(os.path.join(work_folder, 'title_counts.csv'), 'w', encoding='utf-8') as file:
+        file.write('Title,Process As\n')
+        file.writelines(f'{title},{process_as}\n' for title, process_as in TITLE_COUNTS)
+
+    return os.path.abspath(work_folder)
+
+
+# Point the scripts at the fake server and the test database. Has to happen before they are imported,
+# their rate limits and connection settings are read at import time
+def configure_environment(server, database_url=LOAD_TEST_DATABASE_URL):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['MP_SITEMAP'] = f'{server.base_url}/sitemap.xml'
+    os.environ['MP_API_URL'] = f'{server.base_url}/api/v2/routes'
+    os.environ['ROUTE_CALLS_PER_PERIOD'] = str(CALLS_PER_PERIOD)
+    os.environ['STATS_CALLS_PER_PERIOD'] = str(CALLS_PER_PERIOD)
+
+
+# Print one round's end-to-end numbers
+def report_round(round_number, elapsed, changed, requests, failed=None):
+    routes = len(changed.get('route_grabber', ()))
+    served = sum(requests.values())
+    errors = sum(count for (_, status), count in requests.items() if status != 200)
+
+    print(f'Round {round_number}: {elapsed:.1f}s end to end')
+    print(f'  routes scraped: {routes} ({routes / elapsed:.1f} routes/s)')
+    print(f'  requests served: {served} ({served / elapsed:.1f}/s), {errors} errors or throttles')
+    for (kind, status), count in sorted(requests.items()):
+        print(f'    {kind} {status}: {count}')
+    for name, page_ids in changed.items():
+        print(f'  {name}: {len(page_ids)} page_ids changed')
+    for name, error in (failed or {}).items():
+        print(f'  {name}: FAILED ({error})')
+
+    logging.info(f'Round {round_number} took {elapsed:.1f}s for {routes} routes, {served} requests')
+
+
+# Run the whole pipeline against the fake server, once in full and then incrementally
+def run_load_test(route_count=ROUTE_COUNT, rounds=ROUNDS, database_url=LOAD_TEST_DATABASE_URL):
+    server = FakeMPServer(port=0, route_count=route_count, latency=LATENCY, error_rate=ERROR_RATE,
+                          throttle_rate=THROTTLE_RATE, change_rate=CHANGE_RATE).start()
+    start_folder = os.getcwd()
+    results = []
+
+    try:
+        reset_database(database_url)
+        os.chdir(prepare_work_folder())
+        configure_environment(server, database_url)
+        pipeline = importlib.import_module('Pipeline')
+
+        for round_number in range(1, rounds + 1):
+            if round_number > 1:
+                server.advance()
+            requests_before = server.requests.copy()
+
+            start_time = time.time()
+            changed, failed = pipeline.run_pipeline()
+            elapsed = time.time() - start_time
+
+            report_round(round_number, elapsed, changed, server.requests - requests_before, failed)
+            results.append((elapsed, changed, failed))
+
+    finally:
+        os.chdir(start_folder)
+        server.shutdown()
+        server.server_close()
+
+    return results
+
+
+# Main execution
+def main():
+    setup_logging()
+
+    try:
+        run_load_test()
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
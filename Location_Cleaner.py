@@ -1,9 +1,11 @@
 import os
 import logging
 import datetime
+import numpy as np
 import pandas as pd
-from decouple import config
-from sqlalchemy import create_engine
+from sqlalchemy import text, bindparam
+import Database as database
+from Normalization_Cache import NormalizationCache, file_fingerprint
 
 ### CONFIGURATION ###
 
@@ -11,14 +13,10 @@ from sqlalchemy import create_engine
 LOG_FOLDER = 'log_files'
 LOG_FILENAME = f'Logfile - Location Cleanup ({datetime.date.today()}).log'
 
-# MySQL Database Configuration
-DB_CONFIG = {
-    "host": config('AWS_HOST'),
-    "user": config('AWS_USERNAME'),
-    "password": config('AWS_MASTER_PASSWORD'),
-    "database": config('AWS_DATABASE')}
-
 INSERT_TABLE = 'route_location'
+AREAS_TABLE = 'location_areas'
+LOCATION_COLUMNS = ['continent', 'country', 'state', 'area_1', 'area_2', 'area_3', 'area_4',
+                    'area_5', 'area_6', 'area_7', 'area_8']
 
 
 ### FUNCTIONS ###
@@ -36,27 +34,15 @@ def setup_logging():
         print(f'Error creating log folder: {e}')
 
 
-# Create MySQL database connection
-def connect_to_db():
-    try:
-        # Create an SQLAlchemy engine
-        engine = create_engine(
-            f"mysql+mysqlconnector://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}")
-        conn = engine.connect()
-        logging.info(f'Connected to database at {datetime.datetime.now()}')
-
-        return conn
-
-    except Exception as e:
-        logging.error(f'Error connected to db: {e}', exc_info=True)
-        raise
-
-
 # Grab route locations from MySQL database
-def get_route_locations(conn):
+def get_route_locations(conn, page_ids=None):
     query = "SELECT page_id, location FROM mp_route_info"
     try:
-        route_location = pd.read_sql(query, conn)
+        if page_ids is not None:
+            query = text(query + ' WHERE page_id IN :page_ids').bindparams(bindparam('page_ids', expanding=True))
+            route_location = pd.read_sql(query, conn, params={'page_ids': list(page_ids)})
+        else:
+            route_location = pd.read_sql(query, conn)
         logging.info(f'Got list of locations at {datetime.datetime.now()}')
 
         return route_location
@@ -68,6 +54,7 @@ def get_route_locations(conn):
 
 
 # Split each route location and sort based on values
+# (row-at-a-time reference for split_locations, used by Benchmarks.py to confirm identical output)
 def location_cleaner(location_column):
     try:
         output_list = []
@@ -106,38 +93,260 @@ def location_cleaner(location_column):
     return None
 
 
-# Main execution
-def main():
+# Vectorised location_cleaner for a whole column: one split with expansion, then the 'International'
+# rows are shifted left by a mask. Produces the same 11 columns, padded with None and truncated
+def split_locations(locations):
+    try:
+        locations = pd.Series(locations, dtype=object)
+        parts = locations.str.split(' > ', expand=True)
+        parts = parts.reindex(columns=range(max(parts.shape[1], len(LOCATION_COLUMNS) + 2)))
+        parts = np.array(parts, dtype=object)
+        parts[pd.isna(parts)] = None
+
+        international = parts[:, 0] == 'International'
+        area_count = len(LOCATION_COLUMNS) - 3
+
+        output = np.empty((len(locations), len(LOCATION_COLUMNS)), dtype=object)
+        output[:, 0] = np.where(international, parts[:, 1], 'N America')
+        output[:, 1] = np.where(international, parts[:, 2], 'United States')
+        output[:, 2] = np.where(international, 'N/A', parts[:, 0])
+        for area in range(1, area_count + 1):
+            output[:, area + 2] = np.where(international, parts[:, area + 2], parts[:, area])
+
+        # Rows location_cleaner can't parse (missing, or International without a country) come back empty
+        invalid = locations.isna().to_numpy() | (international & pd.isna(parts[:, 2]))
+        output[invalid, :] = None
+
+        return pd.DataFrame(output, index=locations.index, columns=LOCATION_COLUMNS, dtype=object)
+
+    except Exception as e:
+        logging.error(f'Error splitting locations: {e}', exc_info=True)
+        raise
+
+
+# Same statistics as DataFrame.describe(include='all') for the location columns (count, unique, top, freq),
+# worked out from the distinct locations and how many routes have each instead of a pass over every route
+def describe_locations(distinct_df, counts):
+    summary = {}
+    for col in LOCATION_COLUMNS:
+        values = distinct_df[col]
+        present = values.notna().to_numpy()
+        totals = pd.Series(counts[present]).groupby(values[present].to_numpy(), sort=False).sum()
+        if len(totals) > 0:
+            summary[col] = [int(totals.sum()), len(totals), totals.idxmax(), int(totals.max())]
+        else:
+            summary[col] = [0, 0, None, None]
+
+    return pd.DataFrame(summary, index=['count', 'unique', 'top', 'freq'])
+
+
+# Create the area tree and the route -> leaf area table. Returns True when an old wide route_location
+# (continent ... area_8 columns) was replaced, the caller then has to map every route again
+def create_tables(conn):
+    try:
+        old_columns = conn.execute(text(f"""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = '{INSERT_TABLE}' AND column_name = 'continent'
+        """)).fetchone()[0]
+        if old_columns > 0:
+            conn.execute(text(f'DROP TABLE {INSERT_TABLE}'))
+            logging.info(f'Dropped the old wide {INSERT_TABLE}, every route will be re-mapped')
+
+        create_table_queries = [
+            f"""
+            CREATE TABLE IF NOT EXISTS {AREAS_TABLE} (
+                area_id INT PRIMARY KEY,
+                parent_id INT,
+                name VARCHAR(255) COLLATE utf8mb4_bin,
+                level INT,
+                lft INT,
+                rgt INT,
+                UNIQUE KEY parent_name (parent_id, name),
+                INDEX lft_idx (lft)
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS {INSERT_TABLE} (
+                page_id INT PRIMARY KEY,
+                area_id INT,
+                INDEX area_idx (area_id)
+            )
+            """]
+
+        for query in create_table_queries:
+            conn.execute(text(query))
+
+        # Area names are compared exactly, like the trie in build_area_tree. Under the default collation
+        # 'Red rock' and 'Red Rock' under one parent would collide on parent_name
+        name_collation = conn.execute(text(f"""
+            SELECT collation_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = '{AREAS_TABLE}' AND column_name = 'name'
+        """)).fetchone()[0]
+        if name_collation != 'utf8mb4_bin':
+            conn.execute(text(f'ALTER TABLE {AREAS_TABLE} MODIFY name VARCHAR(255) COLLATE utf8mb4_bin'))
+            logging.info(f'Changed {AREAS_TABLE}.name to a binary collation')
+        conn.commit()
+
+        return old_columns > 0
+
+    except Exception as e:
+        logging.error(f'Error creating location tables: {e}', exc_info=True)
+        raise
+
+
+# Full path of (area name, level) for a location, where level is the matching wide column
+# (0 continent, 1 country, 2 state, 3+ area_n). Unlike location_cleaner nothing is truncated
+def location_path(location):
+    location_split = location.split(' > ')
+
+    if location_split[0] == 'International':
+        path = [(location_split[1], 0), (location_split[2], 1)]
+        path.extend((sub_area, level) for level, sub_area in enumerate(location_split[3:], start=3))
+    else:
+        path = [('N America', 0), ('United States', 1), (location_split[0], 2)]
+        path.extend((sub_area, level) for level, sub_area in enumerate(location_split[1:], start=3))
+
+    return path
+
+
+# Load the existing area tree so area ids stay stable between runs
+def get_areas(conn):
+    try:
+        return pd.read_sql(f'SELECT area_id, parent_id, name, level FROM {AREAS_TABLE}', conn)
+
+    except Exception as e:
+        logging.error(f'Error fetching location areas: {e}', exc_info=True)
+        raise
+
+
+# Insert every location's path into the trie and return its leaf area_id per distinct location
+def build_area_tree(areas_df, locations):
+    nodes = {}
+    for row in areas_df.itertuples(index=False):
+        parent_id = 0 if pd.isna(row.parent_id) else int(row.parent_id)
+        nodes[(parent_id, row.name)] = [int(row.area_id), parent_id, row.name, int(row.level)]
+    next_id = max((node[0] for node in nodes.values()), default=0) + 1
+
+    leaf_ids = {}
+    for location in locations:
+        try:
+            parent_id = 0
+            for name, level in location_path(location):
+                node = nodes.get((parent_id, name))
+                if node is None:
+                    node = [next_id, parent_id, name, level]
+                    nodes[(parent_id, name)] = node
+                    next_id += 1
+                parent_id = node[0]
+            leaf_ids[location] = parent_id
+
+        except Exception as e:
+            logging.error(f'Error adding location {location} to area tree: {e}', exc_info=True)
+
+    return nodes, leaf_ids
+
+
+# Number the tree in preorder so every subtree is the lft range [lft, rgt]
+def number_area_tree(nodes):
+    children = {}
+    for area_id, parent_id, name, level in nodes.values():
+        children.setdefault(parent_id, []).append((name, area_id))
+
+    lft = {}
+    rgt = {}
+    counter = 0
+    stack = [(area_id, False) for name, area_id in sorted(children.get(0, []), reverse=True)]
+    while stack:
+        area_id, visited = stack.pop()
+        if visited:
+            rgt[area_id] = counter
+            continue
+        counter += 1
+        lft[area_id] = counter
+        stack.append((area_id, True))
+        stack.extend((child_id, False) for name, child_id in sorted(children.get(area_id, []), reverse=True))
+
+    areas_df = pd.DataFrame(list(nodes.values()), columns=['area_id', 'parent_id', 'name', 'level'])
+    areas_df['parent_id'] = areas_df['parent_id'].replace(0, None).astype('Int64')
+    areas_df['lft'] = areas_df['area_id'].map(lft)
+    areas_df['rgt'] = areas_df['area_id'].map(rgt)
+
+    return areas_df.sort_values('lft').reset_index(drop=True)
+
+
+# Replace the area tree and route leaf ids in one transaction
+def insert_areas(conn, areas_df, route_areas_df, page_ids=None):
+    try:
+        conn.execute(text(f'DELETE FROM {AREAS_TABLE}'))
+        database.insert_frame(areas_df, AREAS_TABLE, conn)
+
+        # A change set only replaces its own routes
+        if page_ids is not None:
+            delete_query = text(f'DELETE FROM {INSERT_TABLE} WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            conn.execute(delete_query, {'page_ids': list(page_ids)})
+        else:
+            conn.execute(text(f'DELETE FROM {INSERT_TABLE}'))
+        database.insert_frame(route_areas_df, INSERT_TABLE, conn)
+        conn.commit()
+
+    except Exception as e:
+        logging.error(f'Error inserting location areas: {e}', exc_info=True)
+        conn.rollback()
+        raise
+
+
+# Main execution, page_ids limits the run to a change set. Returns the page_ids that were re-mapped
+def main(page_ids=None):
     # Setup logging and connection to database
     setup_logging()
+    changed_page_ids = set()
 
     try:
-        with connect_to_db() as conn:
+        with database.connect_to_db() as conn:
+            # An old wide route_location is replaced, which needs a full run to fill the new one
+            if create_tables(conn):
+                page_ids = None
+
             # Get route types
-            route_locations = get_route_locations(conn)
+            route_locations = get_route_locations(conn, page_ids)
             logging.info(f'Length of locations_list is {len(route_locations)}')
 
-            # Process each route and create output
-            cleaned_locations = route_locations['location'].apply(location_cleaner).apply(pd.Series)
-            cleaned_locations.columns = ['continent', 'country', 'state', 'area_1', 'area_2', 'area_3', 'area_4',
-                                         'area_5', 'area_6', 'area_7', 'area_8']
-
-            # Combine dataframes without original location column
-            locations_df = pd.concat([route_locations['page_id'], cleaned_locations], axis=1)
-            logging.info(f'Length of output_list is {len(locations_df)}')
-
-            # Print df information and then add data to MySQL table
-            locations_df.describe(include='all').to_csv('locations_df_stats.csv')
-            locations_df.to_sql(name=INSERT_TABLE, con=conn.engine, if_exists='replace', index=False)
-            logging.info(f'Inserted data of length {len(locations_df)} at {datetime.datetime.now()}')
+            # Summary statistics from the distinct locations weighted by route count (full runs only).
+            # Each distinct location is split once through the cache
+            if page_ids is None:
+                location_cache = NormalizationCache('location', version=file_fingerprint(__file__))
+                _, distinct_df, codes = location_cache.map_frame(
+                    route_locations['location'],
+                    lambda values: split_locations(values).values.tolist(),
+                    LOCATION_COLUMNS, return_distinct=True)
+                location_cache.save()
+                route_counts = np.bincount(codes, minlength=len(distinct_df))
+                describe_locations(distinct_df, route_counts).to_csv('locations_df_stats.csv')
+
+            # Add new paths to the area tree and map each route to its leaf area
+            codes, distinct_locations = pd.factorize(route_locations['location'])
+            nodes, leaf_ids = build_area_tree(get_areas(conn), distinct_locations)
+            areas_df = number_area_tree(nodes)
+            leaf_array = pd.array([leaf_ids.get(location) for location in distinct_locations] + [None], dtype='Int64')
+            route_areas_df = pd.DataFrame({'page_id': route_locations['page_id'],
+                                           'area_id': leaf_array[codes]})
+
+            # Add data to MySQL tables
+            insert_areas(conn, areas_df, route_areas_df, page_ids)
+            logging.info(f'Inserted {len(areas_df)} areas and {len(route_areas_df)} routes at {datetime.datetime.now()}')
+            changed_page_ids.update(route_locations['page_id'].tolist())
 
     except Exception as e:
         logging.error(f'Error occurred in main function:', exc_info=True)
         print(f'Error occurred in main function: {e}')
+        raise
 
     finally:
         print('Done!')
 
+    return changed_page_ids
+
 
 ### Run ###
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+### CONFIGURATION ###
+
+# Folder the parsed values are persisted to between runs
+CACHE_FOLDER = 'cache_files'
+
+
+### FUNCTIONS ###
+
+# Fingerprint of files a parser depends on, so editing them invalidates the cache
+def file_fingerprint(*file_names):
+    digest = hashlib.sha1()
+    for file_name in file_names:
+        with open(file_name, 'rb') as file:
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+
+### CLASSES ###
+
+# Parses each distinct string once and keeps the result on disk. Columns like long_grade, location
+# and long_route_type only have a few thousand distinct values across hundreds of thousands of routes
+class NormalizationCache:
+    def __init__(self, name, version='1'):
+        self.name = name
+        self.version = str(version)
+        self.path = os.path.join(CACHE_FOLDER, f'{name}.json')
+        self.values = {}
+        self.new_values = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    # Read cached values, ignoring the file if it was written by a different parser version
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as file:
+                    cached = json.load(file)
+                if cached.get('version') == self.version:
+                    self.values = cached['values']
+                logging.info(f'Loaded {len(self.values)} cached values for {self.name}')
+
+        except Exception as e:
+            logging.error(f'Error loading {self.name} cache, starting empty: {e}', exc_info=True)
+            self.values = {}
+
+    # Write the cache to a temporary file first so an interrupted run can't corrupt it
+    def save(self):
+        try:
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            with self._lock:
+                cached = {'version': self.version, 'values': self.values}
+                temp_path = f'{self.path}.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as file:
+                    json.dump(cached, file)
+                os.replace(temp_path, self.path)
+            logging.info(f'Saved {len(self.values)} values for {self.name} ({self.new_values} new)')
+
+        except Exception as e:
+            logging.error(f'Error saving {self.name} cache: {e}', exc_info=True)
+
+    # Memoised parse of a single value, safe to call from scraper threads
+    def get(self, value, parse):
+        with self._lock:
+            if value in self.values:
+                return self.values[value]
+
+        result = parse(value)
+        with self._lock:
+            self.values[value] = result
+            self.new_values += 1
+
+        return result
+
+    # Parse a column through its distinct values and broadcast the results back to every row.
+    # parse_batch receives a Series of unseen values and returns one result list per value.
+    # return_distinct also returns the per-distinct-value table and each row's position in it
+    def map_frame(self, series, parse_batch, columns, na_value=None, return_distinct=False):
+        codes, uniques = pd.factorize(series)
+        uniques = list(uniques)
+
+        missing = [value for value in uniques if value not in self.values]
+        if len(missing) > 0:
+            results = parse_batch(pd.Series(missing, dtype=object))
+            with self._lock:
+                for value, result in zip(missing, results):
+                    self.values[value] = result
+                self.new_values += len(missing)
+
+        # Missing rows (code -1) point at an extra row holding na_value
+        if na_value is None:
+            na_value = [None] * len(columns)
+        table = pd.DataFrame([self.values[value] for value in uniques] + [na_value], columns=columns)
+        codes = np.where(codes < 0, len(uniques), codes)
+
+        output = table.iloc[codes].reset_index(drop=True)
+        output.index = series.index
+        logging.info(f'{self.name}: {len(series)} rows, {len(uniques)} distinct, {len(missing)} parsed')
+
+        if return_distinct:
+            return output, table, codes
+        return output
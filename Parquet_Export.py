@@ -0,0 +1,397 @@
+"""Exports the database to hive-partitioned Parquet under parquet_export/ for local column scans.
+
+Route tables are partitioned by state and stats tables by month. A full run rewrites every table, with
+one file per partition. A change-set run rewrites only the state partitions that hold the changed
+page_ids. Month-partitioned tables are not updated from a change set's rows: a route's rows span every
+month, so that would rewrite nearly all of them. They are re-exported in full instead, on full runs and
+on change-set runs once MONTH_REFRESH_DAYS have passed since the last refresh, and are stale in between.
+"""
+import os
+import re
+import glob
+import logging
+import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text, bindparam, inspect
+import Database as database
+import Location_Cleaner as location_cleaner
+import Titles_Cleaner as titles_cleaner
+
+### CONFIGURATION ###
+
+# Log Folder
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Parquet Export ({datetime.date.today()}).log'
+
+# Export root, each table is a hive-partitioned folder (table/partition=value/part-00000.parquet)
+EXPORT_FOLDER = 'parquet_export'
+
+# Table -> how it is partitioned: 'state' by the route's US state (or country outside the US),
+# 'month' by the month of createdAt, None for small lookup tables written as one file
+EXPORT_TABLES = {
+    'mp_route_info': 'state',
+    'route_text': 'state',
+    'route_grades': 'state',
+    'route_location': 'state',
+    **{table_name: 'state' for table_name in titles_cleaner.TEXT_TABLES.values()},
+    'stats_count': 'state',
+    'stats_ticks': 'month',
+    'stats_stars': 'month',
+    'stats_ratings': 'month',
+    'stats_todos': 'month',
+    'tick_monthly': 'state',
+    'tick_style_monthly': 'state',
+    'rating_histogram': 'state',
+    'rating_consensus': 'state',
+    'stats_users': None,
+    'location_areas': None,
+    'grade_order': None,
+}
+
+# Rows read from MySQL per query on a full export (whole page_ids at a time, so a route with more rows
+# than this is read on its own), and page_ids per IN list on an incremental one
+CHUNK_SIZE = 100000
+PAGE_ID_BATCH = 1000
+
+# A route's ticks, stars, ratings and todos span every month, so updating a month-partitioned table for a
+# change set would rewrite nearly all of it. Those tables are only written by full exports, which a
+# change-set run also does once the last one is older than this
+MONTH_REFRESH_DAYS = 7
+MONTH_STAGE_NAME = 'parquet_export_month'
+
+# Sidecar per table mapping page_id -> partition, so an update knows which files hold a page's old rows.
+# Files starting with '_' are skipped when the folder is read as a dataset
+PAGE_INDEX_FILE = '_page_index.parquet'
+UNKNOWN_PARTITION = 'unknown'
+
+COMPRESSION = 'zstd'
+
+# Rows held across all partitions on a full export before they are written out as row groups, each
+# partition keeps one open file for the whole table instead of getting a file per chunk
+WRITE_BUFFER_ROWS = 1000000
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Partition folder names only keep characters that are safe in a path
+def partition_value(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return UNKNOWN_PARTITION
+
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(value)).strip('_') or UNKNOWN_PARTITION
+
+
+# Arrow schema from the MySQL column types, so every chunk and every partition file agrees on types
+# even when a chunk's column is all NULL
+def table_schema(conn, table_name):
+    fields = []
+    for column in inspect(conn).get_columns(table_name):
+        type_name = type(column['type']).__name__.upper()
+        if type_name in ('INTEGER', 'INT', 'BIGINT', 'SMALLINT', 'TINYINT', 'MEDIUMINT', 'BOOLEAN'):
+            arrow_type = pa.int64()
+        elif type_name in ('FLOAT', 'DOUBLE', 'REAL', 'DECIMAL', 'NUMERIC'):
+            arrow_type = pa.float64()
+        elif type_name == 'DATE':
+            arrow_type = pa.date32()
+        elif type_name in ('DATETIME', 'TIMESTAMP'):
+            arrow_type = pa.timestamp('us')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column['name'], arrow_type))
+
+    return pa.schema(fields)
+
+
+# State (or country outside the US) for each route, parsed once per distinct location
+def get_route_states(conn, page_ids=None):
+    try:
+        query = 'SELECT page_id, location FROM mp_route_info'
+        if page_ids is not None:
+            query = text(query + ' WHERE page_id IN :page_ids').bindparams(bindparam('page_ids', expanding=True))
+            frames = [pd.read_sql(query, conn, params={'page_ids': batch})
+                      for batch in page_id_batches(page_ids)]
+            routes = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['page_id', 'location'])
+        else:
+            routes = pd.read_sql(query, conn)
+
+        codes, uniques = pd.factorize(routes['location'])
+        split_df = location_cleaner.split_locations(pd.Series(uniques, dtype=object))
+        regions = split_df['state'].where(split_df['state'] != 'N/A', split_df['country'])
+        partitions = np.array([partition_value(value) for value in regions] + [UNKNOWN_PARTITION], dtype=object)
+        codes = np.where(codes < 0, len(uniques), codes)
+
+        return pd.Series(partitions[codes], index=routes['page_id'].to_numpy())
+
+    except Exception as e:
+        logging.error(f'Error getting route states: {e}', exc_info=True)
+        raise
+
+
+def page_id_batches(page_ids):
+    page_ids = sorted(page_ids)
+    return [page_ids[i:i + PAGE_ID_BATCH] for i in range(0, len(page_ids), PAGE_ID_BATCH)]
+
+
+# Partition value for each row of a chunk
+def row_partitions(df, scheme, route_states):
+    if scheme == 'state':
+        return df['page_id'].map(route_states).fillna(UNKNOWN_PARTITION).to_numpy()
+
+    months = pd.to_datetime(df['createdAt'], errors='coerce', format='mixed').dt.strftime('%Y-%m')
+    return months.fillna(UNKNOWN_PARTITION).to_numpy()
+
+
+def partition_key(scheme):
+    return 'state' if scheme == 'state' else 'month'
+
+
+def partition_folder(table_name, scheme, value):
+    return os.path.join(EXPORT_FOLDER, table_name, f'{partition_key(scheme)}={value}')
+
+
+# Write one file atomically, with dictionary encoding on the string columns
+def write_file(table, file_name):
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    string_columns = [field.name for field in table.schema if pa.types.is_string(field.type)]
+    temp_name = f'{file_name}.tmp'
+    pq.write_table(table, temp_name, compression=COMPRESSION, use_dictionary=string_columns)
+    os.replace(temp_name, file_name)
+
+
+# Dates can come back from the driver as date objects or strings, so they are parsed before conversion
+def to_arrow(df, schema):
+    df = df.copy()
+    for field in schema:
+        if pa.types.is_date(field.type) or pa.types.is_timestamp(field.type):
+            df[field.name] = pd.to_datetime(df[field.name], errors='coerce', format='mixed')
+
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False).replace_schema_metadata(None)
+
+
+# (low, high) page_id ranges holding about CHUNK_SIZE rows each, counted from the page_id index so the
+# driver never buffers more than one range (mysql-connector has no server-side cursors)
+def page_ranges(conn, table_name, chunk_size=CHUNK_SIZE):
+    counts = pd.read_sql(f'SELECT page_id, COUNT(*) AS row_count FROM {table_name} '
+                         f'WHERE page_id IS NOT NULL GROUP BY page_id ORDER BY page_id', conn)
+    ranges = []
+    low = None
+    rows = 0
+    for page_id, row_count in zip(counts['page_id'].to_numpy(), counts['row_count'].to_numpy()):
+        if low is not None and rows + row_count > chunk_size:
+            ranges.append((low, previous))
+            low = None
+            rows = 0
+        if low is None:
+            low = int(page_id)
+        rows += int(row_count)
+        previous = int(page_id)
+    if low is not None:
+        ranges.append((low, previous))
+
+    return ranges
+
+
+# Read a table a page_id range at a time. Lookup tables without a page_id are small and read in one go
+def read_chunks(conn, table_name, schema):
+    if 'page_id' not in schema.names:
+        yield pd.read_sql(f'SELECT * FROM {table_name}', conn)
+        return
+
+    query = text(f'SELECT * FROM {table_name} WHERE page_id BETWEEN :low AND :high')
+    for low, high in page_ranges(conn, table_name):
+        yield pd.read_sql(query, conn, params={'low': low, 'high': high})
+
+
+# Append buffered rows to each partition's open file, one row group per partition per flush
+def flush_partitions(buffers, writers, schema):
+    string_columns = [field.name for field in schema if pa.types.is_string(field.type)]
+    for file_name, frames in buffers.items():
+        if file_name not in writers:
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            writers[file_name] = pq.ParquetWriter(f'{file_name}.tmp', schema, compression=COMPRESSION,
+                                                  use_dictionary=string_columns)
+        writers[file_name].write_table(to_arrow(pd.concat(frames, ignore_index=True), schema))
+    buffers.clear()
+
+
+# Export a whole table into one file per partition, read a page_id range at a time. Files are written
+# under a temporary name and swapped in once the whole table has been read
+def export_full(conn, table_name, scheme, route_states):
+    table_folder = os.path.join(EXPORT_FOLDER, table_name)
+    schema = table_schema(conn, table_name)
+    for old_file in glob.glob(os.path.join(table_folder, '**', '*.parquet*'), recursive=True):
+        os.remove(old_file)
+
+    page_index = []
+    row_count = 0
+    buffers = {}
+    writers = {}
+    buffered_rows = 0
+
+    try:
+        for chunk in read_chunks(conn, table_name, schema):
+            if scheme is None:
+                buffers.setdefault(os.path.join(table_folder, 'part-00000.parquet'), []).append(chunk)
+            else:
+                partitions = row_partitions(chunk, scheme, route_states)
+                for value in pd.unique(partitions):
+                    file_name = os.path.join(partition_folder(table_name, scheme, value), 'part-00000.parquet')
+                    buffers.setdefault(file_name, []).append(chunk[partitions == value])
+                page_index.append(pd.DataFrame({'page_id': chunk['page_id'].to_numpy(), 'partition': partitions}))
+            row_count += len(chunk)
+            buffered_rows += len(chunk)
+
+            if buffered_rows >= WRITE_BUFFER_ROWS:
+                flush_partitions(buffers, writers, schema)
+                buffered_rows = 0
+
+        flush_partitions(buffers, writers, schema)
+        for file_name, writer in writers.items():
+            writer.close()
+            os.replace(f'{file_name}.tmp', file_name)
+
+    except Exception as e:
+        logging.error(f'Error exporting {table_name}: {e}', exc_info=True)
+        for file_name, writer in writers.items():
+            writer.close()
+            if os.path.exists(f'{file_name}.tmp'):
+                os.remove(f'{file_name}.tmp')
+        raise
+
+    if scheme is not None:
+        write_page_index(table_name, pd.concat(page_index, ignore_index=True) if page_index else None)
+    logging.info(f'Exported {row_count} rows of {table_name} into {len(writers)} files at {datetime.datetime.now()}')
+
+
+def read_page_index(table_name):
+    file_name = os.path.join(EXPORT_FOLDER, table_name, PAGE_INDEX_FILE)
+    if not os.path.exists(file_name):
+        return pd.DataFrame({'page_id': pd.Series(dtype='int64'), 'partition': pd.Series(dtype=object)})
+
+    return pd.read_parquet(file_name)
+
+
+def write_page_index(table_name, page_index):
+    if page_index is None:
+        page_index = pd.DataFrame({'page_id': pd.Series(dtype='int64'), 'partition': pd.Series(dtype=object)})
+    page_index = page_index.drop_duplicates().sort_values(['page_id', 'partition'])
+    write_file(pa.Table.from_pandas(page_index, preserve_index=False),
+               os.path.join(EXPORT_FOLDER, table_name, PAGE_INDEX_FILE))
+
+
+# Fetch a change set's current rows
+def get_changed_rows(conn, table_name, page_ids):
+    query = text(f'SELECT * FROM {table_name} WHERE page_id IN :page_ids').bindparams(
+        bindparam('page_ids', expanding=True))
+    frames = [pd.read_sql(query, conn, params={'page_ids': batch}) for batch in page_id_batches(page_ids)]
+
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+# Rewrite only the partitions that held or now hold rows for the changed page_ids
+def export_changes(conn, table_name, scheme, route_states, page_ids):
+    schema = table_schema(conn, table_name)
+    page_ids = set(page_ids)
+    page_index = read_page_index(table_name)
+    changed_index = page_index['page_id'].isin(page_ids)
+
+    new_rows = get_changed_rows(conn, table_name, page_ids)
+    if new_rows is None or len(new_rows) == 0:
+        new_rows = pd.DataFrame(columns=schema.names)
+    new_partitions = row_partitions(new_rows, scheme, route_states) if len(new_rows) > 0 else np.array([], dtype=object)
+    affected = set(page_index.loc[changed_index, 'partition']) | set(new_partitions)
+
+    for value in affected:
+        folder = partition_folder(table_name, scheme, value)
+        old_files = glob.glob(os.path.join(folder, '*.parquet'))
+        parts = []
+        if old_files:
+            kept = pq.read_table(old_files, schema=schema).to_pandas()
+            parts.append(kept[~kept['page_id'].isin(page_ids)])
+        parts.append(new_rows[new_partitions == value])
+        rows = pd.concat(parts, ignore_index=True)
+
+        # One consolidated file replaces whatever parts the partition had
+        new_file = os.path.join(folder, 'part-00000.parquet')
+        if len(rows) > 0:
+            write_file(to_arrow(rows, schema), new_file)
+        elif os.path.exists(new_file):
+            os.remove(new_file)
+        for old_file in old_files:
+            if old_file != new_file:
+                os.remove(old_file)
+
+    page_index = pd.concat([page_index[~changed_index],
+                            pd.DataFrame({'page_id': new_rows['page_id'].to_numpy(dtype='int64'),
+                                          'partition': new_partitions})], ignore_index=True)
+    write_page_index(table_name, page_index)
+    logging.info(f'Rewrote {len(affected)} partitions of {table_name} for {len(page_ids)} page_ids')
+
+
+# Read an exported table back, e.g. read_export('stats_ticks', ['page_id', 'style'], [('month', '>=', '2023-01')])
+def read_export(table_name, columns=None, filters=None):
+    return pd.read_parquet(os.path.join(EXPORT_FOLDER, table_name), columns=columns, filters=filters)
+
+
+# Main execution, page_ids limits the run to a change set. Returns the page_ids that were exported
+def main(page_ids=None):
+    setup_logging()
+    exported_page_ids = set()
+
+    try:
+        with database.connect_to_db() as conn:
+            existing_tables = set(inspect(conn).get_table_names())
+            run_date = datetime.date.today()
+            last_month_run = database.get_last_run(conn, MONTH_STAGE_NAME)
+            refresh_months = (page_ids is None or last_month_run is None or
+                              (run_date - last_month_run).days >= MONTH_REFRESH_DAYS)
+            route_states = get_route_states(conn, page_ids)
+
+            for table_name, scheme in EXPORT_TABLES.items():
+                if table_name not in existing_tables:
+                    logging.info(f'Skipping {table_name}, it does not exist yet')
+                    continue
+
+                if scheme == 'month':
+                    if refresh_months:
+                        export_full(conn, table_name, scheme, route_states)
+                    else:
+                        logging.info(f'Skipping {table_name}, month tables are refreshed in full every '
+                                     f'{MONTH_REFRESH_DAYS} days (last {last_month_run})')
+                elif page_ids is None or scheme is None:
+                    export_full(conn, table_name, scheme, route_states)
+                else:
+                    export_changes(conn, table_name, scheme, route_states, page_ids)
+
+            if refresh_months:
+                database.set_last_run(conn, MONTH_STAGE_NAME, run_date)
+
+            exported_page_ids.update(route_states.index.tolist() if page_ids is None else page_ids)
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+        raise
+
+    return exported_page_ids
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import os
+import time
+import logging
+import datetime
+import importlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+### CONFIGURATION ###
+
+# Log Folder (every stage logs here too, logging.basicConfig only takes effect on its first call)
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Pipeline ({datetime.date.today()}).log'
+
+# Stage name -> (module, stages whose changed page_ids it consumes). Each module's main(page_ids)
+# returns the set of page_ids it changed, main() with no page_ids does the stage's normal run
+STAGES = {
+    'url_grabber': ('URL_Grabber', []),
+    'route_grabber': ('Route_Grabber', ['url_grabber']),
+    'stats_grabber': ('Stats_Grabber', ['route_grabber']),
+    'grade_cleaner': ('Grade_Cleaner', ['route_grabber']),
+    'location_cleaner': ('Location_Cleaner', ['route_grabber']),
+    'titles_cleaner': ('Titles_Cleaner', ['route_grabber']),
+    'spatial_index': ('Spatial_Index', ['route_grabber']),
+    'text_index': ('Text_Index', ['titles_cleaner']),
+    'stats_check': ('Stats_Check', ['stats_grabber']),
+    'route_history': ('Route_History', ['route_grabber', 'stats_grabber']),
+    'tick_analytics': ('Tick_Analytics', ['stats_grabber']),
+    'rating_consensus': ('Rating_Consensus', ['stats_grabber', 'grade_cleaner']),
+    'parquet_export': ('Parquet_Export', ['route_grabber', 'stats_grabber', 'grade_cleaner', 'location_cleaner',
+                                          'titles_cleaner', 'tick_analytics', 'rating_consensus']),
+}
+
+# Stages that also have work of their own besides the change set (Stats_Grabber refreshes stats older
+# than 30 days), so they run even when nothing changed upstream
+ALWAYS_RUN = {'stats_grabber'}
+
+# Stages that are ready at the same time run side by side
+MAX_PARALLEL_STAGES = 4
+
+# Run every stage in full instead of passing change sets along
+FULL_REFRESH = False
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Stages that read (directly or through other stages) from any of the start stages, including themselves
+def downstream_stages(start_stages):
+    selected = set(start_stages)
+    added = True
+    while added:
+        added = False
+        for name, (_, dependencies) in STAGES.items():
+            if name not in selected and selected.intersection(dependencies):
+                selected.add(name)
+                added = True
+
+    return selected
+
+
+# Run one stage. page_ids of None is a normal run, otherwise only the change set is processed.
+# A failing stage raises so run_pipeline can tell it apart from one that changed nothing
+def run_stage(name, page_ids):
+    module_name = STAGES[name][0]
+    start_time = time.time()
+    try:
+        module = importlib.import_module(module_name)
+        changed_page_ids = module.main() if page_ids is None else module.main(page_ids)
+        changed_page_ids = set(changed_page_ids or ())
+        logging.info(f'{name} changed {len(changed_page_ids)} page_ids in {time.time() - start_time:.1f}s')
+
+        return changed_page_ids
+
+    except Exception as e:
+        logging.error(f'Error running stage {name}: {e}', exc_info=True)
+        print(f'Error running stage {name}: {e}')
+        raise
+
+
+# Run the stages as a DAG, handing each stage the union of its dependencies' changed page_ids.
+# Stages whose inputs are all empty are skipped, and so is everything below them that has no other input.
+# Stages below a failed stage are not run at all, they are reported as blocked by it
+def run_pipeline(start_stages=None, page_ids=None, full_refresh=FULL_REFRESH):
+    if start_stages is None:
+        start_stages = [name for name, (_, dependencies) in STAGES.items() if len(dependencies) == 0]
+    selected = downstream_stages(start_stages)
+
+    changed = {}
+    skipped = []
+    failed = {}
+    blocked = {}
+    running = {}
+    remaining = [name for name in STAGES if name in selected]
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_STAGES, thread_name_prefix='stage') as executor:
+        while remaining or running:
+            # Start every stage whose dependencies have all finished
+            for name in list(remaining):
+                dependencies = [dependency for dependency in STAGES[name][1] if dependency in selected]
+                if any(dependency not in changed for dependency in dependencies):
+                    continue
+                remaining.remove(name)
+
+                failed_dependencies = [dependency for dependency in dependencies
+                                       if dependency in failed or dependency in blocked]
+                if failed_dependencies:
+                    logging.error(f'Not running {name}, upstream stage failed: {", ".join(failed_dependencies)}')
+                    blocked[name] = failed_dependencies
+                    changed[name] = set()
+                    continue
+
+                if name in start_stages:
+                    stage_input = None if page_ids is None else set(page_ids)
+                else:
+                    stage_input = set().union(*(changed[dependency] for dependency in dependencies))
+
+                if full_refresh:
+                    stage_input = None
+                elif stage_input is not None and len(stage_input) == 0 and name not in ALWAYS_RUN:
+                    logging.info(f'Skipping {name}, no changed page_ids upstream')
+                    skipped.append(name)
+                    changed[name] = set()
+                    continue
+
+                logging.info(f'Starting {name} with {"all" if stage_input is None else len(stage_input)} page_ids')
+                running[executor.submit(run_stage, name, stage_input)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    changed[name] = future.result()
+                except Exception as e:
+                    failed[name] = e
+                    changed[name] = set()
+
+    print(f'Pipeline finished, skipped: {", ".join(skipped) or "none"}')
+    for name in STAGES:
+        if name in failed:
+            print(f'  {name}: FAILED ({failed[name]})')
+        elif name in blocked:
+            print(f'  {name}: not run, upstream failed ({", ".join(blocked[name])})')
+        elif name in changed and name not in skipped:
+            print(f'  {name}: {len(changed[name])} page_ids changed')
+    if failed:
+        logging.error(f'Pipeline failed stages: {", ".join(failed)}, not run: {", ".join(blocked) or "none"}')
+
+    return changed, failed
+
+
+# Main execution
+def main():
+    setup_logging()
+    start_time = time.time()
+
+    try:
+        run_pipeline()
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+
+    finally:
+        logging.info(f'Pipeline ran for {time.time() - start_time:.1f}s')
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import os
+import logging
+import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+import Database as database
+import Grade_Cleaner as grade_cleaner
+
+### CONFIGURATION ###
+
+# Log Folder
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Rating Consensus ({datetime.date.today()}).log'
+
+# Width of the page_id range aggregated at a time on a full rebuild, and page_ids per IN list on an
+# incremental one
+CHUNK_SIZE = 20000
+PAGE_ID_BATCH = 1000
+
+# Per-route vote counts for every grade users suggested, and the consensus for each grade type compared
+# with the grade listed on the route (route_grades). spread > 0 means the crowd grades it harder
+CONSENSUS_TABLE_QUERIES = ["""
+    CREATE TABLE IF NOT EXISTS rating_histogram (
+        page_id INT,
+        Type VARCHAR(16),
+        Grade VARCHAR(32),
+        Grade_Order INT,
+        votes INT UNSIGNED,
+        PRIMARY KEY (page_id, Type, Grade_Order)
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS rating_consensus (
+        page_id INT,
+        Type VARCHAR(16),
+        votes INT UNSIGNED,
+        mean_order DOUBLE,
+        median_order DOUBLE,
+        listed_order INT,
+        spread DOUBLE,
+        PRIMARY KEY (page_id, Type),
+        INDEX type_spread_idx (Type, spread)
+    )
+"""]
+CONSENSUS_TABLES = ['rating_histogram', 'rating_consensus']
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Create the histogram and consensus tables
+def create_tables(conn):
+    try:
+        for query in CONSENSUS_TABLE_QUERIES:
+            conn.execute(text(query))
+        conn.commit()
+
+    except Exception as e:
+        logging.error(f'Error creating rating consensus tables: {e}', exc_info=True)
+        raise
+
+
+# grade_order.csv lists each grade type as one contiguous run of ordinals, so the first ordinal of every
+# type in grade_categories.csv is enough to tell which type a grade belongs to
+def load_type_starts(grade_order, file_name='grade_categories.csv'):
+    cat_df = pd.read_csv(file_name)
+    starts = []
+    for col in grade_cleaner.GRADE_COLUMNS:
+        orders = grade_cleaner.grade_to_order(cat_df[col].dropna().map(grade_cleaner.clean_grade), grade_order)
+        if orders.notna().any():
+            starts.append((int(orders.min()), col))
+
+    return sorted(starts)
+
+
+# First spelling in grade_order.csv for each ordinal, used as the histogram's grade label
+def order_labels(grade_order):
+    labels = {}
+    for grade, order in grade_order.items():
+        labels.setdefault(order, grade)
+
+    return labels
+
+
+# Read the rating strings for a page_id range or a list of page_ids
+def get_ratings(conn, low=None, high=None, page_ids=None):
+    try:
+        if page_ids is not None:
+            query = text('SELECT page_id, allRatings FROM stats_ratings WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            return pd.read_sql(query, conn, params={'page_ids': list(page_ids)})
+
+        query = text('SELECT page_id, allRatings FROM stats_ratings WHERE page_id BETWEEN :low AND :high')
+        return pd.read_sql(query, conn, params={'low': low, 'high': high})
+
+    except Exception as e:
+        logging.error(f'Error getting ratings from database: {e}', exc_info=True)
+        raise
+
+
+# Listed grade ordinal for each route and type, from Grade_Cleaner's route_grades
+def get_listed_grades(conn, low=None, high=None, page_ids=None):
+    try:
+        if page_ids is not None:
+            query = text('SELECT page_id, Type, Grade_Order FROM route_grades WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            return pd.read_sql(query, conn, params={'page_ids': list(page_ids)})
+
+        query = text('SELECT page_id, Type, Grade_Order FROM route_grades WHERE page_id BETWEEN :low AND :high')
+        return pd.read_sql(query, conn, params={'low': low, 'high': high})
+
+    except Exception as e:
+        logging.error(f'Error getting listed grades from database: {e}', exc_info=True)
+        raise
+
+
+# Split every allRatings string into one row per suggested grade, with its ordinal and grade type.
+# Votes are cleaned the way route_grades is ('5.10-' -> '5.10a') so they compare with the listed grade.
+# Anything grade_order.csv doesn't know is dropped
+def parse_ratings(ratings, grade_order, type_starts):
+    votes = ratings[['page_id']].assign(Grade=ratings['allRatings'].str.split(',')).explode('Grade')
+    votes = votes[votes['Grade'].notna()]
+    votes['Grade'] = votes['Grade'].str.strip().map(grade_cleaner.clean_grade)
+    votes['Grade_Order'] = grade_cleaner.grade_to_order(votes['Grade'], grade_order)
+    votes = votes[votes['Grade_Order'].notna()].copy()
+
+    starts = np.array([start for start, _ in type_starts])
+    types = np.array([type_name for _, type_name in type_starts], dtype=object)
+    positions = np.searchsorted(starts, votes['Grade_Order'].to_numpy(dtype='int64'), side='right') - 1
+    votes['Type'] = np.where(positions >= 0, types[positions.clip(0)], None)
+
+    return votes[votes['Type'].notna()]
+
+
+# Histogram and consensus for a frame of parsed votes, compared against the listed grades
+def aggregate_ratings(votes, listed, labels):
+    histogram = (votes.groupby(['page_id', 'Type', 'Grade_Order'])
+                 .size().rename('votes').reset_index())
+    histogram.insert(2, 'Grade', histogram['Grade_Order'].map(labels))
+
+    orders = votes.assign(Grade_Order=votes['Grade_Order'].astype('float64'))
+    consensus = (orders.groupby(['page_id', 'Type'])['Grade_Order']
+                 .agg(votes='size', mean_order='mean', median_order='median')
+                 .reset_index())
+    listed = listed.rename(columns={'Grade_Order': 'listed_order'})
+    consensus = consensus.merge(listed, on=['page_id', 'Type'], how='left')
+    consensus['spread'] = consensus['mean_order'] - consensus['listed_order']
+
+    return {'rating_histogram': histogram, 'rating_consensus': consensus}
+
+
+# Swap in the aggregates for a page_id range or a list of page_ids in one transaction
+def replace_aggregates(conn, aggregates, low=None, high=None, page_ids=None):
+    try:
+        for table_name in CONSENSUS_TABLES:
+            if page_ids is not None:
+                delete_query = text(f'DELETE FROM {table_name} WHERE page_id IN :page_ids').bindparams(
+                    bindparam('page_ids', expanding=True))
+                conn.execute(delete_query, {'page_ids': list(page_ids)})
+            else:
+                conn.execute(text(f'DELETE FROM {table_name} WHERE page_id BETWEEN :low AND :high'),
+                             {'low': low, 'high': high})
+            database.insert_frame(aggregates[table_name], table_name, conn)
+
+        conn.commit()
+
+    except Exception as e:
+        logging.error(f'Error replacing rating aggregates: {e}', exc_info=True)
+        conn.rollback()
+        raise
+
+
+# Rebuild every route, one page_id range at a time (covering routes whose ratings are all gone too)
+def rebuild_all(conn, grade_order, type_starts, labels):
+    bounds = conn.execute(text("""
+        SELECT MIN(low), MAX(high) FROM (
+            SELECT MIN(page_id) AS low, MAX(page_id) AS high FROM stats_ratings
+            UNION ALL SELECT MIN(page_id), MAX(page_id) FROM rating_consensus
+        ) b
+    """)).fetchone()
+    page_ids = set()
+    if bounds[0] is None:
+        return page_ids
+
+    for low in range(bounds[0], bounds[1] + 1, CHUNK_SIZE):
+        high = low + CHUNK_SIZE - 1
+        votes = parse_ratings(get_ratings(conn, low=low, high=high), grade_order, type_starts)
+        aggregates = aggregate_ratings(votes, get_listed_grades(conn, low=low, high=high), labels)
+        replace_aggregates(conn, aggregates, low=low, high=high)
+        page_ids.update(votes['page_id'].tolist())
+
+    return page_ids
+
+
+# Rebuild just the routes in a change set
+def update_routes(conn, page_ids, grade_order, type_starts, labels):
+    page_ids = sorted(page_ids)
+    for i in range(0, len(page_ids), PAGE_ID_BATCH):
+        batch = page_ids[i:i + PAGE_ID_BATCH]
+        votes = parse_ratings(get_ratings(conn, page_ids=batch), grade_order, type_starts)
+        aggregates = aggregate_ratings(votes, get_listed_grades(conn, page_ids=batch), labels)
+        replace_aggregates(conn, aggregates, page_ids=batch)
+
+    return set(page_ids)
+
+
+# Main execution, page_ids limits the run to a change set. Returns the page_ids whose consensus was rebuilt
+def main(page_ids=None):
+    setup_logging()
+    changed_page_ids = set()
+
+    try:
+        grade_order = grade_cleaner.load_grade_order()
+        type_starts = load_type_starts(grade_order)
+        labels = order_labels(grade_order)
+
+        with database.connect_to_db() as conn:
+            create_tables(conn)
+
+            if page_ids is None:
+                changed_page_ids.update(rebuild_all(conn, grade_order, type_starts, labels))
+            else:
+                changed_page_ids.update(update_routes(conn, page_ids, grade_order, type_starts, labels))
+            logging.info(f'Rebuilt rating consensus for {len(changed_page_ids)} routes at {datetime.datetime.now()}')
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+        raise
+
+    return changed_page_ids
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,6 @@ import time
 import json
 import logging
 import requests
-import mysql.connector
 import datetime
 import pandas as pd
 from bs4 import BeautifulSoup
@@ -12,6 +11,9 @@ from statistics import mean
 from decouple import config
 from concurrent.futures import ThreadPoolExecutor
 from ratelimit import limits, sleep_and_retry
+from Normalization_Cache import NormalizationCache, file_fingerprint
+import Database as database
+import Route_History as route_history
 
 ### CONFIGURATION ###
 
@@ -23,15 +25,23 @@ LOG_FILENAME = f'Logfile - Route Grabber ({datetime.date.today()}).log'
 BATCH_SIZE = 100  # also used to set max_workers
 
 # Rate limiting
-CALLS_PER_PERIOD = 40
+CALLS_PER_PERIOD = config('ROUTE_CALLS_PER_PERIOD', default=40, cast=int)
 TIME_PERIOD = 10  # seconds
 
-# MySQL Database Configuration
-DB_CONFIG = {
-    "host": config('AWS_HOST'),
-    "user": config('AWS_USERNAME'),
-    "password": config('AWS_MASTER_PASSWORD'),
-    "database": config('AWS_DATABASE')}
+# Parsed 'Type:' strings, shared by the scraper threads and kept between runs
+ROUTE_TYPE_CACHE = NormalizationCache('long_route_type', version=file_fingerprint(__file__))
+
+# The description/protection/directions/misc blobs live in route_text so scans of mp_route_info only
+# read its fixed-width columns. Use 'DYNAMIC' where the server doesn't allow compressed tables
+TEXT_COLUMNS = ['description', 'protection', 'directions', 'misc']
+TEXT_ROW_FORMAT = config('ROUTE_TEXT_ROW_FORMAT', default='COMPRESSED')
+
+# Routes copied per statement when moving text out of an mp_route_info created before route_text
+MIGRATE_BATCH_SIZE = 5000
+
+# A run scraping at least this fraction of the routes in route_views_per_month (e.g. the initial scrape)
+# ranks them in one windowed pass at the end. Shifting ranks per batch would rewrite most rows every batch
+RANK_RECOMPUTE_FRACTION = 0.1
 
 
 ### FUNCTIONS ###
@@ -48,20 +58,6 @@ def setup_logging():
         print(f'Error creating log file: {e}')
 
 
-# Create MySQL database connection
-def connect_to_db():
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        logging.info(f'Connected to database at {datetime.datetime.now()}')
-
-        return conn
-
-    except Exception as e:
-        logging.error(f'Error establishing connection to database: {e}', exc_info=True)
-
-    return None
-
-
 # Create MySQL table
 def create_table(cursor):
     try:
@@ -87,15 +83,21 @@ def create_table(cursor):
                 date_added DATE,
                 shared_by VARCHAR(255),
                 latitude DECIMAL(10, 8),
-                longitude DECIMAL(11, 8),
+                longitude DECIMAL(11, 8)
+            )
+        """
+        create_text_query = f"""
+            CREATE TABLE IF NOT EXISTS route_text (
+                page_id INT PRIMARY KEY,
                 description TEXT,
                 protection TEXT,
                 directions TEXT,
                 misc TEXT
-            )
+            ) ROW_FORMAT={TEXT_ROW_FORMAT}
         """
         logging.info(f'Created/checked table in database at {datetime.datetime.now()}')
         cursor.execute(create_table_query)
+        cursor.execute(create_text_query)
 
     except Exception as e:
         logging.error(f'Error creating table in database: {e}', exc_info=True)
@@ -125,7 +127,9 @@ def insert_data(cursor, route_info):
                            data['Date Added'],
                            data['Shared By'],
                            data['Latitude'],
-                           data['Longitude'],
+                           data['Longitude'])
+                          for data in route_info]
+        text_to_insert = [(data['Page ID'],
                            json.dumps(data['Description']),
                            json.dumps(data['Protection']),
                            json.dumps(data['Directions']), json.dumps(data['Misc']))
@@ -137,10 +141,9 @@ def insert_data(cursor, route_info):
                                       grade, long_grade, fa, route_type,
                                       long_route_type, distance_ft, pitches, fixed_pieces,
                                       stars, votes, location, views, date_added,
-                                      shared_by, latitude, longitude, description,
-                                      protection, directions, misc)
+                                      shared_by, latitude, longitude)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    %s, %s, %s, %s, %s)
             ON DUPLICATE KEY UPDATE
                 url = VALUES(url),
                 last_update = VALUES(last_update),
@@ -161,19 +164,302 @@ def insert_data(cursor, route_info):
                 date_added = VALUES(date_added),
                 shared_by = VALUES(shared_by),
                 latitude = VALUES(latitude),
-                longitude = VALUES(longitude),
+                longitude = VALUES(longitude)
+            """
+        insert_text_query = """
+            INSERT INTO route_text (page_id, description, protection, directions, misc)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
                 description = VALUES(description),
                 protection = VALUES(protection),
                 directions = VALUES(directions),
                 misc = VALUES(misc)
             """
         cursor.executemany(insert_query, data_to_insert)
+        cursor.executemany(insert_text_query, text_to_insert)
         logging.info('Successfully inserted data into database')
 
     except Exception as e:
         logging.error(f'Error inserting data into database: {e}', exc_info=True)
 
 
+# Move the text columns of an mp_route_info created before route_text existed, one page_id range per
+# commit so no statement holds locks on the whole table, then drop them from mp_route_info
+def migrate_text_columns(conn, cursor, batch_size=MIGRATE_BATCH_SIZE):
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'mp_route_info' AND column_name = 'description'
+        """)
+        if cursor.fetchone()[0] == 0:
+            return
+
+        cursor.execute('SELECT MIN(page_id), MAX(page_id) FROM mp_route_info')
+        low_id, high_id = cursor.fetchone()
+        columns = ', '.join(TEXT_COLUMNS)
+        if low_id is not None:
+            for low in range(low_id, high_id + 1, batch_size):
+                cursor.execute(f"""
+                    INSERT IGNORE INTO route_text (page_id, {columns})
+                    SELECT page_id, {columns} FROM mp_route_info
+                    WHERE page_id BETWEEN %s AND %s
+                """, (low, low + batch_size - 1))
+                conn.commit()
+
+        cursor.execute('ALTER TABLE mp_route_info ' + ', '.join(f'DROP COLUMN {column}' for column in TEXT_COLUMNS))
+        conn.commit()
+        logging.info(f'Moved text columns from mp_route_info to route_text at {datetime.datetime.now()}')
+
+    except Exception as e:
+        logging.error(f'Error moving text columns to route_text: {e}', exc_info=True)
+        raise
+
+
+# Create the route type dimension and the page_id -> route type bridge
+def create_type_tables(cursor):
+    try:
+        create_table_queries = ["""
+            CREATE TABLE IF NOT EXISTS route_types (
+                route_type_id INT AUTO_INCREMENT PRIMARY KEY,
+                route_type VARCHAR(100) COLLATE utf8mb4_bin UNIQUE
+            )
+        """, """
+            CREATE TABLE IF NOT EXISTS route_type_bridge (
+                page_id INT,
+                route_type_id INT,
+                PRIMARY KEY (page_id, route_type_id),
+                INDEX route_type_idx (route_type_id, page_id)
+            )
+        """]
+        for query in create_table_queries:
+            cursor.execute(query)
+
+        # Types are matched by exact spelling in update_route_types, so the key can't fold case or accents
+        cursor.execute("""
+            SELECT collation_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'route_types' AND column_name = 'route_type'
+        """)
+        if cursor.fetchone()[0] != 'utf8mb4_bin':
+            cursor.execute('ALTER TABLE route_types MODIFY route_type VARCHAR(100) COLLATE utf8mb4_bin')
+            logging.info('Changed route_types.route_type to a binary collation')
+
+    except Exception as e:
+        logging.error(f'Error creating route type tables: {e}', exc_info=True)
+
+
+# Replace the bridge rows for the scraped routes, adding any route types not seen before
+def update_route_types(cursor, route_info):
+    try:
+        route_types = {data['Page ID']: [value for value in data['Route Type'].split(', ') if value]
+                       for data in route_info if data.get('Route Type') is not None}
+        if len(route_types) == 0:
+            return
+
+        distinct_types = sorted({value for values in route_types.values() for value in values})
+        if distinct_types:
+            cursor.executemany('INSERT IGNORE INTO route_types (route_type) VALUES (%s)',
+                               [(value,) for value in distinct_types])
+            placeholders = ', '.join(['%s'] * len(distinct_types))
+            cursor.execute(f'SELECT route_type, route_type_id FROM route_types WHERE route_type IN ({placeholders})',
+                           distinct_types)
+            type_ids = dict(cursor.fetchall())
+
+        page_ids = list(route_types)
+        placeholders = ', '.join(['%s'] * len(page_ids))
+        cursor.execute(f'DELETE FROM route_type_bridge WHERE page_id IN ({placeholders})', page_ids)
+
+        bridge_rows = [(page_id, type_ids[value]) for page_id, values in route_types.items() for value in set(values)]
+        if bridge_rows:
+            cursor.executemany('INSERT INTO route_type_bridge (page_id, route_type_id) VALUES (%s, %s)', bridge_rows)
+        logging.info(f'Updated route types for {len(page_ids)} routes')
+
+    except Exception as e:
+        logging.error(f'Error updating route types: {e}', exc_info=True)
+        raise
+
+
+# Append views, votes and stars to route_history for routes where they changed since the last scrape
+def record_route_history(cursor, route_info):
+    try:
+        rows = [(data['Page ID'], data['Date Grabbed'], data['Views'], data['Votes'],
+                 None if data['Stars'] is None else int(round(data['Stars'] * 100)))
+                for data in route_info]
+        written = route_history.record_history(cursor, 'route_history', rows)
+        logging.info(f'Recorded route history for {written} of {len(rows)} routes')
+
+    except Exception as e:
+        logging.error(f'Error recording route history: {e}', exc_info=True)
+        raise
+
+
+# Create the materialized views-per-month table, the rank is kept up to date by update_views_per_month
+def create_views_table(cursor):
+    try:
+        create_table_query = """
+            CREATE TABLE IF NOT EXISTS route_views_per_month (
+                page_id INT PRIMARY KEY,
+                date_added DATE,
+                date_grabbed DATE,
+                total_views INT,
+                month_count DOUBLE,
+                views_per_month DOUBLE,
+                `rank` INT,
+                INDEX views_per_month_idx (views_per_month),
+                INDEX rank_idx (`rank`)
+            )
+        """
+        cursor.execute(create_table_query)
+
+    except Exception as e:
+        logging.error(f'Error creating views per month table: {e}', exc_info=True)
+
+
+# Months between two dates the way MySQL counts them: whole months (TIMESTAMPDIFF) plus the part
+# of the next month that has passed
+def month_count(date_added, reference):
+    date_added = pd.Timestamp(date_added).normalize()
+    reference = pd.Timestamp(reference).normalize()
+    months = (reference.year - date_added.year) * 12 + reference.month - date_added.month
+    if months > 0 and reference.day < date_added.day:
+        months -= 1
+    elif months < 0 and reference.day > date_added.day:
+        months += 1
+
+    month_start = date_added + pd.DateOffset(months=months)
+    month_end = date_added + pd.DateOffset(months=months + 1)
+
+    return months + (reference - month_start).days / (month_end - month_start).days
+
+
+# (page_id, date_added, date_grabbed, total_views, month_count, views_per_month) for scraped routes,
+# using the day each route was grabbed as the reference date
+def views_per_month_rows(route_info):
+    rows = []
+    for data in route_info:
+        if pd.isna(data['Date Added']) or data['Views'] is None:
+            continue
+        months = month_count(data['Date Added'], data['Date Grabbed'])
+        views_per_month = data['Views'] / months if months != 0 else None
+        rows.append((data['Page ID'], pd.Timestamp(data['Date Added']).date(), data['Date Grabbed'],
+                     data['Views'], months, views_per_month))
+
+    return rows
+
+
+# Rank changes for routes that weren't re-scraped. A route's rank is 1 + the number of routes with a
+# higher views_per_month, so removing the old values and adding the new ones shifts every route by
+# count(new > v) - count(old > v). That count only changes at the old/new values, so each interval
+# between them is one range UPDATE. NULLs rank after every value, like RANK() ... DESC
+def rank_shifts(old_values, new_values):
+    old_values = sorted(value for value in old_values if value is not None)
+    new_values = sorted(value for value in new_values if value is not None)
+    breaks = sorted(set(old_values) | set(new_values))
+
+    shifts = [(None, breaks[0] if breaks else None, len(new_values) - len(old_values))]
+    for i, low in enumerate(breaks):
+        high = breaks[i + 1] if i + 1 < len(breaks) else None
+        shift = sum(value > low for value in new_values) - sum(value > low for value in old_values)
+        shifts.append((low, high, shift))
+
+    return [(low, high, shift) for low, high, shift in shifts if shift != 0]
+
+
+# Whether this run should leave ranks to recompute_ranks: it scrapes a large share of the stored routes,
+# or an earlier such run stopped before ranking (unranked rows would throw off the shifts)
+def defer_ranks(cursor, route_count):
+    try:
+        cursor.execute('SELECT COUNT(*), COUNT(*) - COUNT(`rank`) FROM route_views_per_month')
+        stored, unranked = cursor.fetchone()
+
+        return unranked > 0 or route_count >= stored * RANK_RECOMPUTE_FRACTION
+
+    except Exception as e:
+        logging.error(f'Error counting ranked routes: {e}', exc_info=True)
+        raise
+
+
+# Rank every route in one windowed pass, only rows whose rank changed are written
+def recompute_ranks(cursor):
+    try:
+        cursor.execute("""
+            UPDATE route_views_per_month rv
+            JOIN (
+                SELECT page_id, RANK() OVER (ORDER BY views_per_month DESC) AS new_rank
+                FROM route_views_per_month
+            ) ranked ON ranked.page_id = rv.page_id
+            SET rv.`rank` = ranked.new_rank
+        """)
+        logging.info(f'Recomputed views per month ranks at {datetime.datetime.now()}')
+
+    except Exception as e:
+        logging.error(f'Error recomputing views per month ranks: {e}', exc_info=True)
+        raise
+
+
+# Upsert the scraped routes into route_views_per_month and shift the other routes' ranks to match.
+# With shift_ranks=False the rows are stored unranked for recompute_ranks
+def update_views_per_month(cursor, route_info, shift_ranks=True):
+    try:
+        rows = views_per_month_rows(route_info)
+        if len(rows) == 0:
+            return
+        page_ids = [row[0] for row in rows]
+        placeholders = ', '.join(['%s'] * len(page_ids))
+
+        if not shift_ranks:
+            cursor.execute(f'DELETE FROM route_views_per_month WHERE page_id IN ({placeholders})', page_ids)
+            cursor.executemany("""
+                INSERT INTO route_views_per_month (page_id, date_added, date_grabbed, total_views, month_count,
+                                                   views_per_month)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, rows)
+            logging.info(f'Updated views per month for {len(rows)} routes, ranks deferred')
+            return
+
+        # Take the routes' old values out of the ranking
+        cursor.execute(f'SELECT views_per_month FROM route_views_per_month WHERE page_id IN ({placeholders})',
+                       page_ids)
+        old_values = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'DELETE FROM route_views_per_month WHERE page_id IN ({placeholders})', page_ids)
+
+        new_values = [row[5] for row in rows]
+        for low, high, shift in rank_shifts(old_values, new_values):
+            if low is None:
+                cursor.execute('UPDATE route_views_per_month SET `rank` = `rank` + %s '
+                               'WHERE views_per_month < %s OR views_per_month IS NULL', (shift, high))
+            elif high is None:
+                cursor.execute('UPDATE route_views_per_month SET `rank` = `rank` + %s '
+                               'WHERE views_per_month >= %s', (shift, low))
+            else:
+                cursor.execute('UPDATE route_views_per_month SET `rank` = `rank` + %s '
+                               'WHERE views_per_month >= %s AND views_per_month < %s', (shift, low, high))
+
+        # New routes rank behind every higher route already stored or in this batch
+        ranked_rows = []
+        for row in rows:
+            views_per_month = row[5]
+            if views_per_month is None:
+                cursor.execute('SELECT COUNT(*) FROM route_views_per_month WHERE views_per_month IS NOT NULL')
+                higher = cursor.fetchone()[0] + sum(value is not None for value in new_values)
+            else:
+                cursor.execute('SELECT COUNT(*) FROM route_views_per_month WHERE views_per_month > %s',
+                               (views_per_month,))
+                higher = cursor.fetchone()[0] + sum(value is not None and value > views_per_month
+                                                    for value in new_values)
+            ranked_rows.append(row + (higher + 1,))
+
+        cursor.executemany("""
+            INSERT INTO route_views_per_month (page_id, date_added, date_grabbed, total_views, month_count,
+                                               views_per_month, `rank`)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, ranked_rows)
+        logging.info(f'Updated views per month for {len(ranked_rows)} routes')
+
+    except Exception as e:
+        logging.error(f'Error updating views per month: {e}', exc_info=True)
+        raise
+
+
 # Grab route urls to process from database (only processes route pages)
 def get_urls(cursor):
     try:
@@ -237,6 +523,31 @@ def get_title_categories():
         logging.error(f'Error getting title categories: {e}', exc_info=True)
 
 
+# Split the 'Type:' cell into route types, distance, pitches, and fixed hardware
+def split_route_type(long_route_type):
+    type_text = (long_route_type.replace('\n', ' ').replace('  ', '').
+                 replace('Fixed Hardware', ', Fixed Hardware:'))
+    split_type = type_text.split(', ')
+    distance = 0
+    pitches = 1
+    fixed_pieces = 0
+    route_type = []
+    for item in split_type:
+        if 'ft' in item:
+            distance = int(item.split(' ft ')[0])
+
+        elif 'pitches' in item:
+            pitches = int(item.replace(' pitches', ''))
+
+        elif 'Fixed Hardware:' in item:
+            fixed_pieces = int(item.replace('Fixed Hardware:', '').replace('(', '').replace(')', ''))
+
+        else:
+            route_type.append(item)
+
+    return [', '.join(route_type), distance, pitches, fixed_pieces]
+
+
 # Get information for each route with rate limiting
 @sleep_and_retry
 @limits(calls=CALLS_PER_PERIOD, period=TIME_PERIOD)
@@ -314,27 +625,8 @@ def route_grabber(page_id, url, last_update, retry=True):
             type_cell = soup.find('td', string='Type:')
             if type_cell:
                 long_route_type = type_cell.find_next('td').get_text(strip=True)
-                type_text = (long_route_type.replace('\n', ' ').replace('  ', '').
-                             replace('Fixed Hardware', ', Fixed Hardware:'))
-                split_type = type_text.split(', ')
-                distance = 0
-                pitches = 1
-                fixed_pieces = 0
-                route_type = []
-                for item in split_type:
-                    if 'ft' in item:
-                        distance = int(item.split(' ft ')[0])
-
-                    elif 'pitches' in item:
-                        pitches = int(item.replace(' pitches', ''))
-
-                    elif 'Fixed Hardware:' in item:
-                        fixed_pieces = int(item.replace('Fixed Hardware:', '').replace('(', '').replace(')', ''))
-
-                    else:
-                        route_type.append(item)
-
-                route_type = ', '.join(route_type)
+                route_type, distance, pitches, fixed_pieces = ROUTE_TYPE_CACHE.get(long_route_type,
+                                                                                   split_route_type)
 
             else:
                 logging.error(f"Couldn't find Route Type for {route_name}")
@@ -414,15 +706,21 @@ def route_grabber(page_id, url, last_update, retry=True):
     return None
 
 
-# Main execution
-def main():
+# Main execution, page_ids limits the run to a change set. Returns the page_ids that were (re-)scraped
+def main(page_ids=None):
     setup_logging()
+    changed_page_ids = set()
 
     try:
-        with connect_to_db() as conn:
+        with database.connect_raw() as conn:
             cursor = conn.cursor()
-            # Create the table if it doesn't exist
+            # Create the tables if they don't exist
             create_table(cursor)
+            migrate_text_columns(conn, cursor)
+            create_views_table(cursor)
+            create_type_tables(cursor)
+            for query in route_history.HISTORY_TABLE_QUERIES:
+                cursor.execute(query)
 
             # Get a list of url's to process
             urls_list = get_urls(cursor)
@@ -430,10 +728,16 @@ def main():
             # Get a list of url's that have already been processed and take them out of the urls_list
             processed_urls_list = get_processed_data(cursor)
             filtered_list = list(set(urls_list).difference(processed_urls_list))
+            if page_ids is not None:
+                page_ids = set(page_ids)
+                filtered_list = [url for url in filtered_list if url[0] in page_ids]
             logging.info(f'URLs list is {len(urls_list)} rows long')
             logging.info(f'Processed list is {len(processed_urls_list)} rows long')
             logging.info(f'Filtered list is {len(filtered_list)} rows long')
 
+            # Large runs rank every route once at the end instead of shifting ranks per batch
+            shift_ranks = not defer_ranks(cursor, len(filtered_list))
+
             # Track time it takes to process each batch
             batch_times = []
 
@@ -448,7 +752,11 @@ def main():
                 route_info_list = [dictionary for dictionary in site_data if dictionary is not None]
 
                 insert_data(cursor, route_info_list)
+                update_views_per_month(cursor, route_info_list, shift_ranks=shift_ranks)
+                update_route_types(cursor, route_info_list)
+                record_route_history(cursor, route_info_list)
                 conn.commit()
+                changed_page_ids.update(int(route_info['Page ID']) for route_info in route_info_list)
 
                 batch_times.append((time.time() - start_time) / len(route_info_list))
                 logging.info(f'Data was just inserted for batch {int(i / BATCH_SIZE)} of length {len(route_info_list)}')
@@ -457,14 +765,22 @@ def main():
                 print(f'Data was just inserted for batch: {int(i / BATCH_SIZE)}, length: {len(route_info_list)}')
                 print(f'Projected time remaining is: {(mean(batch_times) * len(filtered_list[i:]) / 3600)} hours')
 
+            if not shift_ranks:
+                recompute_ranks(cursor)
+                conn.commit()
+
     except Exception as e:
         logging.error(f'Error occurred in main function:', exc_info=True)
         print(f'Error occurred in main function processing batch: {e}')
+        raise
 
     finally:
+        ROUTE_TYPE_CACHE.save()
         cursor.close()
         conn.close()
 
+    return changed_page_ids
+
 
 ### Run ###
 if __name__ == '__main__':
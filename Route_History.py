@@ -0,0 +1,200 @@
+import os
+import logging
+import datetime
+from sqlalchemy import text, bindparam
+import Database as database
+
+### CONFIGURATION ###
+
+# Log Folder
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Route History ({datetime.date.today()}).log'
+
+# Every change is kept for MONTHLY_AFTER_DAYS, older history is thinned to the last value in each month,
+# and after YEARLY_AFTER_DAYS to the last value in each year
+MONTHLY_AFTER_DAYS = 90
+YEARLY_AFTER_DAYS = 730
+
+# History older than this is dropped (None keeps it forever)
+RETENTION_DAYS = None
+
+# page_ids per compaction statement, keeps each DELETE's locks short
+COMPACT_CHUNK = 50000
+
+# Warn when the history tables grow past this multiple of the tables they track
+MAX_SIZE_RATIO = 2.0
+
+# Append-only history written by the grabbers. A row is only added when a value differs from the
+# route's previous row, and values are integers (stars_centi is the average star rating * 100)
+HISTORY_TABLE_QUERIES = ["""
+    CREATE TABLE IF NOT EXISTS route_history (
+        page_id INT,
+        date_grabbed DATE,
+        views INT UNSIGNED,
+        votes MEDIUMINT UNSIGNED,
+        stars_centi SMALLINT UNSIGNED,
+        PRIMARY KEY (page_id, date_grabbed)
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS stats_history (
+        page_id INT,
+        date_added DATE,
+        stars MEDIUMINT UNSIGNED,
+        ratings MEDIUMINT UNSIGNED,
+        todos MEDIUMINT UNSIGNED,
+        ticks MEDIUMINT UNSIGNED,
+        PRIMARY KEY (page_id, date_added)
+    )
+"""]
+
+# History table -> (date column, value columns, table it tracks)
+HISTORY_COLUMNS = {
+    'route_history': ('date_grabbed', ['views', 'votes', 'stars_centi'], 'mp_route_info'),
+    'stats_history': ('date_added', ['stars', 'ratings', 'todos', 'ticks'], 'stats_count'),
+}
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Append (page_id, date, *values) rows whose values changed since the route's latest row. Takes a DBAPI
+# cursor so Route_Grabber's raw connection and Stats_Grabber's pooled one write it in their own transaction
+def record_history(cursor, table_name, rows):
+    try:
+        if len(rows) == 0:
+            return 0
+        date_column, value_columns, _ = HISTORY_COLUMNS[table_name]
+        page_ids = [row[0] for row in rows]
+        placeholders = ', '.join(['%s'] * len(page_ids))
+
+        cursor.execute(f"""
+            SELECT h.page_id, h.{date_column}, {', '.join(f'h.{column}' for column in value_columns)}
+            FROM {table_name} h
+            JOIN (SELECT page_id, MAX({date_column}) AS latest
+                  FROM {table_name} WHERE page_id IN ({placeholders}) GROUP BY page_id) l
+              ON l.page_id = h.page_id AND l.latest = h.{date_column}
+        """, page_ids)
+        latest = {row[0]: tuple(row[2:]) for row in cursor.fetchall()}
+
+        changed_rows = [row for row in rows if latest.get(row[0]) != tuple(row[2:])]
+        if len(changed_rows) > 0:
+            columns = ['page_id', date_column] + value_columns
+            cursor.executemany(f"""
+                INSERT INTO {table_name} ({', '.join(columns)})
+                VALUES ({', '.join(['%s'] * len(columns))})
+                ON DUPLICATE KEY UPDATE {', '.join(f'{column} = VALUES({column})' for column in value_columns)}
+            """, changed_rows)
+
+        return len(changed_rows)
+
+    except Exception as e:
+        logging.error(f'Error recording {table_name}: {e}', exc_info=True)
+        raise
+
+
+# Thin history older than the cutoffs down to the last row per month, then per year, and drop anything
+# past RETENTION_DAYS. page_ids limits the pass to a change set
+def compact_history(conn, table_name, page_ids=None, today=None):
+    date_column = HISTORY_COLUMNS[table_name][0]
+    today = today or datetime.date.today()
+
+    if page_ids is not None:
+        page_ids = sorted(page_ids)
+        page_filters = [(f'page_id IN :page_ids', {'page_ids': page_ids[i:i + COMPACT_CHUNK]})
+                        for i in range(0, len(page_ids), COMPACT_CHUNK)]
+    else:
+        bounds = conn.execute(text(f'SELECT MIN(page_id), MAX(page_id) FROM {table_name}')).fetchone()
+        if bounds[0] is None:
+            return 0
+        page_filters = [('page_id BETWEEN :low AND :high', {'low': low, 'high': low + COMPACT_CHUNK - 1})
+                        for low in range(bounds[0], bounds[1] + 1, COMPACT_CHUNK)]
+
+    deleted = 0
+    for page_filter, params in page_filters:
+        for cutoff_days, period_format in [(MONTHLY_AFTER_DAYS, '%Y-%m'), (YEARLY_AFTER_DAYS, '%Y')]:
+            query = text(f"""
+                DELETE h FROM {table_name} h
+                JOIN (SELECT page_id, DATE_FORMAT({date_column}, '{period_format}') AS period,
+                             MAX({date_column}) AS keep_date
+                      FROM {table_name}
+                      WHERE {date_column} < :cutoff AND {page_filter}
+                      GROUP BY page_id, period) k
+                  ON k.page_id = h.page_id AND k.period = DATE_FORMAT(h.{date_column}, '{period_format}')
+                WHERE h.{date_column} < k.keep_date
+            """)
+            if 'page_ids' in params:
+                query = query.bindparams(bindparam('page_ids', expanding=True))
+            cutoff = today - datetime.timedelta(days=cutoff_days)
+            deleted += conn.execute(query, {**params, 'cutoff': cutoff}).rowcount
+
+        if RETENTION_DAYS is not None:
+            query = text(f'DELETE FROM {table_name} WHERE {date_column} < :cutoff AND {page_filter}')
+            if 'page_ids' in params:
+                query = query.bindparams(bindparam('page_ids', expanding=True))
+            cutoff = today - datetime.timedelta(days=RETENTION_DAYS)
+            deleted += conn.execute(query, {**params, 'cutoff': cutoff}).rowcount
+
+        conn.commit()
+
+    logging.info(f'Compacted {table_name}, removed {deleted} rows')
+    return deleted
+
+
+# Compare the on-disk size of each history table with the table it tracks
+def check_sizes(conn):
+    sizes = dict(conn.execute(text("""
+        SELECT table_name, data_length + index_length
+        FROM information_schema.tables
+        WHERE table_schema = DATABASE()
+    """)).fetchall())
+
+    for table_name, (_, _, base_table) in HISTORY_COLUMNS.items():
+        history_size, base_size = sizes.get(table_name) or 0, sizes.get(base_table) or 0
+        ratio = history_size / base_size if base_size else 0
+        logging.info(f'{table_name} is {history_size / 2 ** 20:.1f} MB, {ratio:.2f}x {base_table}')
+        if ratio > MAX_SIZE_RATIO:
+            logging.warning(f'{table_name} is over {MAX_SIZE_RATIO}x {base_table}, consider shorter retention')
+            print(f'{table_name} is {ratio:.2f}x {base_table}, consider shorter retention')
+
+
+# Main execution, page_ids limits compaction to a change set. Returns the page_ids that were compacted
+def main(page_ids=None):
+    setup_logging()
+    compacted_page_ids = set()
+
+    try:
+        with database.connect_to_db() as conn:
+            for query in HISTORY_TABLE_QUERIES:
+                conn.execute(text(query))
+            conn.commit()
+
+            for table_name in HISTORY_COLUMNS:
+                compact_history(conn, table_name, page_ids)
+            check_sizes(conn)
+
+            if page_ids is not None:
+                compacted_page_ids.update(page_ids)
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+        raise
+
+    return compacted_page_ids
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
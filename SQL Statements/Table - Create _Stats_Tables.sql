@@ -1,7 +1,13 @@
+CREATE TABLE IF NOT EXISTS stats_users (
+	user_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+	name VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+	UNIQUE KEY name_key (name));
+
 CREATE TABLE IF NOT EXISTS stats_ticks (
 	table_count INT AUTO_INCREMENT PRIMARY KEY,
+	item_id BIGINT UNSIGNED,
     page_id INT,
-	user VARCHAR(255),
+	user_id INT UNSIGNED,
     date DATE,
     style VARCHAR(255),
     leadStyle VARCHAR(255),
@@ -9,13 +15,17 @@ CREATE TABLE IF NOT EXISTS stats_ticks (
     text TEXT,
     comment TEXT,
     createdAt DATE,
-    updatedAt DATE);
+    updatedAt DATE,
+    UNIQUE KEY item_key (item_id),
+    INDEX page_idx (page_id),
+    INDEX user_idx (user_id));
               
 
 CREATE TABLE IF NOT EXISTS stats_ratings (
 	table_count INT AUTO_INCREMENT PRIMARY KEY,
+	item_id BIGINT UNSIGNED,
 	page_id INT,
-	user VARCHAR(255),
+	user_id INT UNSIGNED,
 	allRatings VARCHAR(255),
     rockRating VARCHAR(255),
     iceRating VARCHAR(255),
@@ -24,24 +34,41 @@ CREATE TABLE IF NOT EXISTS stats_ratings (
     mixedRating VARCHAR(255),
     snowRating VARCHAR(255),
     safteyRating TEXT,
+    rockRatingOrder INT,
+    iceRatingOrder INT,
+    aidRatingOrder INT,
+    boulderRatingOrder INT,
+    mixedRatingOrder INT,
+    snowRatingOrder INT,
 	createdAt DATE,
-	updatedAt DATE);
+	updatedAt DATE,
+	UNIQUE KEY item_key (item_id),
+	INDEX page_idx (page_id),
+	INDEX user_idx (user_id));
 
 
 CREATE TABLE IF NOT EXISTS stats_stars (
 	table_count INT AUTO_INCREMENT PRIMARY KEY,
+	item_id BIGINT UNSIGNED,
 	page_id INT,
-	user VARCHAR(255),
+	user_id INT UNSIGNED,
 	score VARCHAR(255),
 	createdAt DATE,
-	updatedAt DATE);
+	updatedAt DATE,
+	UNIQUE KEY item_key (item_id),
+	INDEX page_idx (page_id),
+	INDEX user_idx (user_id));
                 
 CREATE TABLE IF NOT EXISTS stats_todos (
 	table_count INT AUTO_INCREMENT PRIMARY KEY,
+	item_id BIGINT UNSIGNED,
 	page_id INT,
-	user VARCHAR(255),
+	user_id INT UNSIGNED,
 	createdAt DATE,
-	updatedAt DATE);
+	updatedAt DATE,
+	UNIQUE KEY item_key (item_id),
+	INDEX page_idx (page_id),
+	INDEX user_idx (user_id));
 
      
 CREATE TABLE IF NOT EXISTS stats_count (
@@ -50,4 +77,10 @@ CREATE TABLE IF NOT EXISTS stats_count (
 	stars INT,
 	ratings INT,
 	todos INT,
-    ticks INT);
\ No newline at end of file
+	ticks INT,
+	stored_stars INT DEFAULT 0,
+	stored_ratings INT DEFAULT 0,
+	stored_todos INT DEFAULT 0,
+	stored_ticks INT DEFAULT 0,
+	check_pending TINYINT DEFAULT 1,
+	INDEX check_pending_idx (check_pending));
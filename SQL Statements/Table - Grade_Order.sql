@@ -0,0 +1,39 @@
+-- One-off migration adding rating ordinals to stats_ratings. Grade_Cleaner writes the grade_order lookup
+-- table and adds and backfills route_grades.Grade_Order itself. Run the ALTER before Stats_Grabber next
+-- writes ratings, and the updates once Grade_Cleaner has run so grade_order exists.
+ALTER TABLE stats_ratings
+	ADD COLUMN rockRatingOrder INT,
+	ADD COLUMN iceRatingOrder INT,
+	ADD COLUMN aidRatingOrder INT,
+	ADD COLUMN boulderRatingOrder INT,
+	ADD COLUMN mixedRatingOrder INT,
+	ADD COLUMN snowRatingOrder INT;
+
+-- Ratings are cleaned the way Grade_Cleaner.clean_grade cleans route_grades ('5.10-' -> '5.10a', '+' -> 'd'),
+-- so a grade has the same ordinal in both tables. The updates can be re-run on their own to fix older rows
+UPDATE stats_ratings sr LEFT JOIN grade_order go
+	ON go.Grade = REPLACE(REPLACE(REPLACE(sr.rockRating, 'V-easy', 'V Easy'), '+', 'd'), '-', 'a')
+SET sr.rockRatingOrder = go.Grade_Order;
+UPDATE stats_ratings sr LEFT JOIN grade_order go
+	ON go.Grade = REPLACE(REPLACE(REPLACE(sr.iceRating, 'V-easy', 'V Easy'), '+', 'd'), '-', 'a')
+SET sr.iceRatingOrder = go.Grade_Order;
+UPDATE stats_ratings sr LEFT JOIN grade_order go
+	ON go.Grade = REPLACE(REPLACE(REPLACE(sr.aidRating, 'V-easy', 'V Easy'), '+', 'd'), '-', 'a')
+SET sr.aidRatingOrder = go.Grade_Order;
+UPDATE stats_ratings sr LEFT JOIN grade_order go
+	ON go.Grade = REPLACE(REPLACE(REPLACE(sr.boulderRating, 'V-easy', 'V Easy'), '+', 'd'), '-', 'a')
+SET sr.boulderRatingOrder = go.Grade_Order;
+UPDATE stats_ratings sr LEFT JOIN grade_order go
+	ON go.Grade = REPLACE(REPLACE(REPLACE(sr.mixedRating, 'V-easy', 'V Easy'), '+', 'd'), '-', 'a')
+SET sr.mixedRatingOrder = go.Grade_Order;
+UPDATE stats_ratings sr LEFT JOIN grade_order go
+	ON go.Grade = REPLACE(REPLACE(REPLACE(sr.snowRating, 'V-easy', 'V Easy'), '+', 'd'), '-', 'a')
+SET sr.snowRatingOrder = go.Grade_Order;
+
+-- Example range scan: 5.10a-5.11d sport routes in Colorado
+-- SELECT rg.page_id FROM route_grades rg
+-- JOIN mp_route_info mr ON mr.page_id = rg.page_id
+-- WHERE rg.Type = 'Rock'
+--   AND rg.Grade_Order BETWEEN (SELECT Grade_Order FROM grade_order WHERE Grade = '5.10a')
+--                          AND (SELECT Grade_Order FROM grade_order WHERE Grade = '5.11d')
+--   AND mr.route_type LIKE '%Sport%' AND mr.location LIKE 'Colorado%';
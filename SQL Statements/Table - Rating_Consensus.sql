@@ -0,0 +1,27 @@
+-- Grade votes parsed from stats_ratings.allRatings by Rating_Consensus.py, rebuilt for refreshed routes
+-- after Stats_Grabber and Grade_Cleaner. Ordinals come from grade_order.csv, listed_order from route_grades.
+CREATE TABLE IF NOT EXISTS rating_histogram (
+	page_id INT,
+	Type VARCHAR(16),
+	Grade VARCHAR(32),
+	Grade_Order INT,
+	votes INT UNSIGNED,
+	PRIMARY KEY (page_id, Type, Grade_Order));
+
+CREATE TABLE IF NOT EXISTS rating_consensus (
+	page_id INT,
+	Type VARCHAR(16),
+	votes INT UNSIGNED,
+	mean_order DOUBLE,
+	median_order DOUBLE,
+	listed_order INT,
+	spread DOUBLE,
+	PRIMARY KEY (page_id, Type),
+	INDEX type_spread_idx (Type, spread));
+
+-- Example: the most sandbagged rock routes with at least 20 votes
+-- SELECT mr.name, mr.grade, rc.votes, rc.mean_order, rc.listed_order, rc.spread
+-- FROM rating_consensus rc
+-- JOIN mp_route_info mr ON mr.page_id = rc.page_id
+-- WHERE rc.Type = 'Rock' AND rc.votes >= 20
+-- ORDER BY rc.spread DESC LIMIT 50;
@@ -0,0 +1,6 @@
+-- One-off migration for route_grades tables created by the old replace-load, which dropped all indexes.
+ALTER TABLE route_grades
+	MODIFY page_id INT NOT NULL,
+	MODIFY Type VARCHAR(16) NOT NULL,
+	MODIFY Grade VARCHAR(32),
+	ADD PRIMARY KEY (page_id, Type);
@@ -0,0 +1,35 @@
+-- Append-only history of route popularity. Route_Grabber and Stats_Grabber add a row only when a value
+-- changed since the route's previous row; Route_History.py thins old rows to monthly, then yearly.
+CREATE TABLE IF NOT EXISTS route_history (
+	page_id INT,
+	date_grabbed DATE,
+	views INT UNSIGNED,
+	votes MEDIUMINT UNSIGNED,
+	stars_centi SMALLINT UNSIGNED,  -- average stars * 100
+	PRIMARY KEY (page_id, date_grabbed)
+);
+
+CREATE TABLE IF NOT EXISTS stats_history (
+	page_id INT,
+	date_added DATE,
+	stars MEDIUMINT UNSIGNED,
+	ratings MEDIUMINT UNSIGNED,
+	todos MEDIUMINT UNSIGNED,
+	ticks MEDIUMINT UNSIGNED,
+	PRIMARY KEY (page_id, date_added)
+);
+
+-- Seed both with the current values so the first scrape only adds changes
+INSERT IGNORE INTO route_history (page_id, date_grabbed, views, votes, stars_centi)
+SELECT page_id, date_grabbed, views, votes, ROUND(stars * 100)
+FROM mp_route_info
+WHERE date_grabbed IS NOT NULL;
+
+INSERT IGNORE INTO stats_history (page_id, date_added, stars, ratings, todos, ticks)
+SELECT page_id, date_added, stars, ratings, todos, ticks
+FROM stats_count
+WHERE date_added IS NOT NULL;
+
+-- Example: monthly page view growth for one route
+-- SELECT date_grabbed, views, views - LAG(views) OVER (ORDER BY date_grabbed) AS new_views
+-- FROM route_history WHERE page_id = 105748391 ORDER BY date_grabbed;
@@ -0,0 +1,14 @@
+-- Route text blobs (json lists of 'title - text' strings), kept out of mp_route_info so scans of its
+-- metadata only read fixed-width columns. Route_Grabber creates this and, on its first run against an
+-- older mp_route_info, copies the text across in page_id batches and drops the old columns.
+CREATE TABLE IF NOT EXISTS route_text (
+	page_id INT PRIMARY KEY,
+	description TEXT,
+	protection TEXT,
+	directions TEXT,
+	misc TEXT
+) ROW_FORMAT=COMPRESSED;
+
+-- Example: a route's metadata with its description
+-- SELECT mr.name, mr.grade, rt.description FROM mp_route_info mr
+-- JOIN route_text rt ON rt.page_id = mr.page_id WHERE mr.page_id = 105748391;
@@ -0,0 +1,46 @@
+-- Route type dimension and page_id -> route type bridge. Route_Grabber writes both as it scrapes, this
+-- script creates them and backfills the routes already in mp_route_info (any number of types per route).
+CREATE TABLE IF NOT EXISTS route_types (
+	route_type_id INT AUTO_INCREMENT PRIMARY KEY,
+	route_type VARCHAR(100) COLLATE utf8mb4_bin UNIQUE
+);
+
+-- Route types are compared exactly, types differing only in case or accent are kept apart
+ALTER TABLE route_types MODIFY route_type VARCHAR(100) COLLATE utf8mb4_bin;
+
+CREATE TABLE IF NOT EXISTS route_type_bridge (
+	page_id INT,
+	route_type_id INT,
+	PRIMARY KEY (page_id, route_type_id),
+	INDEX route_type_idx (route_type_id, page_id)
+);
+
+-- Split route_type on ', ' one piece per recursion step
+CREATE TEMPORARY TABLE split_route_types AS
+WITH RECURSIVE split AS (
+	SELECT
+		page_id,
+		SUBSTRING_INDEX(route_type, ', ', 1) AS route_type,
+		IF(LOCATE(', ', route_type) > 0, SUBSTRING(route_type, LOCATE(', ', route_type) + 2), NULL) AS remainder
+	FROM mp_route_info
+	WHERE route_type IS NOT NULL AND route_type <> ''
+UNION ALL
+	SELECT
+		page_id,
+		SUBSTRING_INDEX(remainder, ', ', 1),
+		IF(LOCATE(', ', remainder) > 0, SUBSTRING(remainder, LOCATE(', ', remainder) + 2), NULL)
+	FROM split
+	WHERE remainder IS NOT NULL
+)
+SELECT DISTINCT page_id, CONVERT(route_type USING utf8mb4) COLLATE utf8mb4_bin AS route_type
+FROM split WHERE route_type <> '';
+
+INSERT IGNORE INTO route_types (route_type)
+SELECT DISTINCT route_type FROM split_route_types;
+
+INSERT IGNORE INTO route_type_bridge (page_id, route_type_id)
+SELECT s.page_id, rt.route_type_id
+FROM split_route_types s
+JOIN route_types rt ON rt.route_type = s.route_type;
+
+DROP TEMPORARY TABLE split_route_types;
@@ -0,0 +1,57 @@
+-- Materialized replacement for the old route_views_per_month view. Route_Grabber keeps this table up to
+-- date as it scrapes, using each route's date_grabbed as the reference date and shifting ranks
+-- incrementally. This script swaps out the view and backfills every route already scraped.
+DROP VIEW IF EXISTS route_views_per_month;
+
+CREATE TABLE IF NOT EXISTS route_views_per_month (
+	page_id INT PRIMARY KEY,
+	date_added DATE,
+	date_grabbed DATE,
+	total_views INT,
+	month_count DOUBLE,
+	views_per_month DOUBLE,
+	`rank` INT,
+	INDEX views_per_month_idx (views_per_month),
+	INDEX rank_idx (`rank`)
+);
+
+-- Whole months are worked out once per route, then the part of the following month is added
+INSERT INTO route_views_per_month (page_id, date_added, date_grabbed, total_views, month_count, views_per_month)
+SELECT
+	page_id,
+	date_added,
+	date_grabbed,
+	views,
+	month_count,
+	views / NULLIF(month_count, 0)
+FROM (
+	SELECT
+		page_id,
+		date_added,
+		date_grabbed,
+		views,
+		months + DATEDIFF(date_grabbed, date_added + INTERVAL months MONTH) /
+			DATEDIFF(date_added + INTERVAL months + 1 MONTH, date_added + INTERVAL months MONTH) AS month_count
+	FROM (
+		SELECT page_id, date_added, date_grabbed, views, TIMESTAMPDIFF(MONTH, date_added, date_grabbed) AS months
+		FROM mp_route_info
+		WHERE date_added IS NOT NULL AND views IS NOT NULL
+	) whole_months
+) counted
+ON DUPLICATE KEY UPDATE
+	date_added = VALUES(date_added),
+	date_grabbed = VALUES(date_grabbed),
+	total_views = VALUES(total_views),
+	month_count = VALUES(month_count),
+	views_per_month = VALUES(views_per_month);
+
+-- One full ranking pass. After this Route_Grabber shifts the ranks its batches affect, or re-runs this
+-- pass at the end of a run that scrapes a large share of the routes
+UPDATE route_views_per_month rv
+JOIN (
+	SELECT page_id, RANK() OVER (ORDER BY views_per_month DESC) AS new_rank
+	FROM route_views_per_month
+) ranked ON ranked.page_id = rv.page_id
+SET rv.`rank` = ranked.new_rank;
+
+SELECT * FROM route_views_per_month ORDER BY `rank`
@@ -0,0 +1,27 @@
+-- One-off migration adding the stored-row counters Stats_Grabber maintains at write time.
+ALTER TABLE stats_count
+	ADD COLUMN stored_stars INT DEFAULT 0,
+	ADD COLUMN stored_ratings INT DEFAULT 0,
+	ADD COLUMN stored_todos INT DEFAULT 0,
+	ADD COLUMN stored_ticks INT DEFAULT 0,
+	ADD COLUMN check_pending TINYINT DEFAULT 1,
+	ADD INDEX check_pending_idx (check_pending);
+
+-- Backfill the counters once, every later write keeps them up to date
+UPDATE stats_count sc
+LEFT JOIN (SELECT page_id, COUNT(*) AS stored FROM stats_stars GROUP BY page_id) s ON s.page_id = sc.page_id
+SET sc.stored_stars = COALESCE(s.stored, 0);
+
+UPDATE stats_count sc
+LEFT JOIN (SELECT page_id, COUNT(*) AS stored FROM stats_ratings GROUP BY page_id) r ON r.page_id = sc.page_id
+SET sc.stored_ratings = COALESCE(r.stored, 0);
+
+UPDATE stats_count sc
+LEFT JOIN (SELECT page_id, COUNT(*) AS stored FROM stats_todos GROUP BY page_id) td ON td.page_id = sc.page_id
+SET sc.stored_todos = COALESCE(td.stored, 0);
+
+UPDATE stats_count sc
+LEFT JOIN (SELECT page_id, COUNT(*) AS stored FROM stats_ticks GROUP BY page_id) ti ON ti.page_id = sc.page_id
+SET sc.stored_ticks = COALESCE(ti.stored, 0);
+
+UPDATE stats_count SET check_pending = 1;
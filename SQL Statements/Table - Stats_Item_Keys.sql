@@ -0,0 +1,34 @@
+-- One-off migration (run after Table - Stats_Users.sql) keying the stats tables on the site's item id.
+-- The (page_id, user_id, createdAt, ...) natural keys merged different anonymous users who rated the same
+-- route on the same day, and NULL dates/styles never matched so retried ticks still duplicated.
+-- Rows stored before this have no item_id (repeated NULLs are allowed by the unique key); Stats_Grabber
+-- deletes and re-fetches each route's stats on its 30 day refresh, which fills them in.
+ALTER TABLE stats_ticks
+	ADD COLUMN item_id BIGINT UNSIGNED AFTER table_count,
+	DROP KEY natural_key,
+	ADD UNIQUE KEY item_key (item_id),
+	ADD INDEX page_idx (page_id);
+
+ALTER TABLE stats_ratings
+	ADD COLUMN item_id BIGINT UNSIGNED AFTER table_count,
+	DROP KEY natural_key,
+	ADD UNIQUE KEY item_key (item_id),
+	ADD INDEX page_idx (page_id);
+
+ALTER TABLE stats_stars
+	ADD COLUMN item_id BIGINT UNSIGNED AFTER table_count,
+	DROP KEY natural_key,
+	ADD UNIQUE KEY item_key (item_id),
+	ADD INDEX page_idx (page_id);
+
+ALTER TABLE stats_todos
+	ADD COLUMN item_id BIGINT UNSIGNED AFTER table_count,
+	DROP KEY natural_key,
+	ADD UNIQUE KEY item_key (item_id),
+	ADD INDEX page_idx (page_id);
+
+-- Check: rows still waiting for their route's refresh
+-- SELECT 'ticks', COUNT(*) FROM stats_ticks WHERE item_id IS NULL
+-- UNION ALL SELECT 'ratings', COUNT(*) FROM stats_ratings WHERE item_id IS NULL
+-- UNION ALL SELECT 'stars', COUNT(*) FROM stats_stars WHERE item_id IS NULL
+-- UNION ALL SELECT 'todos', COUNT(*) FROM stats_todos WHERE item_id IS NULL;
@@ -0,0 +1,38 @@
+-- One-off migration for stats tables created before the natural keys were added.
+-- Keeps the first copy of every duplicated row, then enforces the keys used by Stats_Grabber's upserts.
+DELETE t1 FROM stats_ticks t1
+JOIN stats_ticks t2
+	ON t1.page_id = t2.page_id
+	AND t1.user <=> t2.user
+	AND t1.createdAt <=> t2.createdAt
+	AND t1.date <=> t2.date
+	AND t1.style <=> t2.style
+	AND t1.leadStyle <=> t2.leadStyle
+	AND t1.pitches <=> t2.pitches
+	AND t1.table_count > t2.table_count;
+
+DELETE t1 FROM stats_ratings t1
+JOIN stats_ratings t2
+	ON t1.page_id = t2.page_id
+	AND t1.user <=> t2.user
+	AND t1.createdAt <=> t2.createdAt
+	AND t1.table_count > t2.table_count;
+
+DELETE t1 FROM stats_stars t1
+JOIN stats_stars t2
+	ON t1.page_id = t2.page_id
+	AND t1.user <=> t2.user
+	AND t1.createdAt <=> t2.createdAt
+	AND t1.table_count > t2.table_count;
+
+DELETE t1 FROM stats_todos t1
+JOIN stats_todos t2
+	ON t1.page_id = t2.page_id
+	AND t1.user <=> t2.user
+	AND t1.createdAt <=> t2.createdAt
+	AND t1.table_count > t2.table_count;
+
+ALTER TABLE stats_ticks ADD UNIQUE KEY natural_key (page_id, user(100), createdAt, date, style(50), leadStyle(50), pitches);
+ALTER TABLE stats_ratings ADD UNIQUE KEY natural_key (page_id, user, createdAt);
+ALTER TABLE stats_stars ADD UNIQUE KEY natural_key (page_id, user, createdAt);
+ALTER TABLE stats_todos ADD UNIQUE KEY natural_key (page_id, user, createdAt);
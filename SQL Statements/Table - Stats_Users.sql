@@ -0,0 +1,67 @@
+-- One-off migration moving the stats tables from repeated user names to integer ids.
+-- Every distinct name gets one stats_users row, then each table swaps its user column for user_id.
+CREATE TABLE IF NOT EXISTS stats_users (
+	user_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+	name VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+	UNIQUE KEY name_key (name));
+
+-- Names are compared in utf8mb4_bin like stats_users, the tables' default collation would fold 'Bob'/'bob'
+-- and 'José'/'Jose' into one name and leave the other spelling without an id
+INSERT IGNORE INTO stats_users (name)
+SELECT DISTINCT name FROM (
+	SELECT CONVERT(user USING utf8mb4) COLLATE utf8mb4_bin AS name FROM stats_ticks
+	UNION ALL SELECT CONVERT(user USING utf8mb4) COLLATE utf8mb4_bin FROM stats_ratings
+	UNION ALL SELECT CONVERT(user USING utf8mb4) COLLATE utf8mb4_bin FROM stats_stars
+	UNION ALL SELECT CONVERT(user USING utf8mb4) COLLATE utf8mb4_bin FROM stats_todos
+) names
+WHERE name IS NOT NULL;
+
+ALTER TABLE stats_ticks ADD COLUMN user_id INT UNSIGNED AFTER page_id;
+UPDATE stats_ticks t JOIN stats_users u ON u.name = CONVERT(t.user USING utf8mb4) COLLATE utf8mb4_bin
+SET t.user_id = u.user_id;
+
+ALTER TABLE stats_ratings ADD COLUMN user_id INT UNSIGNED AFTER page_id;
+UPDATE stats_ratings t JOIN stats_users u ON u.name = CONVERT(t.user USING utf8mb4) COLLATE utf8mb4_bin
+SET t.user_id = u.user_id;
+
+ALTER TABLE stats_stars ADD COLUMN user_id INT UNSIGNED AFTER page_id;
+UPDATE stats_stars t JOIN stats_users u ON u.name = CONVERT(t.user USING utf8mb4) COLLATE utf8mb4_bin
+SET t.user_id = u.user_id;
+
+ALTER TABLE stats_todos ADD COLUMN user_id INT UNSIGNED AFTER page_id;
+UPDATE stats_todos t JOIN stats_users u ON u.name = CONVERT(t.user USING utf8mb4) COLLATE utf8mb4_bin
+SET t.user_id = u.user_id;
+
+-- Every named row must have an id before the name column goes. Stop here unless this returns 0 for each table
+SELECT 'ticks' AS stats_table, COUNT(*) AS unmapped FROM stats_ticks WHERE user IS NOT NULL AND user_id IS NULL
+UNION ALL SELECT 'ratings', COUNT(*) FROM stats_ratings WHERE user IS NOT NULL AND user_id IS NULL
+UNION ALL SELECT 'stars', COUNT(*) FROM stats_stars WHERE user IS NOT NULL AND user_id IS NULL
+UNION ALL SELECT 'todos', COUNT(*) FROM stats_todos WHERE user IS NOT NULL AND user_id IS NULL;
+
+ALTER TABLE stats_ticks
+	DROP KEY natural_key,
+	DROP COLUMN user,
+	ADD UNIQUE KEY natural_key (page_id, user_id, createdAt, date, style(50), leadStyle(50), pitches),
+	ADD INDEX user_idx (user_id);
+
+ALTER TABLE stats_ratings
+	DROP KEY natural_key,
+	DROP COLUMN user,
+	ADD UNIQUE KEY natural_key (page_id, user_id, createdAt),
+	ADD INDEX user_idx (user_id);
+
+ALTER TABLE stats_stars
+	DROP KEY natural_key,
+	DROP COLUMN user,
+	ADD UNIQUE KEY natural_key (page_id, user_id, createdAt),
+	ADD INDEX user_idx (user_id);
+
+ALTER TABLE stats_todos
+	DROP KEY natural_key,
+	DROP COLUMN user,
+	ADD UNIQUE KEY natural_key (page_id, user_id, createdAt),
+	ADD INDEX user_idx (user_id);
+
+-- Example: most active users by ticks
+-- SELECT u.name, COUNT(*) AS ticks FROM stats_ticks t JOIN stats_users u USING (user_id)
+-- GROUP BY t.user_id ORDER BY ticks DESC LIMIT 20;
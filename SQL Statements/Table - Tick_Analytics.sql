@@ -0,0 +1,31 @@
+-- Per-route, per-month tick aggregates kept up to date by Tick_Analytics.py after each Stats_Grabber run.
+-- A tick's month is the date climbed, or createdAt when no date was given. Missing styles are stored as ''.
+CREATE TABLE IF NOT EXISTS tick_monthly (
+	page_id INT,
+	month DATE,
+	ticks INT UNSIGNED,
+	climbers INT UNSIGNED,
+	pitches INT UNSIGNED,
+	PRIMARY KEY (page_id, month),
+	INDEX month_idx (month));
+
+CREATE TABLE IF NOT EXISTS tick_style_monthly (
+	page_id INT,
+	month DATE,
+	style VARCHAR(50),
+	leadStyle VARCHAR(50),
+	ticks INT UNSIGNED,
+	PRIMARY KEY (page_id, month, style, leadStyle),
+	INDEX style_idx (style, leadStyle));
+
+-- Example: ticks per month for one route
+-- SELECT month, ticks, climbers FROM tick_monthly WHERE page_id = 105748391 ORDER BY month;
+
+-- Example: redpoint vs onsight ratio by rock grade
+-- SELECT rg.Grade, rg.Grade_Order,
+-- 	SUM(CASE WHEN ts.leadStyle = 'Redpoint' THEN ts.ticks ELSE 0 END)
+-- 		/ NULLIF(SUM(CASE WHEN ts.leadStyle = 'Onsight' THEN ts.ticks ELSE 0 END), 0) AS redpoint_onsight_ratio
+-- FROM tick_style_monthly ts
+-- JOIN route_grades rg ON rg.page_id = ts.page_id AND rg.Type = 'Rock'
+-- GROUP BY rg.Grade, rg.Grade_Order
+-- ORDER BY rg.Grade_Order;
@@ -0,0 +1,36 @@
+-- route_location now stores one leaf area_id per route, with the tree in location_areas.
+-- Location_Cleaner replaces an old 11-column route_location on its first run and re-maps every route.
+
+-- Wide view with the old continent/country/state/area_1..area_8 columns for existing queries
+CREATE OR REPLACE VIEW route_location_wide AS
+WITH RECURSIVE ancestors AS (
+    SELECT area_id AS leaf_id, area_id, parent_id, name, level
+    FROM location_areas
+    UNION ALL
+    SELECT a.leaf_id, p.area_id, p.parent_id, p.name, p.level
+    FROM ancestors a
+    JOIN location_areas p ON p.area_id = a.parent_id
+)
+SELECT
+    rl.page_id,
+    MAX(CASE WHEN an.level = 0 THEN an.name END) AS continent,
+    MAX(CASE WHEN an.level = 1 THEN an.name END) AS country,
+    COALESCE(MAX(CASE WHEN an.level = 2 THEN an.name END), 'N/A') AS state,
+    MAX(CASE WHEN an.level = 3 THEN an.name END) AS area_1,
+    MAX(CASE WHEN an.level = 4 THEN an.name END) AS area_2,
+    MAX(CASE WHEN an.level = 5 THEN an.name END) AS area_3,
+    MAX(CASE WHEN an.level = 6 THEN an.name END) AS area_4,
+    MAX(CASE WHEN an.level = 7 THEN an.name END) AS area_5,
+    MAX(CASE WHEN an.level = 8 THEN an.name END) AS area_6,
+    MAX(CASE WHEN an.level = 9 THEN an.name END) AS area_7,
+    MAX(CASE WHEN an.level = 10 THEN an.name END) AS area_8
+FROM route_location rl
+JOIN ancestors an ON an.leaf_id = rl.area_id
+GROUP BY rl.page_id;
+
+-- Roll-up: every route under an area is a range scan on lft
+SELECT rl.page_id
+FROM location_areas parent
+JOIN location_areas leaf ON leaf.lft BETWEEN parent.lft AND parent.rgt
+JOIN route_location rl ON rl.area_id = leaf.area_id
+WHERE parent.name = 'Red River Gorge';
@@ -1,37 +1,21 @@
+-- Same (page_id, route_type) rows as before, now read from the bridge table Route_Grabber writes
 CREATE OR REPLACE VIEW route_type AS
 	SELECT
-		page_id,
-		SUBSTRING_INDEX(route_type, ', ', 1) AS route_type
-	FROM mp_route_info
-UNION
-	SELECT
-		page_id,
-		SUBSTRING_INDEX(SUBSTRING_INDEX(route_type, ', ', 2), ', ', -1) AS route_type
-	FROM mp_route_info
-UNION
-	SELECT
-		page_id,
-		SUBSTRING_INDEX(SUBSTRING_INDEX(route_type, ', ', 3), ', ', -1) AS route_type
-	FROM mp_route_info
-UNION
-	SELECT
-		page_id,
-		SUBSTRING_INDEX(SUBSTRING_INDEX(route_type, ', ', 4), ', ', -1) AS route_type
-	FROM mp_route_info
-UNION
-	SELECT
-		page_id,
-		SUBSTRING_INDEX(SUBSTRING_INDEX(route_type, ', ', 5), ', ', -1) AS route_type
-	FROM mp_route_info
-UNION
-	SELECT
-		page_id,
-		SUBSTRING_INDEX(route_type, ', ', -1) AS route_type
-	FROM mp_route_info;
+		rtb.page_id,
+		rt.route_type
+	FROM route_type_bridge rtb
+	JOIN route_types rt ON rt.route_type_id = rtb.route_type_id;
 
 SELECT * FROM route_type
 	ORDER BY page_id;
-    
-SELECT route_type, count(route_type)
-	FROM route_type
-    GROUP BY route_type
+
+-- Counts come straight off the (route_type_id, page_id) index
+SELECT rt.route_type, COUNT(*)
+	FROM route_type_bridge rtb
+	JOIN route_types rt ON rt.route_type_id = rtb.route_type_id
+	GROUP BY rt.route_type;
+
+-- Filter by type, e.g. every sport route
+SELECT rtb.page_id
+	FROM route_type_bridge rtb
+	WHERE rtb.route_type_id = (SELECT route_type_id FROM route_types WHERE route_type = 'Sport');
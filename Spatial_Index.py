@@ -0,0 +1,229 @@
+import os
+import math
+import logging
+import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+import Database as database
+
+### CONFIGURATION ###
+
+# Log Folder
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Spatial Index ({datetime.date.today()}).log'
+
+# On-disk index file
+INDEX_FILE = 'spatial_index.npz'
+
+# Grid cell size in degrees (0.05 is roughly 5.5 km north-south)
+CELL_SIZE = 0.05
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Great-circle distance in km from one point to arrays of points
+def haversine_km(lat, lon, lats, lons):
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+### CLASSES ###
+
+# Uniform lat/lon grid over route coordinates. Points are kept sorted by cell key (row * columns + column),
+# so a row of cells in a bounding box is one contiguous slice found with searchsorted
+class SpatialIndex:
+    def __init__(self, page_ids=(), latitudes=(), longitudes=(), cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.columns = int(math.ceil(360 / cell_size))
+        self.rows = int(math.ceil(180 / cell_size))
+        self._set_points(np.asarray(page_ids, dtype=np.int64),
+                         np.asarray(latitudes, dtype=np.float64),
+                         np.asarray(longitudes, dtype=np.float64))
+
+    def _cell_row(self, latitudes):
+        return np.clip(np.floor((np.asarray(latitudes) + 90) / self.cell_size), 0, self.rows - 1).astype(np.int64)
+
+    def _cell_column(self, longitudes):
+        return np.clip(np.floor((np.asarray(longitudes) + 180) / self.cell_size), 0, self.columns - 1).astype(np.int64)
+
+    # Drop points without coordinates and sort the rest by cell key
+    def _set_points(self, page_ids, latitudes, longitudes):
+        valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        page_ids, latitudes, longitudes = page_ids[valid], latitudes[valid], longitudes[valid]
+        keys = self._cell_row(latitudes) * self.columns + self._cell_column(longitudes)
+        order = np.lexsort((page_ids, keys))
+
+        self.page_ids = page_ids[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.keys = keys[order]
+
+    def __len__(self):
+        return len(self.page_ids)
+
+    def save(self, file_name=INDEX_FILE):
+        temp_name = f'{file_name}.tmp.npz'
+        np.savez(temp_name, page_ids=self.page_ids, latitudes=self.latitudes, longitudes=self.longitudes,
+                 cell_size=np.array(self.cell_size))
+        os.replace(temp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name=INDEX_FILE):
+        with np.load(file_name) as data:
+            return cls(data['page_ids'], data['latitudes'], data['longitudes'], float(data['cell_size']))
+
+    # Replace the coordinates of re-scraped routes (NaN coordinates remove a route)
+    def update(self, page_ids, latitudes, longitudes):
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        keep = ~np.isin(self.page_ids, page_ids)
+        self._set_points(np.concatenate([self.page_ids[keep], page_ids]),
+                         np.concatenate([self.latitudes[keep], np.asarray(latitudes, dtype=np.float64)]),
+                         np.concatenate([self.longitudes[keep], np.asarray(longitudes, dtype=np.float64)]))
+
+    # Positions of points inside a box, min_lon > max_lon means the box crosses the antimeridian
+    def _box_positions(self, min_lat, min_lon, max_lat, max_lon):
+        if min_lon > max_lon:
+            return np.concatenate([self._box_positions(min_lat, min_lon, max_lat, 180.0),
+                                   self._box_positions(min_lat, -180.0, max_lat, max_lon)])
+
+        first_column, last_column = self._cell_column([min_lon, max_lon])
+        first_row, last_row = self._cell_row([min_lat, max_lat])
+        slices = []
+        for row in range(first_row, last_row + 1):
+            start = np.searchsorted(self.keys, row * self.columns + first_column, side='left')
+            end = np.searchsorted(self.keys, row * self.columns + last_column, side='right')
+            if end > start:
+                slices.append(np.arange(start, end))
+        if len(slices) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        positions = np.concatenate(slices)
+        latitudes, longitudes = self.latitudes[positions], self.longitudes[positions]
+        inside = (latitudes >= min_lat) & (latitudes <= max_lat) & (longitudes >= min_lon) & (longitudes <= max_lon)
+
+        return positions[inside]
+
+    # page_ids inside a bounding box
+    def bounding_box(self, min_lat, min_lon, max_lat, max_lon):
+        return np.sort(self.page_ids[self._box_positions(min_lat, min_lon, max_lat, max_lon)])
+
+    # [(page_id, distance_km)] within radius_km of a point, nearest first
+    def radius(self, lat, lon, radius_km):
+        lat_delta = radius_km / KM_PER_DEGREE
+        min_lat, max_lat = max(lat - lat_delta, -90.0), min(lat + lat_delta, 90.0)
+
+        # Widest longitude span is at the box's latitude furthest from the equator
+        widest = max(abs(min_lat), abs(max_lat))
+        if widest >= 90 or radius_km >= MAX_DISTANCE_KM / 2:
+            min_lon, max_lon = -180.0, 180.0
+        else:
+            lon_delta = lat_delta / math.cos(math.radians(widest))
+            if lon_delta >= 180:
+                min_lon, max_lon = -180.0, 180.0
+            else:
+                min_lon = (lon + 180 - lon_delta) % 360 - 180
+                max_lon = (lon + 180 + lon_delta) % 360 - 180
+
+        positions = self._box_positions(min_lat, min_lon, max_lat, max_lon)
+        distances = haversine_km(lat, lon, self.latitudes[positions], self.longitudes[positions])
+        within = distances <= radius_km
+        positions, distances = positions[within], distances[within]
+        order = np.lexsort((self.page_ids[positions], distances))
+
+        return list(zip(self.page_ids[positions][order].tolist(), distances[order].tolist()))
+
+    # k nearest routes, searching outward in doubling radii until the k-th nearest is inside the circle
+    def nearest(self, lat, lon, k=10):
+        if len(self) == 0:
+            return []
+
+        radius_km = self.cell_size * KM_PER_DEGREE
+        while True:
+            matches = self.radius(lat, lon, radius_km)
+            if len(matches) >= k or radius_km >= MAX_DISTANCE_KM:
+                return matches[:k]
+            radius_km = min(radius_km * 2, MAX_DISTANCE_KM)
+
+
+### FUNCTIONS ###
+
+# Get route coordinates, optionally only for a change set
+def get_coordinates(conn, page_ids=None):
+    try:
+        if page_ids is not None:
+            query = text('SELECT page_id, latitude, longitude FROM mp_route_info WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            df = pd.read_sql(query, conn, params={'page_ids': list(page_ids)})
+        else:
+            df = pd.read_sql('SELECT page_id, latitude, longitude FROM mp_route_info', conn)
+
+        logging.info(f'Got {len(df)} route coordinates at {datetime.datetime.now()}')
+        return df
+
+    except Exception as e:
+        logging.error(f'Error getting route coordinates: {e}', exc_info=True)
+        raise
+
+
+# Build the index from every route, or update the saved one for re-scraped page_ids
+def build_index(conn, page_ids=None, file_name=INDEX_FILE):
+    if page_ids is not None and os.path.exists(file_name):
+        index = SpatialIndex.load(file_name)
+        page_ids = list(page_ids)
+        df = get_coordinates(conn, page_ids)
+
+        # Routes that no longer exist are removed with NaN coordinates
+        df = df.set_index('page_id').reindex(page_ids).reset_index()
+        index.update(df['page_id'], df['latitude'].astype(float), df['longitude'].astype(float))
+    else:
+        df = get_coordinates(conn)
+        index = SpatialIndex(df['page_id'], df['latitude'].astype(float), df['longitude'].astype(float))
+
+    index.save(file_name)
+    logging.info(f'Saved spatial index with {len(index)} routes at {datetime.datetime.now()}')
+
+    return index
+
+
+# Main execution, page_ids limits the run to a change set. Returns the page_ids that were indexed
+def main(page_ids=None):
+    setup_logging()
+    changed_page_ids = set()
+
+    try:
+        with database.connect_to_db() as conn:
+            index = build_index(conn, page_ids)
+            changed_page_ids.update(index.page_ids.tolist() if page_ids is None else page_ids)
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+        raise
+
+    return changed_page_ids
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
 import os
 import logging
 import datetime
+import numpy as np
 import pandas as pd
-from decouple import config
-from sqlalchemy import create_engine
+from sqlalchemy import text, bindparam
+import Database as database
 import Stats_Grabber as stats_grabber
 
 ### CONFIGURATION ###
@@ -12,12 +13,28 @@ import Stats_Grabber as stats_grabber
 LOG_FOLDER = 'log_files'
 LOG_FILENAME = f'Logfile - Data Check ({datetime.date.today()}).log'
 
-# MySQL Database Configuration
-DB_CONFIG = {
-    "host": config('AWS_HOST'),
-    "user": config('AWS_USERNAME'),
-    "password": config('AWS_MASTER_PASSWORD'),
-    "database": config('AWS_DATABASE'), }
+# 'incremental' compares the counters Stats_Grabber keeps for pages touched since the last check,
+# 'chunked' recounts every stats table one page_id range at a time, 'full' recounts everything in memory
+CHECK_MODE = 'incremental'
+
+# Width of the page_id range read per chunk in chunked mode
+CHUNK_SIZE = 50000
+
+# Pages missing more rows than this are written to page_ids.csv for re-fetching
+REFETCH_THRESHOLD = 1
+
+STAT_COLUMNS = ['stars', 'ratings', 'ticks', 'todos']
+
+STATS_CHECK_QUERY = """
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        page_id INT PRIMARY KEY,
+        stars_difference INT,
+        ratings_difference INT,
+        ticks_difference INT,
+        todos_difference INT,
+        sum_difference INT
+    )
+"""
 
 ### FUNCTIONS ###
 
@@ -34,40 +51,114 @@ def setup_logging():
         print(f'Error creating log folder: {e}')
 
 
-# Create MySQL database connection
-def connect_to_db():
+# Create the stats_check table keyed on page_id so incremental checks can upsert into it. Tables written
+# by the old to_sql(if_exists='replace') have no key, so they are rebuilt with one (see add_primary_key)
+def create_table(conn):
     try:
-        # Create an SQLAlchemy engine
-        engine = create_engine(
-            f"""mysql+mysqlconnector://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/
-                {DB_CONFIG['database']}""")
-
-        # Connect to the engine and create a cursor
-        conn = engine.connect()
-        logging.info(f'Connected to database at {datetime.datetime.now()}')
+        conn.execute(text(STATS_CHECK_QUERY.format(table_name='stats_check')))
+        conn.commit()
 
-        return conn
+        has_key = conn.execute(text("""
+            SELECT COUNT(*) FROM information_schema.table_constraints
+            WHERE table_schema = DATABASE() AND table_name = 'stats_check' AND constraint_type = 'PRIMARY KEY'
+        """)).fetchone()[0]
+        if has_key == 0:
+            add_primary_key(conn)
 
     except Exception as e:
-        logging.error(f'Error connecting to database: {e}', exc_info=True)
+        logging.error(f'Error creating stats_check table: {e}', exc_info=True)
+        raise
 
-    return None
+
+# Copy a keyless stats_check into a keyed one, keeping the last row written for each page_id (InnoDB scans
+# a keyless table in insert order), then swap it in
+def add_primary_key(conn):
+    try:
+        columns = 'page_id, ' + ', '.join(f'{stat}_difference' for stat in STAT_COLUMNS) + ', sum_difference'
+        updates = ', '.join(f'{column} = VALUES({column})' for column in columns.split(', ')[1:])
+
+        conn.execute(text('DROP TABLE IF EXISTS stats_check_keyed'))
+        conn.execute(text(STATS_CHECK_QUERY.format(table_name='stats_check_keyed')))
+        conn.execute(text(f"""
+            INSERT INTO stats_check_keyed ({columns})
+            SELECT {columns} FROM stats_check WHERE page_id IS NOT NULL
+            ON DUPLICATE KEY UPDATE {updates}
+        """))
+        conn.execute(text('RENAME TABLE stats_check TO stats_check_unkeyed, stats_check_keyed TO stats_check'))
+        conn.execute(text('DROP TABLE stats_check_unkeyed'))
+        conn.commit()
+        logging.info(f'Rebuilt stats_check with a primary key at {datetime.datetime.now()}')
+
+    except Exception as e:
+        logging.error(f'Error adding a primary key to stats_check: {e}', exc_info=True)
+        raise
 
 
-# Insert data into each table in the database
-def insert_data(conn, stats_check):
+# Write the differences and clear the checked pages' pending flags in one transaction, so a failed write
+# leaves the flags set for the next check (full checks clear the table first). The DELETE/UPDATE run
+# before the insert so to_sql joins the open transaction instead of committing its own
+def insert_data(conn, stats_check, checked_page_ids, replace=True):
     try:
         # Execute MySQL query
         table_name = 'stats_check'
-        stats_check.to_sql(name=table_name, con=conn.engine, if_exists='replace', index=False)
+        if replace:
+            conn.execute(text(f'DELETE FROM {table_name}'))
+        clear_pending(conn, checked_page_ids)
+
+        if len(stats_check) > 0:
+            database.insert_frame(stats_check, table_name, conn, method=stats_grabber.upsert_rows,
+                                  chunksize=stats_grabber.UPSERT_CHUNK_SIZE)
+        conn.commit()
         logging.info('Successfully added data to the database')
 
     except Exception as e:
         logging.error(f'Error inserting data into database: {e}', exc_info=True)
+        conn.rollback()
+        raise
+
+
+# Get the counter differences for pages Stats_Grabber has written since the last check
+def get_pending_checks(conn, page_ids=None):
+    try:
+        pending_query = """
+            SELECT page_id,
+                   stars - stored_stars AS stars_difference,
+                   ratings - stored_ratings AS ratings_difference,
+                   ticks - stored_ticks AS ticks_difference,
+                   todos - stored_todos AS todos_difference
+            FROM stats_count
+            WHERE check_pending = 1
+        """
+        if page_ids is not None:
+            query = text(pending_query + ' AND page_id IN :page_ids').bindparams(bindparam('page_ids', expanding=True))
+            df = pd.read_sql(query, conn, params={'page_ids': list(page_ids)})
+        else:
+            df = pd.read_sql(pending_query, conn)
+        df['sum_difference'] = df[
+            ['stars_difference', 'ratings_difference', 'ticks_difference', 'todos_difference']].sum(axis=1).astype('int')
+        logging.info(f'Got {len(df)} pending checks at {datetime.datetime.now()}')
+
+        return df
+
+    except Exception as e:
+        logging.error(f'Error getting pending checks: {e}', exc_info=True)
 
     return None
 
 
+# Clear the pending flag for checked pages, committed by insert_data along with their differences
+def clear_pending(conn, page_ids):
+    try:
+        clear_query = text('UPDATE stats_count SET check_pending = 0 WHERE page_id IN :page_ids').bindparams(
+            bindparam('page_ids', expanding=True))
+        for i in range(0, len(page_ids), stats_grabber.UPSERT_CHUNK_SIZE):
+            conn.execute(clear_query, {'page_ids': page_ids[i:i + stats_grabber.UPSERT_CHUNK_SIZE]})
+
+    except Exception as e:
+        logging.error(f'Error clearing pending checks: {e}', exc_info=True)
+        raise
+
+
 # Gret stats data to process from database
 def get_stats(conn):
     try:
@@ -107,6 +198,91 @@ def get_stats(conn):
     return None
 
 
+# Count stored rows per page for one page_id range of a stats table
+def get_range_counts(conn, table, low, high):
+    range_query = text(f"""
+        SELECT page_id, COUNT(*) AS stored
+        FROM stats_{table}
+        WHERE page_id BETWEEN :low AND :high
+        GROUP BY page_id
+        ORDER BY page_id
+    """)
+    rows = conn.execute(range_query, {'low': low, 'high': high}).fetchall()
+    counts = np.array([tuple(row) for row in rows], dtype=np.int64).reshape(-1, 2)
+
+    return counts[:, 0], counts[:, 1]
+
+
+# Compare reported and stored counts for one page_id range with NumPy. Returns the mismatches and the page_ids checked
+def process_range(conn, low, high):
+    counts_query = text("""
+        SELECT page_id, stars, ratings, ticks, todos
+        FROM stats_count
+        WHERE page_id BETWEEN :low AND :high
+        ORDER BY page_id
+    """)
+    counts_df = pd.read_sql(counts_query, conn, params={'low': low, 'high': high})
+    page_ids = counts_df['page_id'].to_numpy(dtype=np.int64)
+
+    differences = {'page_id': page_ids}
+    for stat in STAT_COLUMNS:
+        stored_ids, stored = get_range_counts(conn, stat, low, high)
+
+        # Align the grouped counts to stats_count's page_ids, pages with no stored rows count as 0
+        position = np.searchsorted(stored_ids, page_ids)
+        position = np.minimum(position, max(len(stored_ids) - 1, 0))
+        if len(stored_ids) > 0:
+            matched = stored_ids[position] == page_ids
+            stored_aligned = np.where(matched, stored[position], 0)
+        else:
+            stored_aligned = np.zeros(len(page_ids), dtype=np.int64)
+
+        reported = counts_df[stat].fillna(0).to_numpy(dtype=np.int64)
+        differences[f'{stat}_difference'] = reported - stored_aligned
+
+    range_df = pd.DataFrame(differences)
+    range_df['sum_difference'] = range_df[[f'{stat}_difference' for stat in STAT_COLUMNS]].sum(axis=1)
+    mismatch = (range_df[[f'{stat}_difference' for stat in STAT_COLUMNS]].to_numpy() != 0).any(axis=1)
+
+    return range_df[mismatch], page_ids.tolist()
+
+
+# Check every page in page_id ranges, appending mismatches as each range finishes
+def check_in_chunks(conn):
+    try:
+        bounds = conn.execute(text('SELECT MIN(page_id), MAX(page_id) FROM stats_count')).fetchone()
+        if bounds[0] is None:
+            return
+
+        # The driver buffers each result client-side, so memory is bounded by one page_id range's rows
+        conn.execute(text('DELETE FROM stats_check'))
+        conn.commit()
+
+        first_chunk = True
+        mismatch_count = 0
+        for low in range(bounds[0], bounds[1] + 1, CHUNK_SIZE):
+            high = low + CHUNK_SIZE - 1
+            mismatch_df, checked_page_ids = process_range(conn, low, high)
+
+            # Only the pages read in this range are cleared, anything flagged since is left for the next check
+            insert_data(conn, mismatch_df, checked_page_ids, replace=False)
+
+            mode = 'w' if first_chunk else 'a'
+            mismatch_df.to_csv('stats_check.csv', mode=mode, header=first_chunk, index=False)
+            refetch_df = mismatch_df.loc[mismatch_df['sum_difference'] > REFETCH_THRESHOLD, ['page_id']]
+            refetch_df.to_csv('page_ids.csv', mode=mode, header=first_chunk, index=False)
+
+            first_chunk = False
+            mismatch_count += len(mismatch_df)
+            logging.info(f'Checked page_ids {low} to {high}, {mismatch_count} mismatches so far')
+
+        logging.info(f'Finished chunked check with {mismatch_count} mismatches at {datetime.datetime.now()}')
+
+    except Exception as e:
+        logging.error(f'Error running chunked check: {e}', exc_info=True)
+        raise
+
+
 def process_stats(df):
     try:
         # Create new df that calculates the difference b/w stats count and actual counts in the database
@@ -130,13 +306,30 @@ def process_stats(df):
     return None
 
 
-# Main execution
-def main():
+# Main execution, page_ids limits an incremental check to a change set. Returns the page_ids checked
+def main(page_ids=None):
     # Setup logging and connection to database
     setup_logging()
+    checked_page_ids = set()
 
     try:
-        with connect_to_db() as conn:
+        with database.connect_to_db() as conn:
+            create_table(conn)
+
+            # Only compare pages whose counters changed since the last check
+            if CHECK_MODE == 'incremental' or page_ids is not None:
+                stats_check_df = get_pending_checks(conn, page_ids)
+                if len(stats_check_df) > 0:
+                    insert_data(conn, stats_check_df, stats_check_df['page_id'].tolist(), replace=False)
+
+                stats_check_df.to_csv('stats_check.csv', index=False)
+                return set(stats_check_df['page_id'].tolist())
+
+            # Stream the full check one page_id range at a time
+            if CHECK_MODE == 'chunked':
+                check_in_chunks(conn)
+                return checked_page_ids
+
             # Get stats df
             stats_df = get_stats(conn)
             stats_df.to_csv('stats_data.csv', index=False)
@@ -146,15 +339,19 @@ def main():
             stats_check_df.to_csv('stats_check.csv', index=False)
             stats_check_df.head()
 
-            page_id_df = stats_check_df['sum_difference' > 1]
-            page_id_df.to_csv('page_ids.csv')
+            page_id_df = stats_check_df.loc[stats_check_df['sum_difference'] > REFETCH_THRESHOLD, ['page_id']]
+            page_id_df.to_csv('page_ids.csv', index=False)
 
             # Insert grade data into database
-            insert_data(conn, stats_check_df)
+            insert_data(conn, stats_check_df, stats_check_df['page_id'].tolist())
+            checked_page_ids.update(stats_check_df['page_id'].tolist())
 
     except Exception as e:
         logging.error(f'Error occurred in main function:', exc_info=True)
         print(f'Error occurred in main function: {e}')
+        raise
+
+    return checked_page_ids
 
 
 ### Run ###
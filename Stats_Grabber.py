@@ -8,24 +8,38 @@ import pandas as pd
 import concurrent.futures
 from statistics import mean
 from decouple import config
-from sqlalchemy import create_engine, text
+from sqlalchemy import text, bindparam
+from sqlalchemy.dialects.mysql import insert
 from ratelimit import limits, sleep_and_retry
+from Concurrency_Controller import ConcurrencyController
+import Database as database
+import Route_History as route_history
+import Grade_Cleaner as grade_cleaner
 
 
 ### CONFIGURATION
 LOG_FOLDER = 'log_files'
 LOG_FILENAME = f'Logfile - Stats Grabber ({datetime.date.today()}).log'
 BATCH_SIZE = 100
-CALLS_PER_PERIOD = 20
+CALLS_PER_PERIOD = config('STATS_CALLS_PER_PERIOD', default=20, cast=int)
 TIME_PERIOD = 10
+
+# Route stats API, overridden to point at Fake_MP_Server for load tests
+MP_API_URL = config('MP_API_URL', default='https://www.mountainproject.com/api/v2/routes')
 TABLE_LIST = ['stars', 'ticks', 'todos', 'ratings', 'count']
+UPSERT_CHUNK_SIZE = 1000
+
+# stats_users name -> user_id, filled as batches are ingested so each name is looked up once per run
+USER_IDS = {}
 
-DB_CONFIG = {
-    "host": config('AWS_HOST'),
-    "user": config('AWS_USERNAME'),
-    "password": config('AWS_MASTER_PASSWORD'),
-    "database": config('AWS_DATABASE')
-}
+# Rating columns that get an integer grade ordinal alongside the text ({column}Order). The grade lookup is
+# read from grade_order.csv when main runs
+RATING_COLUMNS = ['rockRating', 'iceRating', 'aidRating', 'boulderRating', 'mixedRating', 'snowRating']
+
+# Worker pool is sized from measured latency and the rate limit (see Concurrency_Controller)
+MIN_WORKERS = 1
+MAX_WORKERS = 32
+CONTROLLER = ConcurrencyController(CALLS_PER_PERIOD, TIME_PERIOD, min_workers=MIN_WORKERS, max_workers=MAX_WORKERS)
 
 
 ### FUNCTIONS ###
@@ -42,20 +56,215 @@ def setup_logging():
         print(f'Error setting up log file: {e}')
 
 
-# Create a MySQL database connection
-def connect_to_db():
+# Create the stats tables keyed on the site's item id so retried batches upsert instead of duplicating.
+# Anonymous users and missing dates or styles can't tell rows apart, the item id always does
+def create_tables(conn):
     try:
-        engine = create_engine(
-            f"mysql+mysqlconnector://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}"
-        )
-        conn = engine.connect()
-        logging.info(f'Connected to the database at {datetime.datetime.now()}')
-        return conn
+        create_table_queries = [
+            """
+            CREATE TABLE IF NOT EXISTS stats_users (
+                user_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+                UNIQUE KEY name_key (name)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats_ticks (
+                table_count INT AUTO_INCREMENT PRIMARY KEY,
+                item_id BIGINT UNSIGNED,
+                page_id INT,
+                user_id INT UNSIGNED,
+                date DATE,
+                style VARCHAR(255),
+                leadStyle VARCHAR(255),
+                pitches INT,
+                text TEXT,
+                comment TEXT,
+                createdAt DATE,
+                updatedAt DATE,
+                UNIQUE KEY item_key (item_id),
+                INDEX page_idx (page_id),
+                INDEX user_idx (user_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats_ratings (
+                table_count INT AUTO_INCREMENT PRIMARY KEY,
+                item_id BIGINT UNSIGNED,
+                page_id INT,
+                user_id INT UNSIGNED,
+                allRatings VARCHAR(255),
+                rockRating VARCHAR(255),
+                iceRating VARCHAR(255),
+                aidRating VARCHAR(255),
+                boulderRating VARCHAR(255),
+                mixedRating VARCHAR(255),
+                snowRating VARCHAR(255),
+                safteyRating TEXT,
+                rockRatingOrder INT,
+                iceRatingOrder INT,
+                aidRatingOrder INT,
+                boulderRatingOrder INT,
+                mixedRatingOrder INT,
+                snowRatingOrder INT,
+                createdAt DATE,
+                updatedAt DATE,
+                UNIQUE KEY item_key (item_id),
+                INDEX page_idx (page_id),
+                INDEX user_idx (user_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats_stars (
+                table_count INT AUTO_INCREMENT PRIMARY KEY,
+                item_id BIGINT UNSIGNED,
+                page_id INT,
+                user_id INT UNSIGNED,
+                score VARCHAR(255),
+                createdAt DATE,
+                updatedAt DATE,
+                UNIQUE KEY item_key (item_id),
+                INDEX page_idx (page_id),
+                INDEX user_idx (user_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats_todos (
+                table_count INT AUTO_INCREMENT PRIMARY KEY,
+                item_id BIGINT UNSIGNED,
+                page_id INT,
+                user_id INT UNSIGNED,
+                createdAt DATE,
+                updatedAt DATE,
+                UNIQUE KEY item_key (item_id),
+                INDEX page_idx (page_id),
+                INDEX user_idx (user_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS stats_count (
+                page_id INT PRIMARY KEY,
+                date_added DATE,
+                stars INT,
+                ratings INT,
+                todos INT,
+                ticks INT,
+                stored_stars INT DEFAULT 0,
+                stored_ratings INT DEFAULT 0,
+                stored_todos INT DEFAULT 0,
+                stored_ticks INT DEFAULT 0,
+                check_pending TINYINT DEFAULT 1,
+                INDEX check_pending_idx (check_pending)
+            )
+            """]
+
+        for query in create_table_queries + route_history.HISTORY_TABLE_QUERIES:
+            conn.execute(text(query))
+
+        conn.commit()
+        logging.info(f'Created/checked stats tables at {datetime.datetime.now()}')
 
     except Exception as e:
-        logging.error(f'Error connecting to the database: {e}')
+        logging.error(f'Error creating stats tables: {e}')
+        raise
 
-    return None
+
+# Used as the to_sql method so each chunk is written as one INSERT ... ON DUPLICATE KEY UPDATE
+def upsert_rows(table, conn, keys, data_iter):
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    if len(rows) == 0:
+        return 0
+
+    insert_query = insert(table.table).values(rows)
+    update_columns = {key: insert_query.inserted[key] for key in keys}
+    result = conn.execute(insert_query.on_duplicate_key_update(**update_columns))
+
+    return result.rowcount
+
+
+# Recount the stored rows for a batch of page_ids and flag them for Stats_Check
+def update_stored_counts(conn, page_ids):
+    try:
+        for table in TABLE_LIST[:4]:
+            update_query = text(f"""
+                UPDATE stats_count sc
+                LEFT JOIN (
+                    SELECT page_id, COUNT(*) AS stored
+                    FROM stats_{table}
+                    WHERE page_id IN :page_ids
+                    GROUP BY page_id
+                ) counts ON counts.page_id = sc.page_id
+                SET sc.stored_{table} = COALESCE(counts.stored, 0),
+                    sc.check_pending = 1
+                WHERE sc.page_id IN :page_ids
+            """).bindparams(bindparam('page_ids', expanding=True))
+            conn.execute(update_query, {'page_ids': list(page_ids)})
+
+        conn.commit()
+
+    except Exception as e:
+        logging.error(f'Error updating stored counts: {e}')
+        raise
+
+
+# Look up (adding any new ones) the stats_users id for each user name. Existing names are selected first
+# so INSERT IGNORE doesn't burn auto-increment ids on rows that are already there
+def get_user_ids(conn, names):
+    try:
+        select_query = text('SELECT name, user_id FROM stats_users WHERE name IN :names').bindparams(
+            bindparam('names', expanding=True))
+        new_names = sorted(set(names).difference(USER_IDS))
+
+        for i in range(0, len(new_names), UPSERT_CHUNK_SIZE):
+            chunk = new_names[i:i + UPSERT_CHUNK_SIZE]
+            USER_IDS.update(conn.execute(select_query, {'names': chunk}).fetchall())
+
+            missing = [name for name in chunk if name not in USER_IDS]
+            if len(missing) > 0:
+                conn.execute(text('INSERT IGNORE INTO stats_users (name) VALUES (:name)'),
+                             [{'name': name} for name in missing])
+                USER_IDS.update(conn.execute(select_query, {'names': missing}).fetchall())
+
+        conn.commit()
+        return USER_IDS
+
+    except Exception as e:
+        logging.error(f'Error getting user ids: {e}')
+        raise
+
+
+# Replace the user names in each stats frame with their stats_users id
+def assign_user_ids(conn, stats_output):
+    tables = [table for table in TABLE_LIST[:4] if 'user' in stats_output[table]]
+    if len(tables) == 0:
+        return stats_output
+
+    names = pd.concat([stats_output[table]['user'] for table in tables]).dropna().unique()
+    user_ids = get_user_ids(conn, names)
+    for table in tables:
+        stats_output[table]['user_id'] = stats_output[table]['user'].map(user_ids).astype('Int64')
+        stats_output[table] = stats_output[table].drop(columns='user')
+
+    return stats_output
+
+
+# Append each page's totals to stats_history when they changed since its last refresh
+def record_stats_history(conn, count_df):
+    try:
+        rows = [(int(page_id), row['date_added'],
+                 *(None if pd.isna(row[stat]) else int(row[stat]) for stat in ['stars', 'ratings', 'todos', 'ticks']))
+                for page_id, row in count_df.iterrows()]
+        cursor = conn.connection.cursor()
+        try:
+            written = route_history.record_history(cursor, 'stats_history', rows)
+        finally:
+            cursor.close()
+        conn.commit()
+        logging.info(f'Recorded stats history for {written} of {len(rows)} pages')
+
+    except Exception as e:
+        logging.error(f'Error recording stats history: {e}')
+        raise
 
 
 # Fetch route URLs to process from the database (only route pages)
@@ -91,9 +300,12 @@ def get_processed_data(conn):
 # Fetch processed URLs from the database
 def drop_rows(page_ids, conn):
     try:
+        page_ids = list(page_ids)
         for table in TABLE_LIST:
-            drop_query = text(f'DELETE FROM stats_{table} WHERE page_id IN {tuple(page_ids)}')
-            conn.execute(drop_query)
+            drop_query = text(f'DELETE FROM stats_{table} WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            for i in range(0, len(page_ids), UPSERT_CHUNK_SIZE):
+                conn.execute(drop_query, {'page_ids': page_ids[i:i + UPSERT_CHUNK_SIZE]})
 
         conn.commit()
         logging.info(f'Dropped {len(page_ids)} page_ids from database')
@@ -103,16 +315,18 @@ def drop_rows(page_ids, conn):
         print(f'Error dropping rows from the database: {e}')
         raise
 
-# Get grade data for stats_grabber
+# One attempt at a route's stats. Returns None on an error code worth retrying. Each attempt is one
+# latency sample for the controller, timed after the rate limiter releases the call
 @sleep_and_retry
 @limits(calls=CALLS_PER_PERIOD, period=TIME_PERIOD)
-def json_puller(page_id, retry=True):
+def fetch_stats(page_id):
     stats_output = {}
     stats_count = {}
+    start_time = time.time()
 
     try:
         for stat in TABLE_LIST[:4]:
-            url = 'https://www.mountainproject.com/api/v2/routes/' + str(page_id) + '/' + stat
+            url = f'{MP_API_URL}/{page_id}/{stat}'
             response = requests.get(url)
 
             if response.status_code == 200:
@@ -133,7 +347,7 @@ def json_puller(page_id, retry=True):
                             print(f'Need to process {url} still, got code {response.status_code}')
 
                 for value in data_list:
-                    del value['id']
+                    value['item_id'] = value.pop('id', None)
                     value['page_id'] = page_id
 
                     # flatten allRatings list for grades
@@ -152,19 +366,21 @@ def json_puller(page_id, retry=True):
                     logging.error(f'Stat length didnt add up for {stat} at {url}.')
                     logging.error(f'Got a length of {len(data_list)} but should have been {stat_total}')
 
+                # Rows are upserted on item_id and a NULL never matches the unique key, so an item without
+                # an id would be duplicated every time its page is fetched again
+                missing_ids = sum(value['item_id'] is None for value in data_list)
+                if missing_ids > 0:
+                    logging.error(f'Skipped {missing_ids} {stat} items with no id for page_id {page_id}')
+                    data_list = [value for value in data_list if value['item_id'] is not None]
+
             elif response.status_code == 404:
                 logging.error(f'Bailed on {stat} for page_id {page_id}: got code {response.status_code}', exc_info=True)
                 return {'stars': []}
 
-            elif retry:
+            else:
                 logging.error(f"Error processing {stat} for page_id {page_id}: got code {response.status_code}",
                               exc_info=True)
-                time.sleep(5)
-                return json_puller(page_id, retry=False)
-
-            else:
-                logging.error(f'Retried {stat} for page_id {page_id}: got code {response.status_code}', exc_info=True)
-                return {'stars': []}
+                return None
 
             # Create dictionary values for each stat
             stats_output[stat] = data_list
@@ -179,19 +395,49 @@ def json_puller(page_id, retry=True):
 
         return stats_output
 
+    finally:
+        CONTROLLER.observe(time.time() - start_time)
+
+
+# Get grade data for stats_grabber, retrying once after a pause that isn't counted as latency
+def json_puller(page_id, retry=True):
+    try:
+        stats_output = fetch_stats(page_id)
+        if stats_output is None and retry:
+            time.sleep(5)
+            stats_output = fetch_stats(page_id)
+
+        if stats_output is None:
+            logging.error(f'Retried page_id {page_id}, giving up')
+            return {'stars': []}
+
+        return stats_output
+
     except Exception:
         logging.error(f'Error processing stats for page_id {page_id}:', exc_info=True)
 
 
 # Get information for each route
-def stats_grabber(page_id_list):
+def stats_grabber(page_id_list, grade_order):
     try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(json_puller, page_id) for page_id in page_id_list]
+        # Executor is sized for the largest pool, the controller decides how many run at once
+        # Utilisation is measured over this batch's requests only
+        CONTROLLER.reset_window()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [executor.submit(CONTROLLER.run, json_puller, page_id) for page_id in page_id_list]
             output_list = [future.result() for future in concurrent.futures.as_completed(futures)]
+        CONTROLLER.end_window()
+
+        logging.info(f'Concurrency metrics: {CONTROLLER.metrics()}')
+
+        # Routes whose fetch raised are logged by json_puller and left out of the batch
+        failed_count = sum(output is None for output in output_list)
+        if failed_count > 0:
+            logging.error(f'Skipping {failed_count} routes that failed in this batch')
+        output_list = [output for output in output_list if output is not None]
 
         # Combine dictionaries for each stat
-        if len(output_list) > 1:
+        if len(output_list) >= 1:
             stats_output = output_list[0].copy()
 
             for other_dict in output_list[1:]:
@@ -220,6 +466,13 @@ def stats_grabber(page_id_list):
                 stats_output[table]['createdAt'] = pd.to_datetime(stats_output[table]['createdAt'])
                 stats_output[table]['updatedAt'] = pd.to_datetime(stats_output[table]['updatedAt'])
 
+            # Sortable ordinal for each rating, cleaned the way route_grades is ('5.10-' -> '5.10a') so the
+            # same grade gets the same ordinal in both tables
+            for col in RATING_COLUMNS:
+                if col in stats_output['ratings']:
+                    cleaned = stats_output['ratings'][col].map(grade_cleaner.clean_grade, na_action='ignore')
+                    stats_output['ratings'][f'{col}Order'] = grade_cleaner.grade_to_order(cleaned, grade_order)
+
             return stats_output
 
     except Exception:
@@ -228,12 +481,17 @@ def stats_grabber(page_id_list):
     return None
 
 
-# Main execution
-def main():
+# Main execution, page_ids refreshes just a change set. Returns the page_ids whose stats were written
+def main(page_ids=None):
     setup_logging()
+    changed_page_ids = set()
 
     try:
-        with connect_to_db() as conn:
+        with database.connect_to_db() as conn:
+            # Make sure the stats tables and their item keys exist
+            create_tables(conn)
+            grade_order = grade_cleaner.load_grade_order()
+
             # Get list of page_ids that need processed
             all_page_ids = get_page_id(conn)
             processed_urls = get_processed_data(conn)
@@ -248,6 +506,14 @@ def main():
                     drop_page_ids.append(route[0])
 
             filtered_list = list(set(all_page_ids).difference(process_page_ids))
+
+            # Re-scraped routes are refreshed whatever the age of their stats, on top of the stale ones.
+            # Ticks, ratings and todos change without the route page changing, so the 30 day refresh still runs
+            if page_ids is not None:
+                page_ids = set(page_ids)
+                filtered_list = list(set(filtered_list).union(page_ids))
+                drop_page_ids = list(set(drop_page_ids).union(route[0] for route in processed_urls
+                                                              if route[0] in page_ids))
             print(f'Processing list of {len(filtered_list)} page_id')
 
             # Drop rows for page_id's that need updated
@@ -260,34 +526,51 @@ def main():
             for i in range(0, len(filtered_list), BATCH_SIZE):
                 start_time = time.time()
                 route_batch = filtered_list[i:i + BATCH_SIZE]
-                stats_output = stats_grabber(route_batch)
+                stats_output = stats_grabber(route_batch, grade_order)
 
                 if stats_output is None:
                     logging.error(f'Got none type processing batch {int(i / BATCH_SIZE)}')
                     continue
 
+                # Stats tables store integer user ids, names live once in stats_users
+                stats_output = assign_user_ids(conn, stats_output)
+
+                # Upsert on the item ids so a retried or overlapping batch can't duplicate rows
                 for key, value in stats_output.items():
                     if key == 'count':
-                        value.to_sql(name='stats_count', con=conn.engine, if_exists='append', index=True,
-                                     index_label='page_id')
+                        database.insert_frame(value, 'stats_count', conn, method=upsert_rows,
+                                              chunksize=UPSERT_CHUNK_SIZE, index=True, index_label='page_id')
                     else:
-                        value.to_sql(name=f'stats_{key}', con=conn.engine, if_exists='append', index=False)
+                        database.insert_frame(value, f'stats_{key}', conn, method=upsert_rows,
+                                              chunksize=UPSERT_CHUNK_SIZE)
+                conn.commit()
+
+                # Keep the reconciliation counters in step with what was just written
+                update_stored_counts(conn, stats_output['count'].index.tolist())
+                record_stats_history(conn, stats_output['count'])
+                changed_page_ids.update(stats_output['count'].index.tolist())
 
                 # Add processing time to batch_time and estimate time remaining
                 batch_times.append((time.time() - start_time) / len(stats_output['count']))
                 logging.info(f'Data was just inserted for batch {int(i / BATCH_SIZE)}')
                 logging.info(f'Total time for batch {time.time() - start_time}')
                 logging.info(f'Projected time remaining is {(mean(batch_times) * len(filtered_list[i:]) / 3600)} hours')
+                metrics = CONTROLLER.metrics()
+                print(f"Workers: {metrics['concurrency']}, latency: {metrics['latency']}s, "
+                      f"utilisation: {metrics['utilisation']}")
                 print(
                     f'Batch #{int(i / BATCH_SIZE)} - {round((mean(batch_times) * len(filtered_list[i:]) / 3600), 2)} hours remaining')
 
     except Exception as e:
         logging.error(f'An error occurred in the main function: {e}')
         print(f'An error occurred in the main function processing batch: {e}')
+        raise
 
     finally:
         logging.info(f'Finished running at {datetime.datetime.now()}')
 
+    return changed_page_ids
+
 
 ### EXECUTION ###
 if __name__ == '__main__':
@@ -0,0 +1,454 @@
+import os
+import re
+import json
+import math
+import mmap
+import logging
+import datetime
+import pandas as pd
+from sqlalchemy import text, bindparam
+import Database as database
+
+### CONFIGURATION ###
+
+# Log Folder
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Text Index ({datetime.date.today()}).log'
+
+# On-disk index location
+INDEX_FOLDER = 'text_index'
+MANIFEST_FILE = 'manifest.json'
+
+# Field name -> table written by Titles_Cleaner, the position in this dict is the field id on disk
+TEXT_TABLES = {'description': 'route_descriptions',
+               'protection': 'route_protection',
+               'directions': 'route_directions'}
+FIELDS = list(TEXT_TABLES)
+
+# Routes per segment on a full build (a keyset page of page_ids), keeps memory bounded while building
+SEGMENT_SIZE = 50000
+
+# Merge every segment into one once an incremental update leaves more than this
+MAX_SEGMENTS = 8
+
+# BM25 ranking parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Lowercase word tokens, the same rules are used for documents and queries
+def tokenize(value):
+    if not value:
+        return []
+
+    return TOKEN_PATTERN.findall(value.lower())
+
+
+# Postings are stored as LEB128 varints so small deltas take a single byte
+def encode_varint(number, output):
+    while number >= 0x80:
+        output.append((number & 0x7F) | 0x80)
+        number >>= 7
+    output.append(number)
+
+
+def decode_varints(data, start, end):
+    values = []
+    number = 0
+    shift = 0
+    for position in range(start, end):
+        byte = data[position]
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(number)
+            number = 0
+            shift = 0
+
+    return values
+
+
+# Encode {page_id: {field_id: [positions]}} as delta page_ids followed by each field's delta positions
+def encode_postings(postings):
+    output = bytearray()
+    previous_page = 0
+    for page_id in sorted(postings):
+        encode_varint(page_id - previous_page, output)
+        previous_page = page_id
+
+        fields = postings[page_id]
+        encode_varint(len(fields), output)
+        for field_id in sorted(fields):
+            positions = fields[field_id]
+            encode_varint(field_id, output)
+            encode_varint(len(positions), output)
+            previous_position = 0
+            for position in positions:
+                encode_varint(position - previous_position, output)
+                previous_position = position
+
+    return bytes(output)
+
+
+def decode_postings(values):
+    postings = {}
+    i = 0
+    page_id = 0
+    while i < len(values):
+        page_id += values[i]
+        field_count = values[i + 1]
+        i += 2
+
+        fields = {}
+        for _ in range(field_count):
+            field_id, position_count = values[i], values[i + 1]
+            i += 2
+            positions = []
+            position = 0
+            for delta in values[i:i + position_count]:
+                position += delta
+                positions.append(position)
+            i += position_count
+            fields[field_id] = positions
+        postings[page_id] = fields
+
+    return postings
+
+
+# Write one segment: a postings file plus a JSON lexicon (term -> offset, length, doc freq) and doc lengths
+def write_segment(folder, name, term_postings, doc_lengths):
+    lexicon = {}
+    with open(os.path.join(folder, f'{name}.postings'), 'wb') as file:
+        offset = 0
+        for term in sorted(term_postings):
+            encoded = encode_postings(term_postings[term])
+            file.write(encoded)
+            lexicon[term] = [offset, len(encoded), len(term_postings[term])]
+            offset += len(encoded)
+
+    with open(os.path.join(folder, f'{name}.json'), 'w', encoding='utf-8') as file:
+        json.dump({'lexicon': lexicon, 'doc_lengths': {str(k): v for k, v in doc_lengths.items()}}, file)
+
+
+# Invert {page_id: {field: text}} into term postings
+def invert_documents(documents):
+    term_postings = {}
+    doc_lengths = {}
+    for page_id, fields in documents.items():
+        length = 0
+        for field, value in fields.items():
+            field_id = FIELDS.index(field)
+            for position, term in enumerate(tokenize(value)):
+                term_postings.setdefault(term, {}).setdefault(page_id, {}).setdefault(field_id, []).append(position)
+                length += 1
+        doc_lengths[page_id] = length
+
+    return term_postings, doc_lengths
+
+
+### CLASSES ###
+
+# One immutable segment opened read-only, postings are decoded on demand from a memory map
+class Segment:
+    def __init__(self, folder, name, deleted):
+        self.name = name
+        self.deleted = set(deleted)
+        with open(os.path.join(folder, f'{name}.json'), encoding='utf-8') as file:
+            segment = json.load(file)
+        self.lexicon = segment['lexicon']
+        self.doc_lengths = {int(k): v for k, v in segment['doc_lengths'].items()}
+
+        self._file = open(os.path.join(folder, f'{name}.postings'), 'rb')
+        size = os.path.getsize(self._file.name)
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+    def postings(self, term):
+        if term not in self.lexicon:
+            return {}
+        offset, length, _ = self.lexicon[term]
+        postings = decode_postings(decode_varints(self._data, offset, offset + length))
+
+        return {page_id: fields for page_id, fields in postings.items() if page_id not in self.deleted}
+
+    def live_documents(self):
+        return {page_id: length for page_id, length in self.doc_lengths.items() if page_id not in self.deleted}
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+# Segmented inverted index over route text. Updates write a new segment and mark the page_ids they
+# replace as deleted in older segments, so nothing already on disk is rewritten until a merge
+class TextIndex:
+    def __init__(self, folder=INDEX_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.manifest = {'next_segment': 0, 'segments': []}
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as file:
+                self.manifest = json.load(file)
+        self.segments = [Segment(folder, entry['name'], entry['deleted']) for entry in self.manifest['segments']]
+        self._refresh_stats()
+
+    def _refresh_stats(self):
+        self.doc_lengths = {}
+        for segment in self.segments:
+            self.doc_lengths.update(segment.live_documents())
+        self.avg_length = (sum(self.doc_lengths.values()) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    def _save_manifest(self):
+        self.manifest['segments'] = [{'name': segment.name, 'deleted': sorted(segment.deleted)}
+                                     for segment in self.segments]
+        temp_path = os.path.join(self.folder, f'{MANIFEST_FILE}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.manifest, file)
+        os.replace(temp_path, os.path.join(self.folder, MANIFEST_FILE))
+
+    def _new_segment_name(self):
+        name = f"segment_{self.manifest['next_segment']:06d}"
+        self.manifest['next_segment'] += 1
+        return name
+
+    # Hide page_ids in every existing segment (re-indexed or no longer have text)
+    def delete_documents(self, page_ids):
+        page_ids = set(page_ids)
+        deleted = 0
+        for segment in self.segments:
+            live = (page_ids & segment.doc_lengths.keys()) - segment.deleted
+            segment.deleted.update(live)
+            deleted += len(live)
+
+        # Nothing on disk changes when none of the pages were indexed, e.g. every segment of a full build
+        if deleted > 0:
+            self._save_manifest()
+            self._refresh_stats()
+
+    # Index {page_id: {field: text}} as a new segment, replacing any earlier versions of those pages
+    def add_documents(self, documents, replaced_page_ids=()):
+        self.delete_documents(set(documents) | set(replaced_page_ids))
+        if len(documents) == 0:
+            return
+
+        term_postings, doc_lengths = invert_documents(documents)
+        name = self._new_segment_name()
+        write_segment(self.folder, name, term_postings, doc_lengths)
+        self.segments.append(Segment(self.folder, name, []))
+        self._save_manifest()
+
+        # Only the new segment's lengths are added, the older segments are unchanged since delete_documents
+        self.doc_lengths.update(doc_lengths)
+        self.avg_length = sum(self.doc_lengths.values()) / len(self.doc_lengths)
+        logging.info(f'Wrote {name} with {len(documents)} routes and {len(term_postings)} terms')
+
+    # Postings for one term across all segments (segments never share a live page_id)
+    def postings(self, term):
+        merged = {}
+        for segment in self.segments:
+            merged.update(segment.postings(term))
+        return merged
+
+    # Rewrite all live postings into a single segment, one term at a time
+    def merge(self):
+        if len(self.segments) <= 1:
+            return
+
+        terms = sorted(set().union(*(segment.lexicon.keys() for segment in self.segments)))
+        name = self._new_segment_name()
+        lexicon = {}
+        with open(os.path.join(self.folder, f'{name}.postings'), 'wb') as file:
+            offset = 0
+            for term in terms:
+                postings = self.postings(term)
+                if len(postings) == 0:
+                    continue
+                encoded = encode_postings(postings)
+                file.write(encoded)
+                lexicon[term] = [offset, len(encoded), len(postings)]
+                offset += len(encoded)
+
+        with open(os.path.join(self.folder, f'{name}.json'), 'w', encoding='utf-8') as file:
+            json.dump({'lexicon': lexicon, 'doc_lengths': {str(k): v for k, v in self.doc_lengths.items()}}, file)
+
+        old_segments = self.segments
+        self.segments = [Segment(self.folder, name, [])]
+        self._save_manifest()
+        for segment in old_segments:
+            segment.close()
+            os.remove(os.path.join(self.folder, f'{segment.name}.postings'))
+            os.remove(os.path.join(self.folder, f'{segment.name}.json'))
+        self._refresh_stats()
+        logging.info(f'Merged {len(old_segments)} segments into {name}')
+
+    # Occurrences of a phrase per page, counting positions where every term follows the previous one
+    def _phrase_matches(self, terms, field_ids):
+        term_postings = [self.postings(term) for term in terms]
+        pages = set(term_postings[0])
+        for postings in term_postings[1:]:
+            pages &= postings.keys()
+
+        matches = {}
+        for page_id in pages:
+            count = 0
+            for field_id in field_ids:
+                position_sets = [set(postings[page_id].get(field_id, ())) for postings in term_postings]
+                count += sum(1 for start in position_sets[0]
+                             if all(start + offset in position_sets[offset] for offset in range(1, len(terms))))
+            if count > 0:
+                matches[page_id] = count
+
+        return matches
+
+    # Ranked lookup. Quoted text is matched as a phrase; every term and phrase must appear unless
+    # require_all is False. Returns [(page_id, score)] best first
+    def search(self, query, limit=20, fields=None, require_all=True):
+        field_ids = [FIELDS.index(field) for field in (fields or FIELDS)]
+        phrases = [tokenize(phrase) for phrase in PHRASE_PATTERN.findall(query)]
+        words = tokenize(PHRASE_PATTERN.sub(' ', query))
+
+        # Each clause maps page_id -> term frequency in the requested fields
+        clauses = []
+        for phrase in phrases:
+            if len(phrase) > 0:
+                clauses.append(self._phrase_matches(phrase, field_ids))
+        for word in dict.fromkeys(words):
+            frequencies = {}
+            for page_id, page_fields in self.postings(word).items():
+                count = sum(len(page_fields.get(field_id, ())) for field_id in field_ids)
+                if count > 0:
+                    frequencies[page_id] = count
+            clauses.append(frequencies)
+
+        if len(clauses) == 0:
+            return []
+
+        candidates = set(clauses[0])
+        for clause in clauses[1:]:
+            candidates = candidates & clause.keys() if require_all else candidates | clause.keys()
+
+        # BM25 over the combined text of the route
+        doc_count = len(self.doc_lengths)
+        scores = {}
+        for clause in clauses:
+            idf = math.log(1 + (doc_count - len(clause) + 0.5) / (len(clause) + 0.5))
+            for page_id in candidates & clause.keys():
+                frequency = clause[page_id]
+                length_ratio = self.doc_lengths.get(page_id, 0) / self.avg_length if self.avg_length else 0
+                scores[page_id] = scores.get(page_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (
+                    frequency + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+### FUNCTIONS ###
+
+# Read the text for a set of page_ids (or a page_id range) as {page_id: {field: text}}
+def get_documents(conn, page_ids=None, low=None, high=None):
+    try:
+        documents = {}
+        for field, table_name in TEXT_TABLES.items():
+            if page_ids is not None:
+                query = text(f'SELECT page_id, title, text FROM {table_name} WHERE page_id IN :page_ids').bindparams(
+                    bindparam('page_ids', expanding=True))
+                df = pd.read_sql(query, conn, params={'page_ids': list(page_ids)})
+            else:
+                query = text(f'SELECT page_id, title, text FROM {table_name} WHERE page_id BETWEEN :low AND :high')
+                df = pd.read_sql(query, conn, params={'low': low, 'high': high})
+
+            for row in df.itertuples(index=False):
+                page_text = f'{row.title or ""} {row.text or ""}'
+                fields = documents.setdefault(int(row.page_id), {})
+                fields[field] = f'{fields[field]} {page_text}' if field in fields else page_text
+
+        return documents
+
+    except Exception as e:
+        logging.error(f'Error getting route text: {e}', exc_info=True)
+        raise
+
+
+# Rebuild the whole index, one segment per SEGMENT_SIZE routes, then merge them. Segments follow keyset
+# pages of route page_ids rather than fixed-width id ranges, which are mostly empty over the sparse ids
+def build_index(conn, folder=INDEX_FOLDER):
+    for file_name in os.listdir(folder) if os.path.exists(folder) else []:
+        os.remove(os.path.join(folder, file_name))
+
+    index = TextIndex(folder)
+    page_query = text('SELECT page_id FROM mp_route_info WHERE page_id > :after ORDER BY page_id LIMIT :limit')
+    after = -1
+    while True:
+        page_ids = [row[0] for row in conn.execute(page_query, {'after': after, 'limit': SEGMENT_SIZE})]
+        if len(page_ids) == 0:
+            break
+        index.add_documents(get_documents(conn, low=page_ids[0], high=page_ids[-1]))
+        after = page_ids[-1]
+    index.merge()
+    logging.info(f'Built text index over {len(index.doc_lengths)} routes at {datetime.datetime.now()}')
+
+    return index
+
+
+# Re-index just the page_ids whose text changed
+def update_index(conn, page_ids, folder=INDEX_FOLDER):
+    index = TextIndex(folder)
+    page_ids = list(page_ids)
+    if len(page_ids) > 0:
+        index.add_documents(get_documents(conn, page_ids=page_ids), replaced_page_ids=page_ids)
+    if len(index.segments) > MAX_SEGMENTS:
+        index.merge()
+    logging.info(f'Updated text index for {len(page_ids)} routes at {datetime.datetime.now()}')
+
+    return index
+
+
+# Main execution, page_ids limits the run to a change set. Returns the page_ids that were indexed
+def main(page_ids=None):
+    setup_logging()
+    changed_page_ids = set()
+
+    try:
+        with database.connect_to_db() as conn:
+            if page_ids is None:
+                index = build_index(conn)
+                changed_page_ids.update(index.doc_lengths)
+            else:
+                index = update_index(conn, page_ids)
+                changed_page_ids.update(page_ids)
+            index.close()
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+        raise
+
+    return changed_page_ids
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import os
+import logging
+import datetime
+import pandas as pd
+from sqlalchemy import text, bindparam
+import Database as database
+
+### CONFIGURATION ###
+
+# Log Folder
+LOG_FOLDER = 'log_files'
+LOG_FILENAME = f'Logfile - Tick Analytics ({datetime.date.today()}).log'
+
+# Width of the page_id range aggregated at a time on a full rebuild, and page_ids per IN list on an
+# incremental one. Peak memory is one range's ticks
+CHUNK_SIZE = 20000
+PAGE_ID_BATCH = 1000
+
+# Style values are cut to the key length, missing ones are stored as ''
+STYLE_LENGTH = 50
+
+# Per-route, per-month tick totals and the style/leadStyle mix behind them. A tick's month comes from
+# the date climbed, or when it was logged if the climber left the date out
+ANALYTICS_TABLE_QUERIES = ["""
+    CREATE TABLE IF NOT EXISTS tick_monthly (
+        page_id INT,
+        month DATE,
+        ticks INT UNSIGNED,
+        climbers INT UNSIGNED,
+        pitches INT UNSIGNED,
+        PRIMARY KEY (page_id, month),
+        INDEX month_idx (month)
+    )
+""", """
+    CREATE TABLE IF NOT EXISTS tick_style_monthly (
+        page_id INT,
+        month DATE,
+        style VARCHAR(50),
+        leadStyle VARCHAR(50),
+        ticks INT UNSIGNED,
+        PRIMARY KEY (page_id, month, style, leadStyle),
+        INDEX style_idx (style, leadStyle)
+    )
+"""]
+ANALYTICS_TABLES = ['tick_monthly', 'tick_style_monthly']
+
+TICK_COLUMNS = 'page_id, user_id, date, createdAt, style, leadStyle, pitches'
+
+
+### FUNCTIONS ###
+
+# Initialize the logging system (debug, info, warning, error, and critical)
+def setup_logging():
+    try:
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        log_file = os.path.join(LOG_FOLDER, LOG_FILENAME)
+        logging.basicConfig(filename=log_file, level=logging.INFO,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        logging.info(f'Log file created/accessed at {datetime.datetime.now()}')
+
+    except Exception as e:
+        print(f'Error creating log folder: {e}')
+
+
+# Create the analytics tables
+def create_tables(conn):
+    try:
+        for query in ANALYTICS_TABLE_QUERIES:
+            conn.execute(text(query))
+        conn.commit()
+
+    except Exception as e:
+        logging.error(f'Error creating tick analytics tables: {e}', exc_info=True)
+        raise
+
+
+# Read the columns the cube needs for a page_id range or a list of page_ids
+def get_ticks(conn, low=None, high=None, page_ids=None):
+    try:
+        if page_ids is not None:
+            query = text(f'SELECT {TICK_COLUMNS} FROM stats_ticks WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            return pd.read_sql(query, conn, params={'page_ids': list(page_ids)})
+
+        query = text(f'SELECT {TICK_COLUMNS} FROM stats_ticks WHERE page_id BETWEEN :low AND :high')
+        return pd.read_sql(query, conn, params={'low': low, 'high': high})
+
+    except Exception as e:
+        logging.error(f'Error getting ticks from database: {e}', exc_info=True)
+        raise
+
+
+# Group a frame of ticks into the monthly totals and the style mix, in one pass each
+def aggregate_ticks(ticks):
+    climbed = pd.to_datetime(ticks['date'], errors='coerce', format='mixed')
+    logged = pd.to_datetime(ticks['createdAt'], errors='coerce', format='mixed')
+    months = climbed.fillna(logged).dt.to_period('M').dt.to_timestamp()
+
+    ticks = ticks.assign(month=months.dt.date,
+                         style=ticks['style'].fillna('').astype(str).str.slice(0, STYLE_LENGTH),
+                         leadStyle=ticks['leadStyle'].fillna('').astype(str).str.slice(0, STYLE_LENGTH))
+    undated = ticks['month'].isna()
+    if undated.any():
+        logging.info(f'Skipped {undated.sum()} ticks with no date')
+        ticks = ticks[~undated]
+
+    monthly = (ticks.groupby(['page_id', 'month'])
+               .agg(ticks=('page_id', 'size'), climbers=('user_id', 'nunique'), pitches=('pitches', 'sum'))
+               .reset_index())
+    styles = (ticks.groupby(['page_id', 'month', 'style', 'leadStyle'])
+              .size().rename('ticks').reset_index())
+
+    return {'tick_monthly': monthly, 'tick_style_monthly': styles}
+
+
+# Swap in the aggregates for a page_id range or a list of page_ids in one transaction
+def replace_aggregates(conn, aggregates, low=None, high=None, page_ids=None):
+    try:
+        for table_name in ANALYTICS_TABLES:
+            if page_ids is not None:
+                delete_query = text(f'DELETE FROM {table_name} WHERE page_id IN :page_ids').bindparams(
+                    bindparam('page_ids', expanding=True))
+                conn.execute(delete_query, {'page_ids': list(page_ids)})
+            else:
+                conn.execute(text(f'DELETE FROM {table_name} WHERE page_id BETWEEN :low AND :high'),
+                             {'low': low, 'high': high})
+            database.insert_frame(aggregates[table_name], table_name, conn)
+
+        conn.commit()
+
+    except Exception as e:
+        logging.error(f'Error replacing tick aggregates: {e}', exc_info=True)
+        conn.rollback()
+        raise
+
+
+# Rebuild every route, one page_id range at a time. The range covers routes that have lost all
+# their ticks as well, so their old aggregates are cleared
+def rebuild_all(conn):
+    bounds = conn.execute(text("""
+        SELECT MIN(low), MAX(high) FROM (
+            SELECT MIN(page_id) AS low, MAX(page_id) AS high FROM stats_ticks
+            UNION ALL SELECT MIN(page_id), MAX(page_id) FROM tick_monthly
+        ) b
+    """)).fetchone()
+    page_ids = set()
+    if bounds[0] is None:
+        return page_ids
+
+    for low in range(bounds[0], bounds[1] + 1, CHUNK_SIZE):
+        high = low + CHUNK_SIZE - 1
+        ticks = get_ticks(conn, low=low, high=high)
+        replace_aggregates(conn, aggregate_ticks(ticks), low=low, high=high)
+        page_ids.update(ticks['page_id'].tolist())
+
+    return page_ids
+
+
+# Rebuild just the routes in a change set
+def update_routes(conn, page_ids):
+    page_ids = sorted(page_ids)
+    for i in range(0, len(page_ids), PAGE_ID_BATCH):
+        batch = page_ids[i:i + PAGE_ID_BATCH]
+        replace_aggregates(conn, aggregate_ticks(get_ticks(conn, page_ids=batch)), page_ids=batch)
+
+    return set(page_ids)
+
+
+# Main execution, page_ids limits the run to a change set. Returns the page_ids whose aggregates were rebuilt
+def main(page_ids=None):
+    setup_logging()
+    changed_page_ids = set()
+
+    try:
+        with database.connect_to_db() as conn:
+            create_tables(conn)
+
+            if page_ids is None:
+                changed_page_ids.update(rebuild_all(conn))
+            else:
+                changed_page_ids.update(update_routes(conn, page_ids))
+            logging.info(f'Rebuilt tick analytics for {len(changed_page_ids)} routes at {datetime.datetime.now()}')
+
+    except Exception as e:
+        logging.error(f'Error occurred in main function:', exc_info=True)
+        print(f'Error occurred in main function: {e}')
+        raise
+
+    return changed_page_ids
+
+
+### Run ###
+if __name__ == '__main__':
+    main()
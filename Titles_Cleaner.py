@@ -1,10 +1,13 @@
 import os
-import ast
+import json
 import logging
 import datetime
+import multiprocessing
 import pandas as pd
-from decouple import config
-from sqlalchemy import create_engine, text
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import text, bindparam
+import Database as database
 
 ### CONFIGURATION ###
 
@@ -15,13 +18,29 @@ LOG_FILENAME = f'Logfile - Titles Cleanup ({datetime.date.today()}).log'
 # Batch Processing
 BATCH_SIZE = 100000  # Had issues inserting larger df so using batches
 
-# MySQL Database Configuration
-DB_CONFIG = {
-    "host": config('AWS_HOST'),
-    "user": config('AWS_USERNAME'),
-    "password": config('AWS_MASTER_PASSWORD'),
-    "database": config('AWS_DATABASE')
-}
+# Routes read from route_text per chunk, peak memory is bounded by this
+CHUNK_SIZE = 5000
+
+# Worker processes for splitting text (0 or 1 splits in the main process)
+PROCESS_WORKERS = os.cpu_count() or 1
+
+# Chunks in flight per worker, keeps the pool busy without reading far ahead of the writes
+CHUNKS_PER_WORKER = 2
+
+# Text column in route_text -> output table
+TEXT_TABLES = {'description': 'route_descriptions',
+               'protection': 'route_protection',
+               'directions': 'route_directions',
+               'misc': 'route_misc'}
+
+TITLE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        page_id INT,
+        title TEXT,
+        text TEXT,
+        INDEX page_idx (page_id)
+    )
+"""
 
 
 ### FUNCTIONS ###
@@ -39,24 +58,6 @@ def setup_logging():
         print(f'Error creating log file: {e}')
 
 
-# Create MySQL database connection
-def connect_to_db():
-    try:
-        # Create an SQLAlchemy engine
-        engine = create_engine(
-            f"mysql+mysqlconnector://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}")
-
-        # Connect to the engine
-        conn = engine.connect()
-        logging.info(f'Connected to database at {datetime.datetime.now()}')
-
-        return conn
-
-    except Exception as e:
-        logging.error(f'Error connecting to database: {e}', exc_info=True)
-        raise
-
-
 # Drop tables if they exist to enable batch processing with append
 def drop_table(conn):
     try:
@@ -74,113 +75,180 @@ def drop_table(conn):
         raise
 
 
-# Insert data into each table in the database in batches
-def insert_data(conn, table_name, table_data):
+# Create the output tables with an INT page_id index, change sets delete and Text_Index reads by page_id.
+# Tables left by the old to_sql inserts have no index (and a TEXT page_id if their first chunk was empty)
+def create_tables(conn):
     try:
-        # Execute MySQL query in batches
-        for i in range(0, len(table_data), BATCH_SIZE):
-            batch = table_data.iloc[i:i + BATCH_SIZE]
-            batch.to_sql(name=table_name, con=conn.engine,
-                         if_exists='append', index=False)
+        for table_name in TEXT_TABLES.values():
+            conn.execute(text(TITLE_TABLE_QUERY.format(table_name=table_name)))
+
+            has_index = conn.execute(text(f"""
+                SELECT COUNT(*) FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = '{table_name}' AND column_name = 'page_id'
+            """)).fetchone()[0]
+            if has_index == 0:
+                conn.execute(text(f'ALTER TABLE {table_name} MODIFY page_id INT, ADD INDEX page_idx (page_id)'))
+                logging.info(f'Added a page_id index to {table_name}')
+
+        conn.commit()
 
     except Exception as e:
-        logging.error(f'Error occurred while inserting data into {table_name} table: {e}', exc_info=True)
-        conn.rollback()
+        logging.error(f'Error creating title tables: {e}', exc_info=True)
         raise
 
 
-# Grab route urls to process from database (only processes route pages)
-def get_titles(conn):
+# Delete a change set's rows from each table so they can be re-inserted
+def delete_rows(conn, page_ids):
     try:
-        # Execute MySQL query
-        urls_query = """SELECT page_id, description, protection, directions, misc
-                                                            FROM mp_route_info"""
-
-        df = pd.read_sql(urls_query, conn)
-        logging.info(f'Got dataframe with title values at {datetime.datetime.now()}')
+        for table_name in TEXT_TABLES.values():
+            delete_query = text(f'DELETE FROM {table_name} WHERE page_id IN :page_ids').bindparams(
+                bindparam('page_ids', expanding=True))
+            conn.execute(delete_query, {'page_ids': list(page_ids)})
 
-        return df
+        conn.commit()
 
     except Exception as e:
-        logging.error(f'Error getting titles from database: {e}', exc_info=True)
+        logging.error(f'Error deleting rows from title tables: {e}', exc_info=True)
+        conn.rollback()
         raise
 
 
-def process_row(row):
+# Insert data into each table in the database in batches, on their own pooled connection so the writes
+# commit independently of the reading connection. Empty frames are skipped
+def insert_data(table_name, table_data):
     try:
-        # Create output dictionary with titles
-        output_dictionary = {'description': '', 'protection': '', 'directions': '', 'misc': ''}
+        if len(table_data) == 0:
+            return
 
-        for key in output_dictionary:
-            title_list = ast.literal_eval(row.loc[key])
-            output_list = []
-            for title_data in title_list:
-                values = title_data.split(' - ')
-                title_value = values[0].encode('utf-16', 'surrogatepass').decode('utf-16')
-                text_value = " - ".join(values[1:]).encode('utf-16', 'surrogatepass').decode('utf-16')
-                output_list.append((row.loc['page_id'], title_value, text_value))
-            output_dictionary[key] = output_list
+        # Execute MySQL query in batches
+        with database.checkout() as write_conn:
+            for i in range(0, len(table_data), BATCH_SIZE):
+                batch = table_data.iloc[i:i + BATCH_SIZE]
+                database.insert_frame(batch, table_name, write_conn)
 
-        return output_dictionary
+    except Exception as e:
+        logging.error(f'Error occurred while inserting data into {table_name} table: {e}', exc_info=True)
+        raise
+
+
+# Read the text columns from route_text in page_id order, one keyset page of chunk_size routes per query.
+# The MySQL driver buffers each result client-side, so the page size is what bounds memory
+def get_titles(conn, chunk_size=CHUNK_SIZE, page_ids=None):
+    try:
+        if page_ids is not None:
+            urls_query = text("""SELECT page_id, description, protection, directions, misc
+                                 FROM route_text WHERE page_id IN :page_ids ORDER BY page_id""").bindparams(
+                bindparam('page_ids', expanding=True))
+            page_ids = sorted(page_ids)
+            for i in range(0, len(page_ids), chunk_size):
+                yield pd.read_sql(urls_query, conn, params={'page_ids': page_ids[i:i + chunk_size]})
+
+        else:
+            urls_query = text("""SELECT page_id, description, protection, directions, misc
+                                 FROM route_text WHERE page_id > :after ORDER BY page_id LIMIT :limit""")
+            after = -1
+            while True:
+                chunk = pd.read_sql(urls_query, conn, params={'after': after, 'limit': chunk_size})
+                if len(chunk) == 0:
+                    break
+                yield chunk
+                after = int(chunk['page_id'].iloc[-1])
+
+        logging.info(f'Finished reading title values at {datetime.datetime.now()}')
 
     except Exception as e:
-        logging.error(f'Error processing titles: {e}', exc_info=True)
+        logging.error(f'Error getting titles from database: {e}', exc_info=True)
         raise
 
 
-# Main execution
-def main():
-    # Setup logging and connection to database
-    setup_logging()
+# Route_Grabber stores each column as json.dumps of a list of 'title - text' strings
+def decode_titles(value):
+    if value is None:
+        return []
+
+    return json.loads(value)
 
+
+# Split one chunk of routes into (page_id, title, text) rows for each output table
+def process_chunk(chunk_df):
     try:
-        with connect_to_db() as conn:
-            # Delete tables if they exit
-            drop_table(conn)
+        output_dictionary = {key: [] for key in TEXT_TABLES}
+
+        for row in chunk_df.itertuples(index=False):
+            for key, output_list in output_dictionary.items():
+                for title_data in decode_titles(getattr(row, key)):
+                    title_value, _, text_value = title_data.partition(' - ')
+                    output_list.append((row.page_id, title_value, text_value))
 
-            # Get route descriptions
-            title_df = get_titles(conn)
+        return {key: pd.DataFrame(output_list, columns=['page_id', 'title', 'text'])
+                for key, output_list in output_dictionary.items()}
 
-            # Process each row for description, protection, directions, and misc
-            titles_ml = title_df.apply(process_row, axis=1).to_list()
+    except Exception as e:
+        logging.error(f'Error processing titles: {e}', exc_info=True)
+        raise
 
-            # Create empty lists and add the corresponding category data to them
-            description_list = []
-            protection_list = []
-            directions_list = []
-            misc_list = []
 
-            for titles_dict in titles_ml:
-                description_list.extend(titles_dict['description'])
-                protection_list.extend(titles_dict['protection'])
-                directions_list.extend(titles_dict['directions'])
-                misc_list.extend(titles_dict['misc'])
+# Split chunks of routes in a process pool and yield the results in the order the chunks were read.
+# Only PROCESS_WORKERS * CHUNKS_PER_WORKER chunks are held at once so memory stays bounded
+def process_chunks(chunks, workers=PROCESS_WORKERS):
+    if workers <= 1:
+        for chunk_df in chunks:
+            yield len(chunk_df), process_chunk(chunk_df)
+        return
 
-            # Convert the lists to dataframes for output
-            description_df = pd.DataFrame(description_list,
-                                          columns=['page_id', 'title', 'text'])
+    # Spawned children, a forked one can inherit a DB or logging lock held by another Pipeline stage's thread
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = deque()
+        for chunk_df in chunks:
+            pending.append((len(chunk_df), executor.submit(process_chunk, chunk_df)))
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                chunk_size, future = pending.popleft()
+                yield chunk_size, future.result()
 
-            protection_df = pd.DataFrame(protection_list,
-                                         columns=['page_id', 'title', 'text'])
+        while pending:
+            chunk_size, future = pending.popleft()
+            yield chunk_size, future.result()
 
-            directions_df = pd.DataFrame(directions_list,
-                                         columns=['page_id', 'title', 'text'])
 
-            misc_df = pd.DataFrame(misc_list, columns=['page_id', 'title', 'text'])
+# Main execution, page_ids limits the run to a change set. Returns the page_ids that were re-split
+def main(page_ids=None):
+    # Setup logging and connection to database
+    setup_logging()
+    changed_page_ids = set()
 
-            # Insert the data into the MySQL database
-            insert_data(conn, 'route_descriptions', description_df)
-            insert_data(conn, 'route_protection', protection_df)
-            insert_data(conn, 'route_directions', directions_df)
-            insert_data(conn, 'route_misc', misc_df)
+    try:
+        with database.connect_to_db() as conn:
+            # Recreate the tables empty, or just delete the change set's rows
+            if page_ids is None:
+                drop_table(conn)
+            create_tables(conn)
+            if page_ids is not None:
+                delete_rows(conn, page_ids)
+
+            # Split each chunk (in parallel when there are workers) and write them out in page_id order
+            route_count = 0
+            for chunk_size, titles_dict in process_chunks(get_titles(conn, page_ids=page_ids)):
+                for key, table_name in TEXT_TABLES.items():
+                    insert_data(table_name, titles_dict[key])
+                    changed_page_ids.update(titles_dict[key]['page_id'].tolist())
+
+                route_count += chunk_size
+                logging.info(f'Processed titles for {route_count} routes')
+
+            # Routes in the change set that lost all their text changed too
+            if page_ids is not None:
+                changed_page_ids.update(page_ids)
 
     except Exception as e:
         logging.error(f'Error occurred in main function:', exc_info=True)
         print(f'Error occurred in main function: {e}')
+        raise
 
     finally:
         print('Done!')
 
+    return changed_page_ids
+
 
 ### Run ###
 if __name__ == '__main__':
@@ -2,11 +2,12 @@ import os
 import re
 import logging
 import requests
-import mysql.connector
 from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 from datetime import date
+from urllib.parse import urlparse
 from decouple import config
+import Database as database
 
 ### CONFIGURATION ###
 
@@ -30,22 +31,6 @@ def setup_logging():
                         format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-# Create MySQL database connection
-def connect_to_db():
-    try:
-        db_config = dict(host=config('AWS_HOST'), user=config('AWS_USERNAME'), password=config('AWS_MASTER_PASSWORD'),
-                         database=config('AWS_DATABASE'))
-
-        conn = mysql.connector.connect(**db_config)
-
-        return conn
-
-    except Exception as e:
-        logging.error(f'Error connecting to database: {e}')
-
-    return None
-
-
 # Create MySQL table if it doesn't exist
 def create_table(cursor, update):
     try:
@@ -143,7 +128,7 @@ def get_urls(url):
             for url_tag in url_tags:
                 loc_tag = url_tag.find('loc')
                 lastmod_tag = url_tag.find('lastmod')
-                page_id_match = re.search(r'[0-9]+', loc_tag.text)
+                page_id_match = re.search(r'[0-9]+', urlparse(loc_tag.text).path)
 
                 if page_id_match:
                     page_id = page_id_match.group(0)
@@ -164,12 +149,13 @@ def get_urls(url):
     return None
 
 
-# Main execution
+# Main execution, returns the page_ids of the urls that were inserted
 def main():
     setup_logging()
+    changed_page_ids = set()
 
     try:
-        with connect_to_db() as conn:
+        with database.connect_raw() as conn:
             # Create cursor object
             cursor = conn.cursor(buffered=True)
 
@@ -195,16 +181,20 @@ def main():
                     insert_data(cursor, url_list)
 
                     conn.commit()
+                    changed_page_ids.update(int(data['Page ID']) for data in url_list)
                 else:
                     logging.error(f'Got a blank site_data list for batch {i / BATCH_SIZE}')
 
     except Exception as e:
         logging.error(f'Error occurred in main function: {e}')
+        raise
 
     finally:
         cursor.close()
         conn.close()
 
+    return changed_page_ids
+
 
 ### Run ###
 